@@ -1,9 +1,36 @@
-from flask import Flask
-from flask_cors import CORS
+import logging
+from time import perf_counter
 
-def create_app():
+def create_app(eager=None):
+    """
+    Flask app factory. Flask, flask-cors and the API modules are imported here rather than
+    at package import, so tools that only need app.schemas or app.utils stay light. Models
+    load on first use unless `eager` (default: ML_EAGER_LOAD) loads and warms them now.
+    """
+    started = perf_counter()
+    from flask import Flask
+    from flask_cors import CORS
+    from .api import api_bp, init_app, metrics_bp, sensors_bp
+    from .sensors import sensors_enabled
+    imported = perf_counter()
     app = Flask(__name__)
     CORS(app)
-    from .api import api_bp
+    registry = init_app(app, eager)
     app.register_blueprint(api_bp)
-    return app 
\ No newline at end of file
+    app.register_blueprint(metrics_bp)
+    if sensors_enabled():
+        app.register_blueprint(sensors_bp)
+    registry.startup.update(import_s=round(imported - started, 4), create_app_s=round(perf_counter() - started, 4))
+    logging.getLogger(__name__).info("[startup] %s", registry.startup)
+    return app
+
+def create_asgi_app(eager=None):
+    started = perf_counter()
+    # Imported lazily so the WSGI app does not require starlette
+    from .asgi import create_asgi_app as _create_asgi_app
+    imported = perf_counter()
+    app = _create_asgi_app(eager)
+    registry = app.state.registry
+    registry.startup.update(import_s=round(imported - started, 4), create_app_s=round(perf_counter() - started, 4))
+    logging.getLogger(__name__).info("[startup] %s", registry.startup)
+    return app
@@ -1,61 +1,134 @@
-from flask import Blueprint, request, jsonify
-from .models.yield_model import YieldModel
-from .models.irrigation_model import IrrigationModel
-from .utils import validate_yield_input, validate_irrigation_input
+from time import perf_counter
+from flask import Blueprint, Response, current_app, g, request, jsonify
+from . import handlers, metrics
+from .features import RollingStore
+from .registry import ModelRegistry
+from .sensors import SensorHub, sensors_enabled
 
 api_bp = Blueprint("api", __name__, url_prefix="/api")
+metrics_bp = Blueprint("metrics", __name__)
+# Registered only with ML_SENSORS on; sensor state needs a single process (see app/sensors.py)
+sensors_bp = Blueprint("sensors", __name__, url_prefix="/api/sensors")
 
-yield_model = YieldModel()
-irrigation_model = IrrigationModel()
+def init_app(app, eager=None):
+    """
+    Create the prediction cache, rolling store and model registry for `app` (kept in
+    app.extensions["ml_service"]). Models load on first use unless `eager`.
+    """
+    prediction_cache = handlers.make_prediction_cache()
+    registry = ModelRegistry(cache=prediction_cache, rolling=RollingStore(), eager=eager)
+    app.extensions["ml_service"] = {"registry": registry, "cache": prediction_cache,
+                                    "sensors": SensorHub() if sensors_enabled() else None,
+                                    "collectors": metrics.app_collectors(prediction_cache, registry)}
+    return registry
+
+def _registry():
+    return current_app.extensions["ml_service"]["registry"]
+
+@api_bp.before_app_request
+def _start_model_watcher():
+    g.request_start = perf_counter()
+    _registry().ensure_watcher()
+
+@api_bp.after_app_request
+def _record_request(response):
+    start = g.get("request_start")
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.REQUEST_SECONDS.observe(perf_counter() - start, endpoint=endpoint, status=str(response.status_code))
+    return response
+
+def _sensors():
+    return current_app.extensions["ml_service"]["sensors"]
+
+def _respond(result, model=None):
+    payload, status = result
+    if model is None:
+        return jsonify(payload), status
+    with metrics.timed(model, "serialization"):
+        return jsonify(payload), status
+
+def _predict(handler, kind, tag):
+    options, error = handlers.prediction_options(request.args, request.headers.get("Accept-Language"), tag)
+    if error:
+        return _respond(error)
+    data = request.get_json(silent=True)
+    return _respond(handler(_registry().current.routed(kind), data, tag, **options), model=kind)
 
 @api_bp.route("/predict-yield", methods=["POST"])
 def predict_yield():
-    data = request.get_json()
-    print(f"[predict-yield] Incoming data: {data}")
-    valid, errors = validate_yield_input(data)
-    if not valid:
-        print(f"[predict-yield] Invalid input: {errors}")
-        return jsonify({"error": "Invalid input", "details": errors}), 400
-    try:
-        prediction, _, summary = yield_model.predict(data)
-        response = {
-            "prediction": prediction,
-            "summary": summary
-        }
-        print(f"[predict-yield] Outgoing response: {response}")
-        return jsonify(response)
-    except Exception as e:
-        print(f"[predict-yield] Exception: {e}")
-        return jsonify({"error": "Prediction failed", "details": str(e)}), 500
+    return _predict(handlers.predict_single, "yield", "predict-yield")
 
 @api_bp.route("/predict-irrigation", methods=["POST"])
 def predict_irrigation():
-    data = request.get_json()
-    print(f"[predict-irrigation] Incoming data: {data}")
-    valid, errors = validate_irrigation_input(data)
-    if not valid:
-        print(f"[predict-irrigation] Invalid input: {errors}")
-        return jsonify({"error": "Invalid input", "details": errors}), 400
-    try:
-        prediction, _, summary = irrigation_model.predict(data)
-        response = {
-            "prediction": prediction,
-            "summary": summary
-        }
-        print(f"[predict-irrigation] Outgoing response: {response}")
-        return jsonify(response)
-    except Exception as e:
-        print(f"[predict-irrigation] Exception: {e}")
-        return jsonify({"error": "Prediction failed", "details": str(e)}), 500
+    return _predict(handlers.predict_single, "irrigation", "predict-irrigation")
+
+@api_bp.route("/predict-yield/batch", methods=["POST"])
+def predict_yield_batch():
+    return _predict(handlers.predict_batch, "yield", "predict-yield/batch")
+
+@api_bp.route("/predict-irrigation/batch", methods=["POST"])
+def predict_irrigation_batch():
+    return _predict(handlers.predict_batch, "irrigation", "predict-irrigation/batch")
+
+@api_bp.route("/simulate", methods=["POST"])
+def simulate():
+    models = _registry().current
+    data = request.get_json(silent=True)
+    simulation, error = handlers.simulate({"yield": models.routed("yield"), "irrigation": models.routed("irrigation")}, data, "simulate")
+    if error:
+        return _respond(error)
+    return Response(simulation.chunks(), mimetype="application/x-ndjson")
+
+@api_bp.route("/schedule-irrigation", methods=["POST"])
+def schedule_irrigation():
+    models = _registry().current
+    data = request.get_json(silent=True)
+    return _respond(handlers.schedule_irrigation(models.routed("yield"), models.routed("irrigation"), data, "schedule-irrigation"))
 
 @api_bp.route("/reload-models", methods=["POST"])
 def reload_models():
-    global yield_model, irrigation_model
-    try:
-        yield_model = YieldModel()
-        irrigation_model = IrrigationModel()
-        print("[reload-models] Models reloaded from disk.")
-        return jsonify({"status": "success", "message": "Models reloaded."}), 200
-    except Exception as e:
-        print(f"[reload-models] Exception: {e}")
-        return jsonify({"status": "error", "message": str(e)}), 500 
\ No newline at end of file
+    return _respond(handlers.reload_models(_registry(), wait=handlers.is_truthy(request.args.get("wait"))))
+
+@api_bp.route("/models", methods=["GET"])
+def model_status():
+    return _respond(handlers.model_status(_registry()))
+
+@api_bp.route("/ready", methods=["GET"])
+def ready():
+    return _respond(handlers.readiness(_registry()))
+
+@api_bp.route("/drift", methods=["GET"])
+def drift():
+    return _respond(handlers.drift_report(_registry().current))
+
+@sensors_bp.route("/plots", methods=["POST"])
+def sensor_plots():
+    return _respond(handlers.register_sensor_plots(_sensors(), _registry().current, request.get_json(silent=True),
+                                                   "sensors/plots"))
+
+@sensors_bp.route("/readings", methods=["POST"])
+def sensor_readings():
+    return _respond(handlers.ingest_sensor_readings(_sensors(), _registry().current, request.get_data(), request.content_type,
+                                                    "sensors/readings"))
+
+@sensors_bp.route("/predictions", methods=["GET"])
+def sensor_predictions():
+    return _respond(handlers.sensor_events(_sensors(), request.args, "sensors/predictions"))
+
+@sensors_bp.route("/stream", methods=["GET"])
+def sensor_stream():
+    # An endless response would hold one of gunicorn's sync workers for good
+    return _respond(handlers.sensor_stream_unsupported("sensors/stream"))
+
+@sensors_bp.route("/stats", methods=["GET"])
+def sensor_stats():
+    return _respond(handlers.sensor_stats(_sensors(), "sensors/stats"))
+
+@api_bp.route("/cache-stats", methods=["GET"])
+def cache_stats():
+    return jsonify(current_app.extensions["ml_service"]["cache"].stats())
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(current_app.extensions["ml_service"]["collectors"]), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,276 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+import contextlib
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from . import handlers, metrics
+from .batching import MicroBatcher
+from .features import RollingStore
+from .registry import ModelRegistry
+from .sensors import SSE_KEEPALIVE, STREAM_S, SensorHub, sensors_enabled, sse_event
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimingMiddleware:
+    """
+    Records ml_request_duration_seconds per route path and status code.
+    Paths that match no route are labelled "unmatched" to bound label cardinality.
+    """
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            endpoint = scope["path"] if scope["path"] in self.paths else "unmatched"
+            metrics.REQUEST_SECONDS.observe(perf_counter() - start, endpoint=endpoint, status=str(status["code"]))
+
+
+def create_asgi_app(eager=None):
+    """
+    ASGI counterpart of create_app() with the same /api/* contract. Concurrent
+    single-plot requests are micro-batched: they are held for up to ML_BATCH_WINDOW_MS
+    (or until ML_BATCH_MAX_ROWS are waiting) and scored with one predict_batch call.
+    """
+    prediction_cache = handlers.make_prediction_cache()
+    registry = ModelRegistry(cache=prediction_cache, rolling=RollingStore(), eager=eager)
+    executor = ThreadPoolExecutor(max_workers=int(os.environ.get("ML_BATCH_THREADS", "2")), thread_name_prefix="predict")
+    window_ms = float(os.environ.get("ML_BATCH_WINDOW_MS", "2"))
+    max_rows = int(os.environ.get("ML_BATCH_MAX_ROWS", "64"))
+    batchers = {}
+    sensors = SensorHub() if sensors_enabled() else None
+
+    def batcher(kind, interval=None, summary=None):
+        # One batcher per model, interval level and summary locale, created on first use. The model
+        # is looked up when each batch is flushed, so a reload takes effect for the next batch, and
+        # rows are routed to their regional variants per batch.
+        name = kind if interval is None else f"{kind}@{interval}"
+        name = name if summary is None else f"{name}:{summary}"
+        if name not in batchers:
+            batchers[name] = MicroBatcher(
+                lambda rows: registry.current.routed(kind).predict_batch(rows, interval=interval, summary=summary),
+                window_ms, max_rows, executor)
+        return batchers[name]
+
+    collectors = metrics.app_collectors(prediction_cache, registry)
+
+    def respond(result, model=None):
+        payload, status = result
+        if model is None:
+            return JSONResponse(payload, status_code=status)
+        with metrics.timed(model, "serialization"):
+            return JSONResponse(payload, status_code=status)
+
+    async def load(models, *kinds):
+        # A model's first (lazy) load runs on the executor, not the event loop
+        for kind in kinds:
+            if not models.is_loaded(kind):
+                await asyncio.get_running_loop().run_in_executor(executor, models.get, kind)
+        return models
+
+    async def read_json(request):
+        try:
+            return await request.json()
+        except ValueError:
+            return None
+
+    def single(kind, tag):
+        async def endpoint(request):
+            options, error = handlers.prediction_options(request.query_params, request.headers.get("accept-language"), tag)
+            if error:
+                return respond(error)
+            data = await read_json(request)
+            metrics.log_payload(tag, "Incoming data", data)
+            models = await load(registry.current, kind)
+            features, error = handlers.parse_single(models.get(kind), data, tag)
+            if error:
+                return respond(error)
+            try:
+                result = await batcher(kind, **options).submit(features)
+            except Exception as e:
+                logger.exception("[%s] Prediction failed", tag)
+                return respond(({"error": "Prediction failed", "details": str(e)}, 500))
+            return respond(handlers.single_from_batch_result(result, tag, **options), model=kind)
+        return endpoint
+
+    def batch(kind, tag):
+        async def endpoint(request):
+            options, error = handlers.prediction_options(request.query_params, request.headers.get("accept-language"), tag)
+            if error:
+                return respond(error)
+            data = await read_json(request)
+            rows, error = handlers.batch_rows(data, tag)
+            if error:
+                return respond(error)
+            model = (await load(registry.current, kind)).routed(kind)
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(
+                    executor, functools.partial(model.predict_batch, rows, **options))
+            except Exception as e:
+                logger.exception("[%s] Batch prediction failed", tag)
+                return respond(({"error": "Prediction failed", "details": str(e)}, 500))
+            return respond(handlers.batch_response(results, tag, **options), model=kind)
+        return endpoint
+
+    async def simulate(request):
+        data = await read_json(request)
+        models = await load(registry.current, "yield", "irrigation")
+        simulation, error = handlers.simulate({"yield": models.routed("yield"), "irrigation": models.routed("irrigation")}, data, "simulate")
+        if error:
+            return respond(error)
+
+        async def body():
+            # Each chunk is scored on the executor so the event loop keeps serving other requests
+            chunks = simulation.chunks()
+            loop = asyncio.get_running_loop()
+            while True:
+                chunk = await loop.run_in_executor(executor, next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+
+        return StreamingResponse(body(), media_type="application/x-ndjson")
+
+    async def schedule_irrigation(request):
+        data = await read_json(request)
+        models = await load(registry.current, "yield", "irrigation")
+        result = await asyncio.get_running_loop().run_in_executor(
+            executor, handlers.schedule_irrigation, models.routed("yield"), models.routed("irrigation"), data,
+            "schedule-irrigation")
+        return respond(result)
+
+    async def reload_models(request):
+        wait = handlers.is_truthy(request.query_params.get("wait"))
+        if wait:
+            return respond(await asyncio.get_running_loop().run_in_executor(executor, handlers.reload_models, registry, True))
+        return respond(handlers.reload_models(registry, wait=False))
+
+    async def model_status(request):
+        return respond(handlers.model_status(registry))
+
+    async def ready(request):
+        return respond(handlers.readiness(registry))
+
+    async def drift(request):
+        return respond(handlers.drift_report(registry.current))
+
+    async def sensor_plots(request):
+        data = await read_json(request)
+        models = await load(registry.current, "yield", "irrigation")
+        return respond(handlers.register_sensor_plots(sensors, models, data, "sensors/plots"))
+
+    async def sensor_readings(request):
+        body = await request.body()
+        models = registry.current
+        # Parsing, aggregation and re-scoring all run on the executor
+        return respond(await asyncio.get_running_loop().run_in_executor(
+            executor, handlers.ingest_sensor_readings, sensors, models, body, request.headers.get("content-type"),
+            "sensors/readings"))
+
+    async def sensor_predictions(request):
+        return respond(handlers.sensor_events(sensors, request.query_params, "sensors/predictions"))
+
+    async def sensor_stream(request):
+        error = handlers.sensor_state_error("sensors/stream")
+        if error:
+            return respond(error)
+        since, error = handlers.parse_since(request.headers.get("last-event-id", request.query_params.get("since")),
+                                            "sensors/stream")
+        if error:
+            return respond(error)
+
+        async def events(since):
+            idle = 0.0
+            # Bounded, so a stream cannot outlive a worker restart or pin a connection forever
+            deadline = time.monotonic() + STREAM_S
+            while time.monotonic() < deadline and not await request.is_disconnected():
+                batch, since, _ = sensors.events_since(since)
+                for event in batch:
+                    yield sse_event(event)
+                if batch:
+                    idle = 0.0
+                    continue
+                # Polled rather than waiting on the hub's condition, which would block the event loop
+                await asyncio.sleep(0.25)
+                idle += 0.25
+                if idle >= 15:
+                    idle = 0.0
+                    yield SSE_KEEPALIVE
+
+        return StreamingResponse(events(since), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    async def sensor_stats(request):
+        return respond(handlers.sensor_stats(sensors, "sensors/stats"))
+
+    async def cache_stats(request):
+        return JSONResponse(prediction_cache.stats())
+
+    async def batching_stats(request):
+        return JSONResponse({kind: b.stats() for kind, b in batchers.items()})
+
+    async def prometheus_metrics(request):
+        return Response(metrics.render(collectors), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        # Runs in each server worker process, after any fork
+        registry.ensure_watcher()
+        yield
+        executor.shutdown(wait=False)
+
+    routes = [
+        Route("/api/predict-yield", single("yield", "predict-yield"), methods=["POST"]),
+        Route("/api/predict-irrigation", single("irrigation", "predict-irrigation"), methods=["POST"]),
+        Route("/api/predict-yield/batch", batch("yield", "predict-yield/batch"), methods=["POST"]),
+        Route("/api/predict-irrigation/batch", batch("irrigation", "predict-irrigation/batch"), methods=["POST"]),
+        Route("/api/simulate", simulate, methods=["POST"]),
+        Route("/api/schedule-irrigation", schedule_irrigation, methods=["POST"]),
+        Route("/api/reload-models", reload_models, methods=["POST"]),
+        Route("/api/models", model_status, methods=["GET"]),
+        Route("/api/ready", ready, methods=["GET"]),
+        Route("/api/drift", drift, methods=["GET"]),
+        # Left out with ML_SENSORS=0; sensor state needs a single process (see app/sensors.py)
+        *([
+            Route("/api/sensors/plots", sensor_plots, methods=["POST"]),
+            Route("/api/sensors/readings", sensor_readings, methods=["POST"]),
+            Route("/api/sensors/predictions", sensor_predictions, methods=["GET"]),
+            Route("/api/sensors/stream", sensor_stream, methods=["GET"]),
+            Route("/api/sensors/stats", sensor_stats, methods=["GET"]),
+        ] if sensors is not None else []),
+        Route("/api/cache-stats", cache_stats, methods=["GET"]),
+        Route("/api/batching-stats", batching_stats, methods=["GET"]),
+        Route("/metrics", prometheus_metrics, methods=["GET"]),
+    ]
+    app = Starlette(
+        routes=routes,
+        middleware=[
+            Middleware(RequestTimingMiddleware, paths=[route.path for route in routes]),
+            Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        ],
+        lifespan=lifespan,
+    )
+    app.state.registry = registry
+    app.state.sensors = sensors
+    return app
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-row requests on an asyncio loop and scores them together.
+    A batch is flushed when `max_rows` rows are waiting or `max_wait_ms` after the first
+    row arrived, whichever comes first. `predict_batch(rows)` runs in `executor` (a thread
+    pool by default) and must return one result per row, in order.
+    """
+    def __init__(self, predict_batch, max_wait_ms=2.0, max_rows=64, executor=None):
+        self.predict_batch = predict_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_rows = max_rows
+        self.executor = executor
+        self._pending = []
+        self._timer = None
+        self.batches = 0
+        self.rows = 0
+
+    async def submit(self, row):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+        if len(self._pending) >= self.max_rows:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self.batches += 1
+        self.rows += len(batch)
+        loop = asyncio.get_running_loop()
+        task = loop.run_in_executor(self.executor, self.predict_batch, [row for row, _ in batch])
+        task.add_done_callback(lambda done: self._resolve(batch, done))
+
+    @staticmethod
+    def _resolve(batch, done):
+        try:
+            results = done.result()
+        except Exception as e:
+            logging.exception("Micro-batch prediction failed")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_rows": self.max_rows,
+        }
@@ -0,0 +1,297 @@
+"""
+Input drift monitoring against the training distribution.
+
+The trainer writes a reference profile per version (`<name>_profile_<version>.json`, see
+build_profile): for each numeric feature its moments, range and decile bin edges with the
+fraction of training rows per bin, and for each categorical feature its category
+frequencies. The service keeps a DriftMonitor per loaded model that folds every validated
+input row into fixed-size state: Welford mean/variance, min/max and bin counts per numeric
+feature, and per-category counts plus an "unknown" bucket for values the encoder never saw
+(one-hot encoded as all zeros, so they silently score like no category at all).
+
+State lives in two windows of ML_DRIFT_WINDOW_ROWS rows. When the current window fills
+it replaces the previous one, so reports cover the latest one to two windows of traffic
+with memory that does not grow with traffic. Reports compare live bins to the reference
+with PSI (population stability index) and a binned KS statistic.
+"""
+import os
+import math
+import threading
+import numpy as np
+
+PROFILE_FORMAT = 1
+DEFAULT_BINS = 10
+WINDOW_ROWS = int(os.environ.get('ML_DRIFT_WINDOW_ROWS', '10000'))
+# Below this many live rows a feature is reported as "insufficient_data"
+MIN_ROWS = int(os.environ.get('ML_DRIFT_MIN_ROWS', '100'))
+# Common PSI rule of thumb: < 0.1 stable, 0.1-0.25 moderate shift, > 0.25 significant shift
+PSI_WARN = 0.1
+PSI_DRIFT = 0.25
+# Floor on bin fractions, so empty bins do not make PSI infinite
+EPSILON = 1e-4
+# Distinct unseen category values remembered per feature (the rest are only counted)
+MAX_UNKNOWN_VALUES = 20
+# Smaller batches (single-row requests) are buffered and folded in this many rows at a time
+BUFFER_ROWS = 64
+
+
+def _bin_index(edges, values):
+    # Bin i holds values in [edges[i-1], edges[i]); values below edges[0] fall in bin 0
+    return np.searchsorted(edges, values, side='right')
+
+
+def build_profile(numeric, categorical, bins=DEFAULT_BINS, info=None):
+    """
+    Reference profile of the training inputs: `numeric` and `categorical` are DataFrames
+    of the NUMERIC_FEATURES and CATEGORICAL_FEATURES columns of the training rows.
+    """
+    features = {}
+    for name in numeric.columns:
+        values = numeric[name].dropna().to_numpy(dtype=float)
+        # Interior quantile edges; ties (common in small or discrete data) collapse to fewer bins
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1])) if len(values) else np.array([])
+        counts = np.bincount(_bin_index(edges, values), minlength=len(edges) + 1)
+        features[name] = {
+            'count': int(len(values)),
+            'mean': float(values.mean()) if len(values) else None,
+            'std': float(values.std()) if len(values) else None,
+            'min': float(values.min()) if len(values) else None,
+            'max': float(values.max()) if len(values) else None,
+            'edges': edges.tolist(),
+            'fractions': (counts / max(len(values), 1)).tolist(),
+        }
+    categories = {}
+    for name in categorical.columns:
+        frequencies = categorical[name].dropna().astype(str).value_counts(normalize=True).sort_index()
+        categories[name] = {str(k): float(v) for k, v in frequencies.items()}
+    return {
+        'format': PROFILE_FORMAT,
+        'rows': int(len(numeric)),
+        'numeric': features,
+        'categorical': categories,
+        **(info or {}),
+    }
+
+
+def psi(expected, actual):
+    expected = np.maximum(np.asarray(expected, dtype=float), EPSILON)
+    actual = np.maximum(np.asarray(actual, dtype=float), EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def binned_ks(expected, actual):
+    """
+    Largest gap between the reference and live CDFs at the reference bin edges: a lower
+    bound on the two-sample KS statistic that needs only the bin counts.
+    """
+    return float(np.max(np.abs(np.cumsum(expected) - np.cumsum(actual)))) if len(expected) else 0.0
+
+
+def _status(score, n):
+    if n < MIN_ROWS:
+        return 'insufficient_data'
+    return 'drift' if score > PSI_DRIFT else 'warn' if score > PSI_WARN else 'ok'
+
+
+class _Window:
+    """
+    Running statistics for a bounded number of rows.
+    """
+    def __init__(self, n_numeric, n_bins, n_categories):
+        self.rows = 0
+        self.n = np.zeros(n_numeric)
+        self.mean = np.zeros(n_numeric)
+        self.m2 = np.zeros(n_numeric)
+        self.min = np.full(n_numeric, np.inf)
+        self.max = np.full(n_numeric, -np.inf)
+        self.below = np.zeros(n_numeric, dtype=np.int64)
+        self.above = np.zeros(n_numeric, dtype=np.int64)
+        self.bins = np.zeros((n_numeric, n_bins), dtype=np.int64)
+        # Known categories, then one "unknown" bucket
+        self.categories = [np.zeros(k + 1, dtype=np.int64) for k in n_categories]
+        self.unknown_values = [{} for _ in n_categories]
+
+    def merge_moments(self, n, mean, m2):
+        """
+        Combine another set of (count, mean, M2) into this window (Chan et al.'s parallel
+        form of Welford's update).
+        """
+        total = self.n + n
+        delta = mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(total > 0, n / np.maximum(total, 1), 0.0)
+        self.mean = self.mean + delta * ratio
+        self.m2 = self.m2 + m2 + delta ** 2 * self.n * ratio
+        self.n = total
+
+
+class DriftMonitor:
+    """
+    Streaming input statistics for one model version, compared against its training
+    profile. Thread-safe; observe() costs a few vectorized NumPy calls per batch.
+    """
+    def __init__(self, profile, numeric_features, categorical_features, window_rows=WINDOW_ROWS):
+        self.profile = profile
+        self.numeric_features = list(numeric_features)
+        self.categorical_features = list(categorical_features)
+        self.window_rows = window_rows
+        ref = [profile['numeric'][name] for name in self.numeric_features]
+        self.n_bins = [len(r['edges']) + 1 for r in ref]
+        width = max(self.n_bins)
+        # Edges padded with +inf (never reached), so all features are binned with one broadcast comparison
+        self.edges = np.full((len(ref), width - 1), np.inf)
+        for i, r in enumerate(ref):
+            self.edges[i, :len(r['edges'])] = r['edges']
+        self.ref_min = np.array([r['min'] if r['min'] is not None else -np.inf for r in ref])
+        self.ref_max = np.array([r['max'] if r['max'] is not None else np.inf for r in ref])
+        self.known = [sorted(profile['categorical'].get(name, {})) for name in self.categorical_features]
+        self._codes = [{c: i for i, c in enumerate(known)} for known in self.known]
+        self._lock = threading.Lock()
+        self._current = self._new_window()
+        self._previous = None
+        self._pending_numeric, self._pending_categories = [], []
+        self.total_rows = 0
+        self.total_unknown = np.zeros(len(self.categorical_features), dtype=np.int64)
+
+    def _new_window(self):
+        return _Window(len(self.numeric_features), self.edges.shape[1] + 1, [len(k) for k in self.known])
+
+    def observe(self, numeric, categories):
+        """
+        Record a batch of validated rows: n rows of `numeric_features` values and n rows of
+        `categorical_features` values. Batches under BUFFER_ROWS are buffered, so the
+        per-call NumPy overhead is paid once per BUFFER_ROWS single-row requests.
+        """
+        if len(numeric) < BUFFER_ROWS:
+            with self._lock:
+                self._pending_numeric.extend(numeric)
+                self._pending_categories.extend(categories)
+                if len(self._pending_numeric) < BUFFER_ROWS:
+                    return
+                numeric, categories = self._take_pending()
+        self._fold(numeric, categories)
+
+    def _take_pending(self):
+        numeric, categories = self._pending_numeric, self._pending_categories
+        self._pending_numeric, self._pending_categories = [], []
+        return numeric, categories
+
+    def _fold(self, numeric, categories):
+        numeric = np.asarray(numeric, dtype=float)
+        n = len(numeric)
+        if not n:
+            return
+        bins = (numeric[:, :, None] >= self.edges[None, :, :]).sum(axis=2)
+        below = (numeric < self.ref_min).sum(axis=0)
+        above = (numeric > self.ref_max).sum(axis=0)
+        mean = numeric.mean(axis=0)
+        m2 = ((numeric - mean) ** 2).sum(axis=0)
+        codes = [[self._codes[j].get(str(row[j]), len(self.known[j])) for row in categories]
+                 for j in range(len(self.categorical_features))]
+        with self._lock:
+            if self._current.rows >= self.window_rows:
+                self._previous, self._current = self._current, self._new_window()
+            w = self._current
+            w.merge_moments(n, mean, m2)
+            np.minimum(w.min, numeric.min(axis=0), out=w.min)
+            np.maximum(w.max, numeric.max(axis=0), out=w.max)
+            w.below += below
+            w.above += above
+            for i in range(len(self.numeric_features)):
+                w.bins[i] += np.bincount(bins[:, i], minlength=w.bins.shape[1])
+            for j, feature_codes in enumerate(codes):
+                counts = np.bincount(feature_codes, minlength=len(self.known[j]) + 1)
+                w.categories[j] += counts
+                unknown = int(counts[-1])
+                if unknown:
+                    self.total_unknown[j] += unknown
+                    seen = w.unknown_values[j]
+                    for row, code in zip(categories, feature_codes):
+                        if code == len(self.known[j]):
+                            value = str(row[j])
+                            if value in seen or len(seen) < MAX_UNKNOWN_VALUES:
+                                seen[value] = seen.get(value, 0) + 1
+            w.rows += n
+            self.total_rows += n
+
+    def _merged(self):
+        # The reported window: previous (if any) plus current
+        merged = self._new_window()
+        for w in (self._previous, self._current):
+            if w is None:
+                continue
+            merged.rows += w.rows
+            merged.merge_moments(w.n, w.mean, w.m2)
+            merged.min = np.minimum(merged.min, w.min)
+            merged.max = np.maximum(merged.max, w.max)
+            merged.below += w.below
+            merged.above += w.above
+            merged.bins += w.bins
+            for j in range(len(self.categorical_features)):
+                merged.categories[j] += w.categories[j]
+                for value, count in w.unknown_values[j].items():
+                    merged.unknown_values[j][value] = merged.unknown_values[j].get(value, 0) + count
+        return merged
+
+    def report(self):
+        """
+        Per-feature drift of the recent window against the training profile.
+        """
+        with self._lock:
+            pending = self._take_pending()
+        self._fold(*pending)
+        with self._lock:
+            w = self._merged()
+            total_rows = self.total_rows
+            total_unknown = self.total_unknown.copy()
+        rows = w.rows
+        numeric = {}
+        for i, name in enumerate(self.numeric_features):
+            ref = self.profile['numeric'][name]
+            k = self.n_bins[i]
+            live = w.bins[i, :k] / rows if rows else np.zeros(k)
+            score = psi(ref['fractions'], live) if rows else None
+            std = math.sqrt(w.m2[i] / w.n[i]) if w.n[i] else None
+            numeric[name] = {
+                'psi': score,
+                'ks': binned_ks(ref['fractions'], live) if rows else None,
+                'status': _status(score or 0.0, rows),
+                'mean': float(w.mean[i]) if rows else None,
+                'std': std,
+                'min': float(w.min[i]) if rows else None,
+                'max': float(w.max[i]) if rows else None,
+                'reference': {key: ref[key] for key in ('mean', 'std', 'min', 'max')},
+                'mean_shift_std': (float(w.mean[i]) - ref['mean']) / ref['std'] if rows and ref['std'] else None,
+                'below_reference_min': int(w.below[i]),
+                'above_reference_max': int(w.above[i]),
+            }
+        categorical = {}
+        for j, name in enumerate(self.categorical_features):
+            ref = self.profile['categorical'].get(name, {})
+            counts = w.categories[j]
+            expected = [ref[c] for c in self.known[j]] + [0.0]
+            live = counts / rows if rows else np.zeros(len(counts))
+            score = psi(expected, live) if rows else None
+            unknown = int(counts[-1])
+            categorical[name] = {
+                'psi': score,
+                # Unseen categories are one-hot encoded as all zeros, so any share of them is flagged
+                'status': 'drift' if unknown and rows >= MIN_ROWS else _status(score or 0.0, rows),
+                'frequencies': {c: float(f) for c, f in zip(self.known[j], live[:-1])},
+                'reference': ref,
+                'unknown_rows': unknown,
+                'unknown_fraction': float(live[-1]) if rows else 0.0,
+                'unknown_values': dict(sorted(w.unknown_values[j].items(), key=lambda kv: -kv[1])),
+                'unknown_rows_total': int(total_unknown[j]),
+            }
+        statuses = [f['status'] for f in (*numeric.values(), *categorical.values())]
+        status = next((s for s in ('drift', 'warn', 'insufficient_data') if s in statuses), 'ok')
+        return {
+            'status': status,
+            'rows': rows,
+            'rows_total': total_rows,
+            'window_rows': self.window_rows,
+            'reference_rows': self.profile['rows'],
+            'numeric': numeric,
+            'categorical': categorical,
+        }
@@ -0,0 +1,147 @@
+"""
+Per-plot rolling weather features (rainfall_7d, temperature_7d).
+
+A rolling value is the mean of a plot's last WINDOW readings, ordered by timestamp and
+including the current one. Both paths fold readings through the same per-plot window
+(`PlotWindow`): training replays every plot's readings in timestamp order
+(`add_rolling_features`), and serving keeps one window per plot (`RollingStore`), so each
+request costs O(WINDOW) regardless of how much history a plot has. Rows without a plot_id
+or timestamp fall back to the instantaneous values in both paths.
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+from datetime import timezone
+
+WINDOW = 7
+# Rolling feature -> source reading
+ROLLING_FEATURES = {'rainfall_7d': 'rainfall', 'temperature_7d': 'temperature'}
+SOURCES = tuple(ROLLING_FEATURES.values())
+
+
+def window_means(readings):
+    """
+    Mean of each source over a window of readings (tuples ordered like SOURCES).
+    """
+    n = len(readings)
+    return tuple(sum(column) / n for column in zip(*readings))
+
+
+class PlotWindow:
+    """
+    The last `window` readings of one plot, newest last, and the timestamp of the newest.
+    """
+    __slots__ = ('readings', 'last_ts')
+
+    def __init__(self, window=WINDOW):
+        self.readings = deque(maxlen=window)
+        self.last_ts = None
+
+    def push(self, values, ts=None):
+        """
+        Store a reading newer than every stored one and return the window's means.
+        """
+        self.readings.append(values)
+        self.last_ts = ts
+        return window_means(self.readings)
+
+    def peek(self, values):
+        """
+        Means for a reading scored against the stored window without storing it: the
+        newest `window` - 1 readings plus this one.
+        """
+        window = self.readings.maxlen
+        return window_means(list(self.readings)[1 - window:] + [values] if window > 1 else [values])
+
+
+def add_rolling_features(df, window=WINDOW):
+    """
+    Add the rolling columns to a training frame. Readings are grouped by plot_id and replayed
+    in timestamp order through a PlotWindow, as serving sees them; the frame's own order is kept.
+    """
+    # Imported on first use: training needs pandas, the service does not
+    import pandas as pd
+    df = df.copy()
+    for feature, source in ROLLING_FEATURES.items():
+        df[feature] = df[source].astype('float64')
+    if 'plot_id' not in df.columns or 'timestamp' not in df.columns:
+        return df
+    timestamps = pd.to_datetime(df['timestamp'])
+    mask = (df['plot_id'].notna() & timestamps.notna()).to_numpy()
+    if not mask.any():
+        return df
+    keyed = df.loc[mask, list(SOURCES)].astype('float64')
+    keyed['_plot'] = df.loc[mask, 'plot_id'].astype(str).to_numpy()
+    keyed['_ts'] = timestamps[mask].to_numpy()
+    keyed = keyed.sort_values(['_plot', '_ts'], kind='stable')
+    rolled = []
+    plot_window, previous = None, None
+    for plot, ts, values in zip(keyed['_plot'].tolist(), keyed['_ts'].to_numpy().view('int64').tolist(),
+                                zip(*(keyed[source].tolist() for source in SOURCES))):
+        if plot != previous:
+            plot_window, previous = PlotWindow(window), plot
+        # A repeated timestamp is scored against the stored window, as RollingStore does
+        rolled.append(window_means(plot_window.readings) if ts == plot_window.last_ts else plot_window.push(values, ts))
+    rolled = pd.DataFrame(rolled, index=keyed.index, columns=list(ROLLING_FEATURES))
+    for feature in ROLLING_FEATURES:
+        df.loc[rolled.index, feature] = rolled[feature].to_numpy()
+    return df
+
+
+def _epoch(timestamp):
+    # Naive timestamps are taken as UTC, as pandas does when training
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+class RollingStore:
+    """
+    Last WINDOW readings per plot for serving, bounded to `max_plots` plots (least recently
+    seen plots are dropped first). Thread-safe; shared by the yield and irrigation models
+    and kept across model reloads.
+    """
+    def __init__(self, window=WINDOW, max_plots=None):
+        if max_plots is None:
+            max_plots = int(os.environ.get('ML_ROLLING_MAX_PLOTS', '100000'))
+        self.window = window
+        self.max_plots = max_plots
+        self._plots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, plot_id, timestamp, values):
+        """
+        Return the rolling means (one per entry of `values`, ordered like SOURCES) for a reading.
+        The reading is stored only if it is newer than the plot's latest one. A repeat of the
+        latest timestamp returns the stored window; an older reading is scored against the
+        latest window without changing it.
+        """
+        ts = _epoch(timestamp)
+        values = tuple(float(v) for v in values)
+        with self._lock:
+            plot = self._plots.get(plot_id)
+            if plot is None:
+                plot = self._plots[plot_id] = PlotWindow(self.window)
+                if len(self._plots) > self.max_plots:
+                    self._plots.popitem(last=False)
+            else:
+                self._plots.move_to_end(plot_id)
+            if plot.last_ts is None or ts > plot.last_ts:
+                return plot.push(values, ts)
+            if ts == plot.last_ts:
+                return window_means(plot.readings)
+            return plot.peek(values)
+
+    def rolling_values(self, features):
+        """
+        Rolling values for one validated input, or the instantaneous readings when the input
+        has no plot_id or timestamp.
+        """
+        values = tuple(getattr(features, source) for source in SOURCES)
+        if features.plot_id is None or features.timestamp is None:
+            return values
+        return self.observe(features.plot_id, features.timestamp, values)
+
+    def stats(self):
+        with self._lock:
+            return {"plots": len(self._plots), "max_plots": self.max_plots, "window": self.window}
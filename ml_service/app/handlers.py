@@ -0,0 +1,365 @@
+"""
+Request handling shared by the Flask blueprint (api.py) and the ASGI app (asgi.py).
+Every handler takes already-parsed JSON and returns (payload, status).
+"""
+import os
+import logging
+from .cache import PredictionCache
+from .metrics import log_payload
+from .models.uncertainty import parse_level
+from .optimizer import MAX_PLOTS, optimize
+from .schemas import parse_schedule
+from .sensors import MAX_BODY_BYTES, claim_sensor_state, parse_binary, parse_ndjson
+from .simulation import parse_simulation
+from .summaries import DEFAULT_LOCALE, resolve_locale
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 5000
+
+
+def make_prediction_cache():
+    # ML_CACHE_SIZE=0 disables caching; ML_CACHE_TTL is in seconds (unset: entries live until evicted or reloaded)
+    return PredictionCache(
+        maxsize=int(os.environ.get("ML_CACHE_SIZE", "4096")),
+        ttl=float(os.environ["ML_CACHE_TTL"]) if os.environ.get("ML_CACHE_TTL") else None,
+    )
+
+
+def parse_single(model, data, tag):
+    """
+    Validate a single-plot request once, against the model's schema.
+    Returns (typed_input, None) or (None, (payload, status)) on error.
+    """
+    if not isinstance(data, dict):
+        logger.info("[%s] Invalid input: expected a JSON object", tag)
+        return None, ({"error": "Invalid input", "details": ["Expected a JSON object"]}, 400)
+    features, errors = model.parse(data)
+    if errors:
+        logger.info("[%s] Invalid input: %s", tag, errors)
+        return None, ({"error": "Invalid input", "details": errors}, 400)
+    return features, None
+
+
+def prediction_options(args, accept_language, tag):
+    """
+    Parse the prediction query parameters: the opt-in `interval` (see
+    app/models/uncertainty.py), `include_summary` (default true) and the summary `locale`
+    (falling back to the Accept-Language header, see app/summaries.py).
+    Returns ({"interval", "summary"}, None), where "summary" is the locale or None to skip
+    summaries, or (None, (payload, status)) on error.
+    """
+    level, error = parse_level(args.get("interval"))
+    locale = None
+    if not error and is_truthy(args.get("include_summary", "true")):
+        locale, error = resolve_locale(args.get("locale"), accept_language)
+    if error:
+        logger.info("[%s] Invalid input: %s", tag, error)
+        return None, ({"error": "Invalid input", "details": [error]}, 400)
+    return {"interval": level, "summary": locale}, None
+
+
+def predict_single(model, data, tag, interval=None, summary=DEFAULT_LOCALE):
+    log_payload(tag, "Incoming data", data)
+    features, error = parse_single(model, data, tag)
+    if error:
+        return error
+    try:
+        prediction, bound, text = model.predict(features, interval=interval, summary=summary)
+        response = {"prediction": prediction}
+        if summary is not None:
+            response["summary"] = text
+        if interval:
+            response["interval"] = bound
+        log_payload(tag, "Outgoing response", response)
+        return response, 200
+    except Exception as e:
+        logger.exception("[%s] Prediction failed", tag)
+        return {"error": "Prediction failed", "details": str(e)}, 500
+
+
+def single_from_batch_result(result, tag, interval=None, summary=DEFAULT_LOCALE):
+    """
+    Turn one `predict_batch` entry into the single-plot endpoint response.
+    """
+    if "errors" in result:
+        logger.info("[%s] Invalid input: %s", tag, result["errors"])
+        return {"error": "Invalid input", "details": result["errors"]}, 400
+    response = {"prediction": result["prediction"]}
+    if summary is not None:
+        response["summary"] = result["summary"]
+    if interval:
+        response["interval"] = result["interval"]
+    log_payload(tag, "Outgoing response", response)
+    return response, 200
+
+
+def batch_rows(data, tag):
+    """
+    Extract the list of plots from a batch request body.
+    Returns (rows, None) or (None, (payload, status)) on error.
+    """
+    rows = data.get("plots") if isinstance(data, dict) else data
+    if not isinstance(rows, list):
+        logger.info("[%s] Invalid input: expected a list of plots", tag)
+        return None, ({"error": "Invalid input", "details": ["Expected a JSON list of plots or an object with a 'plots' list"]}, 400)
+    if len(rows) > MAX_BATCH_SIZE:
+        return None, ({"error": "Batch too large", "details": [f"At most {MAX_BATCH_SIZE} plots per request"]}, 413)
+    logger.debug("[%s] Incoming batch of %d plots", tag, len(rows))
+    log_payload(tag, "Incoming batch", rows)
+    return rows, None
+
+
+def batch_response(results, tag, interval=None, summary=DEFAULT_LOCALE):
+    items = []
+    failed = 0
+    for i, result in enumerate(results):
+        if "errors" in result:
+            failed += 1
+            items.append({"index": i, "error": "Invalid input", "details": result["errors"]})
+            continue
+        item = {"index": i, "prediction": result["prediction"]}
+        if interval:
+            item["interval"] = result["interval"]
+        if summary is not None:
+            item["summary"] = result["summary"]
+        items.append(item)
+    logger.debug("[%s] Scored %d/%d plots", tag, len(items) - failed, len(items))
+    return {"results": items, "count": len(items), "failed": failed}, 200
+
+
+def predict_batch(model, data, tag, interval=None, summary=DEFAULT_LOCALE):
+    rows, error = batch_rows(data, tag)
+    if error:
+        return error
+    try:
+        results = model.predict_batch(rows, interval=interval, summary=summary)
+    except Exception as e:
+        logger.exception("[%s] Batch prediction failed", tag)
+        return {"error": "Prediction failed", "details": str(e)}, 500
+    return batch_response(results, tag, interval, summary)
+
+
+def simulate(models, data, tag):
+    """
+    Validate a simulation request (see app/simulation.py). Returns (simulation, None), where
+    `simulation.chunks()` yields the NDJSON body, or (None, (payload, status)) on error.
+    """
+    log_payload(tag, "Incoming data", data)
+    simulation, error = parse_simulation(models, data)
+    if error:
+        logger.info("[%s] Rejected: %s", tag, error[0]["details"])
+        return None, error
+    logger.debug("[%s] Simulating %d combinations", tag, simulation.total)
+    return simulation, None
+
+
+def schedule_irrigation(yield_model, irrigation_model, data, tag):
+    """
+    Plan irrigation per plot and day under a water budget (see app/optimizer.py).
+    """
+    log_payload(tag, "Incoming data", data)
+    if not isinstance(data, dict):
+        return {"error": "Invalid input", "details": ["Expected a JSON object"]}, 400
+    plots = data.get("plots")
+    if isinstance(plots, list) and len(plots) > MAX_PLOTS:
+        return {"error": "Too many plots", "details": [f"At most {MAX_PLOTS} plots per request"]}, 413
+    request, errors = parse_schedule(data, irrigation_model.valid_crops, irrigation_model.valid_soil_types)
+    if not errors:
+        n_days = len(request.forecast)
+        errors = [f"plots[{i}].forecast: expected {n_days} days" for i, p in enumerate(request.plots)
+                  if p.forecast is not None and len(p.forecast) != n_days]
+    if errors:
+        logger.info("[%s] Invalid input: %s", tag, errors)
+        return {"error": "Invalid input", "details": errors}, 400
+    try:
+        schedule = optimize(request, yield_model, irrigation_model)
+    except Exception as e:
+        logger.exception("[%s] Scheduling failed", tag)
+        return {"error": "Scheduling failed", "details": str(e)}, 500
+    amounts, water = schedule.amounts.round(2), schedule.water
+    expected = schedule.expected_yield()
+    plots = [
+        {
+            "index": i,
+            "plot_id": p.plot_id,
+            "irrigation_mm": amounts[i].tolist(),
+            "recommended_mm": schedule.recommended[i].round(2).tolist(),
+            "water_liters": float(water[i].sum()),
+            "expected_yield": float(expected[i]),
+            "baseline_yield": float(schedule.baseline[i]),
+        }
+        for i, p in enumerate(request.plots)
+    ]
+    response = {
+        "plots": plots,
+        "water_budget_liters": request.water_budget_liters,
+        "water_used_liters": float(water.sum()),
+        "expected_yield": float(expected.sum()),
+        "baseline_yield": float(schedule.baseline.sum()),
+        "models": {"yield": yield_model.version, "irrigation": irrigation_model.version},
+        "search": schedule.stats,
+    }
+    logger.debug("[%s] Scheduled %d plots x %d days: %s", tag, len(plots), len(request.forecast), schedule.stats)
+    return response, 200
+
+
+def reload_models(registry, wait):
+    """
+    Reload models in every worker. This worker loads in the background (or inline with
+    wait=True) and the others pick up the reload signal through their watchers.
+    """
+    try:
+        registry.signal_reload()
+    except OSError as e:
+        logger.warning("[reload-models] Could not signal other workers: %s", e)
+    if wait:
+        if not registry.reload():
+            return {"status": "error", "message": registry.last_error, "worker": registry.status()}, 500
+        logger.info("[reload-models] Models reloaded from disk.")
+        return {"status": "success", "message": "Models reloaded.", "worker": registry.status()}, 200
+    started = registry.reload_async()
+    message = "Model reload started." if started else "Model reload already in progress."
+    logger.info("[reload-models] %s", message)
+    return {"status": "accepted", "message": message, "worker": registry.status()}, 202
+
+
+def model_status(registry):
+    return {"worker": registry.status(), "workers": registry.worker_statuses()}, 200
+
+
+def readiness(registry):
+    """
+    200 once every model is loaded and warmed, else 503. In lazy mode the first probe
+    starts loading the remaining models in the background.
+    """
+    status = registry.readiness()
+    if not status["ready"]:
+        registry.preload_async()
+    return status, 200 if status["ready"] else 503
+
+
+def drift_report(models):
+    """
+    Input drift of each loaded model and model variant against its training profile (see
+    app/drift.py). Models that have not served a request yet are not loaded for this.
+    """
+    loaded = [(name, models.get(name)) for name in models.versions if models.is_loaded(name)] + models.pool.loaded()
+    report = {}
+    for name, model in loaded:
+        monitor = model.drift
+        report[name] = {"version": model.version, **(monitor.report() if monitor is not None else
+                                                       {"status": "unavailable", "reason": "no training profile for this version"})}
+    return {"models": report}, 200
+
+
+def sensor_state_error(tag):
+    """
+    None if this process holds the sensor state (see app/sensors.py), else a 503 response.
+    """
+    message = claim_sensor_state()
+    if message is None:
+        return None
+    logger.warning("[%s] %s", tag, message)
+    return {"error": "Sensor state unavailable", "details": [message]}, 503
+
+
+def _plot_categories(models, feature):
+    # Plots are scored by both models, so both must know the plot's crop and soil type: the
+    # configured valid values, else the values they were trained on
+    allowed = []
+    for name in ("yield", "irrigation"):
+        model = models.get(name)
+        allowed.append(getattr(model, f"valid_{feature}s") or model.trained_categories(feature))
+    return frozenset.intersection(*allowed)
+
+
+def register_sensor_plots(hub, models, data, tag):
+    error = sensor_state_error(tag)
+    if error:
+        return error
+    rows, error = batch_rows(data, tag)
+    if error:
+        return error
+    stored, errors = hub.register_plots(rows, _plot_categories(models, "crop"), _plot_categories(models, "soil_type"))
+    if errors:
+        logger.info("[%s] Rejected %d plot rows", tag, len(rows) - stored)
+    return {"stored": stored, "rejected": len(rows) - stored, "errors": errors}, 200 if stored or not rows else 400
+
+
+def ingest_sensor_readings(hub, models, body, content_type, tag):
+    """
+    Aggregate a bulk upload of readings (NDJSON, or the binary format of app/sensors.py
+    for application/octet-stream) and re-score the plots whose inputs changed.
+    """
+    error = sensor_state_error(tag)
+    if error:
+        return error
+    if len(body) > MAX_BODY_BYTES:
+        return {"error": "Payload too large", "details": [f"At most {MAX_BODY_BYTES} bytes per request"]}, 413
+    try:
+        if (content_type or "").split(";")[0].strip() == "application/octet-stream":
+            batch = parse_binary(body)
+        else:
+            batch = parse_ndjson(body.decode("utf-8") if isinstance(body, (bytes, bytearray)) else body)
+    except (ValueError, UnicodeDecodeError) as e:
+        logger.info("[%s] Invalid input: %s", tag, e)
+        return {"error": "Invalid input", "details": [str(e)]}, 400
+    touched = hub.ingest(batch)
+    response = {"accepted": len(batch), "ignored": batch.ignored, "rejected": batch.rejected, "errors": batch.errors,
+                "plots_updated": len(touched)}
+    try:
+        events = hub.recompute(models, touched)
+    except Exception as e:
+        # The readings are kept; the plots are re-scored on their next upload
+        logger.exception("[%s] Recompute failed", tag)
+        return {**response, "error": "Prediction failed", "details": str(e)}, 500
+    logger.debug("[%s] %d readings for %d plots, %d re-scored", tag, len(batch), len(touched), len(events))
+    return {**response, "predictions": len(events), "seq": hub.seq}, 200
+
+
+def parse_since(value, tag):
+    """
+    Parse a `since` sequence number (query parameter or Last-Event-ID). Returns (since, error).
+    """
+    try:
+        since = int(value) if value not in (None, "") else 0
+    except ValueError:
+        since = -1
+    if since < 0:
+        logger.info("[%s] Invalid input: since=%r", tag, value)
+        return None, ({"error": "Invalid input", "details": ["since must be a non-negative integer"]}, 400)
+    return since, None
+
+
+def sensor_events(hub, args, tag):
+    error = sensor_state_error(tag)
+    if error:
+        return error
+    since, error = parse_since(args.get("since"), tag)
+    if error:
+        return error
+    try:
+        limit = min(max(int(args.get("limit", "1000")), 1), 10000)
+    except ValueError:
+        return {"error": "Invalid input", "details": ["limit must be an integer"]}, 400
+    events, next_since, reset = hub.events_since(since, limit)
+    return {"events": events, "next": next_since, "reset": reset}, 200
+
+
+def sensor_stats(hub, tag):
+    return sensor_state_error(tag) or (hub.stats(), 200)
+
+
+def sensor_stream_unsupported(tag):
+    """
+    The WSGI app cannot hold SSE connections open without tying up a sync worker, so it
+    points clients at polling or the ASGI app instead.
+    """
+    logger.info("[%s] Streaming requested from the WSGI app", tag)
+    return {"error": "Streaming not supported",
+            "details": ["Poll GET /api/sensors/predictions?since=<next>, or stream from the ASGI app (run_asgi:app)"]}, 501
+
+
+def is_truthy(value):
+    return (value or "").lower() in ("1", "true", "yes")
@@ -0,0 +1,202 @@
+"""
+Per-version artifact manifests.
+
+Each training run writes `<name>_manifest_<version>.json` listing its model, encoder,
+scaler, metrics and training-profile files (and the flat NumPy export, a directory, when
+the model supports it) with SHA-256 checksums and the feature order, then atomically
+repoints `<name>_latest.json` at it. Loaders read the pointer and the manifest, so the
+artifact set is resolved in O(1) and can never mix files from different runs.
+
+Regional and per-crop variants (see app/variants.py) are versioned the same way under their
+own names, e.g. `yield__state_punjab`, and listed in one `<name>_variants.json` index per
+model that the trainer rewrites after exporting them.
+"""
+import os
+import re
+import json
+import glob
+import hashlib
+import logging
+from datetime import datetime
+
+MANIFEST_FORMAT = 1
+VARIANT_INDEX_FORMAT = 1
+ARTIFACT_KINDS = ('model', 'encoder', 'scaler')
+
+
+class ManifestError(RuntimeError):
+    pass
+
+
+def manifest_filename(name, version):
+    return f'{name}_manifest_{version}.json'
+
+
+def latest_filename(name):
+    return f'{name}_latest.json'
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def artifact_sha256(path):
+    """
+    Checksum of an artifact file, or of a directory artifact: the SHA-256 of its sorted
+    file names and their checksums.
+    """
+    if not os.path.isdir(path):
+        return file_sha256(path)
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        h.update(f"{name}:{file_sha256(os.path.join(path, name))}\n".encode())
+    return h.hexdigest()
+
+
+def artifact_size(path):
+    """
+    Size in bytes of an artifact file, or of all files in a directory artifact.
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _write_json_atomic(path, data):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_manifest(model_dir, name, version, files, feature_order, extra=None):
+    """
+    Write the manifest for one trained version and make it the latest.
+    `files` maps artifact kind ('model', 'encoder', 'scaler', 'metrics', ...) to a file name in `model_dir`.
+    Call this only after every listed file is fully written.
+    """
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'name': name,
+        'version': version,
+        'created_at': datetime.now().isoformat(),
+        'feature_order': list(feature_order),
+        'files': {
+            kind: {'path': fname, 'sha256': artifact_sha256(os.path.join(model_dir, fname))}
+            for kind, fname in files.items()
+        },
+    }
+    if extra:
+        manifest.update(extra)
+    _write_json_atomic(os.path.join(model_dir, manifest_filename(name, version)), manifest)
+    _write_json_atomic(os.path.join(model_dir, latest_filename(name)), {
+        'name': name,
+        'version': version,
+        'manifest': manifest_filename(name, version),
+    })
+    return manifest
+
+
+def load_manifest(model_dir, name, version=None):
+    """
+    Return the manifest for `version`, or for the latest version if None.
+    """
+    if version is None:
+        try:
+            with open(os.path.join(model_dir, latest_filename(name))) as f:
+                version = json.load(f)['version']
+        except FileNotFoundError:
+            raise ManifestError(f'No {latest_filename(name)} in {model_dir}; run the trainer or backfill manifests.')
+    try:
+        with open(os.path.join(model_dir, manifest_filename(name, version))) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise ManifestError(f'Manifest for {name} version {version} not found in {model_dir}.')
+    missing = [kind for kind in ARTIFACT_KINDS if kind not in manifest.get('files', {})]
+    if missing:
+        raise ManifestError(f'Manifest for {name} version {version} is missing {missing}.')
+    return manifest
+
+
+def artifact_path(model_dir, manifest, kind):
+    entry = manifest['files'].get(kind)
+    return os.path.join(model_dir, entry['path']) if entry else None
+
+
+def verify_checksums(model_dir, manifest, kinds=None):
+    """
+    Raise ManifestError if any listed artifact (or any of `kinds`) is missing or does not
+    match its checksum.
+    """
+    for kind, entry in manifest['files'].items():
+        if kinds is not None and kind not in kinds:
+            continue
+        path = os.path.join(model_dir, entry['path'])
+        if not os.path.exists(path):
+            raise ManifestError(f"{manifest['name']} {kind} artifact {entry['path']} is missing.")
+        if artifact_sha256(path) != entry['sha256']:
+            raise ManifestError(f"{manifest['name']} {kind} artifact {entry['path']} does not match its checksum.")
+
+
+def variant_index_filename(name):
+    return f'{name}_variants.json'
+
+
+def load_variant_index(model_dir, name):
+    """
+    Return the variant index of model `name`, or an empty one if none was trained.
+    """
+    try:
+        with open(os.path.join(model_dir, variant_index_filename(name))) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return {'format': VARIANT_INDEX_FORMAT, 'name': name, 'updated_at': None, 'variants': []}
+    if index.get('format') != VARIANT_INDEX_FORMAT:
+        raise ManifestError(f"{variant_index_filename(name)} has format {index.get('format')}, expected {VARIANT_INDEX_FORMAT}")
+    return index
+
+
+def write_variant_index(model_dir, name, variants):
+    """
+    Replace the variant index of model `name`. Call this only after every listed variant's
+    manifest is written.
+    """
+    index = {'format': VARIANT_INDEX_FORMAT, 'name': name, 'updated_at': datetime.now().isoformat(), 'variants': list(variants)}
+    _write_json_atomic(os.path.join(model_dir, variant_index_filename(name)), index)
+    return index
+
+
+def backfill_manifests(model_dir, name, numeric_features):
+    """
+    Write a manifest for the newest version that has a complete model/encoder/scaler set,
+    for artifacts trained before manifests existed. Returns the manifest, or None.
+    """
+    from joblib import load
+
+    versions = {}
+    for path in glob.glob(os.path.join(model_dir, f'{name}_*_*')):
+        m = re.fullmatch(rf'{name}_(model|encoder|scaler|metrics)_(\d+)\.(joblib|json)', os.path.basename(path))
+        if m:
+            versions.setdefault(m.group(2), {})[m.group(1)] = os.path.basename(path)
+    complete = sorted(v for v, files in versions.items() if all(k in files for k in ARTIFACT_KINDS))
+    if not complete:
+        logging.warning(f'No complete {name} artifact set to backfill in {model_dir}')
+        return None
+    version = complete[-1]
+    encoder = load(os.path.join(model_dir, versions[version]['encoder']))
+    feature_order = list(numeric_features) + list(encoder.get_feature_names_out(['crop', 'soil_type']))
+    return write_manifest(model_dir, name, version, versions[version], feature_order, extra={'backfilled': True})
+
+
+if __name__ == '__main__':
+    from .models.base import MODEL_DIR, NUMERIC_FEATURES
+    for model_name in ('yield', 'irrigation'):
+        result = backfill_manifests(MODEL_DIR, model_name, NUMERIC_FEATURES)
+        if result:
+            print(f"Wrote {manifest_filename(model_name, result['version'])}")
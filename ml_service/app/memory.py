@@ -0,0 +1,30 @@
+import os
+
+# Fields of /proc/<pid>/smaps_rollup that make up the report, in kB
+_SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def memory_report(pid=None):
+    """
+    Return resident memory for a process split into pages shared with other processes
+    (e.g. copy-on-write pages from the gunicorn master, memory-mapped model arrays)
+    and pages unique to it. Values are in MiB. Returns an empty dict where
+    /proc/<pid>/smaps_rollup is unavailable (non-Linux or kernels before 4.14).
+    """
+    path = f"/proc/{pid or os.getpid()}/smaps_rollup"
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except OSError:
+        return {}
+    kb = {}
+    for line in lines:
+        key, _, rest = line.partition(':')
+        if key in _SMAPS_FIELDS:
+            kb[key] = int(rest.split()[0])
+    return {
+        "rss_mb": round(kb.get('Rss', 0) / 1024, 1),
+        "pss_mb": round(kb.get('Pss', 0) / 1024, 1),
+        "shared_mb": round((kb.get('Shared_Clean', 0) + kb.get('Shared_Dirty', 0)) / 1024, 1),
+        "unique_mb": round((kb.get('Private_Clean', 0) + kb.get('Private_Dirty', 0)) / 1024, 1),
+    }
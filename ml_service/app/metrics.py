@@ -0,0 +1,220 @@
+"""
+Low-overhead in-process metrics rendered in the Prometheus text format at /metrics.
+Metrics are per process; with several gunicorn workers each scrape sees one worker.
+"""
+import os
+import random
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+# Prediction stages are sub-millisecond with the compiled path, so buckets start at 10µs
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, seconds, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        idx = bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][idx] += 1
+            entry[1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "ml_stage_duration_seconds",
+    "Time spent in each prediction stage.",
+    ("model", "stage"),
+)
+REQUEST_SECONDS = Histogram(
+    "ml_request_duration_seconds",
+    "End-to-end request handling time.",
+    ("endpoint", "status"),
+)
+PREDICTIONS = Counter(
+    "ml_predictions_total",
+    "Rows scored, by model version and whether they came from the prediction cache.",
+    ("model", "version", "source"),
+)
+ROUTED_PREDICTIONS = Counter(
+    "ml_routed_predictions_total",
+    "Rows routed to each regional or per-crop model variant (\"global\" for the fallback model).",
+    ("model", "variant"),
+)
+VALIDATION_ERRORS = Counter(
+    "ml_validation_errors_total",
+    "Rows rejected by input validation.",
+    ("model", "version"),
+)
+
+
+@contextmanager
+def timed(model, stage):
+    """
+    Record the duration of the enclosed block in ml_stage_duration_seconds.
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(perf_counter() - start, model=model, stage=stage)
+
+
+def cache_collector(cache):
+    """
+    Collector exposing a PredictionCache's counters and size.
+    """
+    def collect():
+        stats = cache.stats()
+        lines = []
+        for key, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"),
+                          ("expirations", "counter"), ("size", "gauge")):
+            name = f"ml_cache_{key}_total" if kind == "counter" else f"ml_cache_{key}"
+            lines += [f"# HELP {name} Prediction cache {key}.", f"# TYPE {name} {kind}", f"{name} {stats[key]}"]
+        return lines
+    return collect
+
+
+def registry_collector(registry):
+    """
+    Collector exposing the model versions served by a ModelRegistry, their load times and the startup phases.
+    """
+    def collect():
+        models = registry.current
+        lines = ["# HELP ml_model_info Model version currently served by this worker.", "# TYPE ml_model_info gauge"]
+        for model, version in sorted(models.versions.items()):
+            if version is not None:
+                lines.append(f"ml_model_info{_format_labels(('model', 'version'), (model, version))} 1")
+        lines += ["# HELP ml_model_load_seconds Time to load and to warm each served model.", "# TYPE ml_model_load_seconds gauge"]
+        for model, timings in sorted(models.timings.items()):
+            for phase in ("load", "warmup"):
+                lines.append(f"ml_model_load_seconds{_format_labels(('model', 'phase'), (model, phase))} {timings[phase + '_s']}")
+        lines += ["# HELP ml_startup_seconds Duration of each app startup phase in this worker.", "# TYPE ml_startup_seconds gauge"]
+        for phase, seconds in sorted(registry.startup.items()):
+            lines.append(f"ml_startup_seconds{_format_labels(('phase',), (phase.removesuffix('_s'),))} {seconds}")
+        return lines
+    return collect
+
+
+def drift_collector(registry):
+    """
+    Collector exposing input drift of the loaded models and variants against their training profiles (see app/drift.py).
+    """
+    def collect():
+        models = registry.current
+        loaded = [(name, models.get(name)) for name in sorted(models.versions) if models.is_loaded(name)] + models.pool.loaded()
+        reports = {name: model.drift.report() for name, model in loaded if model.drift is not None}
+        lines = ["# HELP ml_feature_psi Population stability index of recent inputs against the training profile.",
+                 "# TYPE ml_feature_psi gauge"]
+        for model, report in reports.items():
+            for feature, stats in (*report["numeric"].items(), *report["categorical"].items()):
+                if stats["psi"] is not None:
+                    lines.append(f"ml_feature_psi{_format_labels(('model', 'feature'), (model, feature))} {stats['psi']}")
+        lines += ["# HELP ml_unknown_category_rows_total Input rows with a category the model was not trained on.",
+                  "# TYPE ml_unknown_category_rows_total counter"]
+        for model, report in reports.items():
+            for feature, stats in report["categorical"].items():
+                lines.append(f"ml_unknown_category_rows_total{_format_labels(('model', 'feature'), (model, feature))} "
+                             f"{stats['unknown_rows_total']}")
+        return lines
+    return collect
+
+
+def app_collectors(cache, registry):
+    """
+    The collectors of one app: callables returning extra exposition lines, read from its
+    prediction cache and model registry. Each app keeps its own list and passes it to
+    `render`, so an app (and its models) is not kept alive by a global list.
+    """
+    return [cache_collector(cache), registry_collector(registry), drift_collector(registry)]
+
+
+def render(collectors=()):
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    for fn in collectors:
+        lines.extend(fn())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_payload_logger = logging.getLogger("ml_service.payloads")
+PAYLOAD_SAMPLE_RATE = float(os.environ.get("ML_PAYLOAD_LOG_SAMPLE_RATE", "0.01"))
+
+
+def log_payload(tag, label, payload):
+    """
+    Log a request or response payload at DEBUG level for a sampled fraction of calls
+    (ML_PAYLOAD_LOG_SAMPLE_RATE). Skipped entirely, including formatting, when DEBUG is off.
+    """
+    if _payload_logger.isEnabledFor(logging.DEBUG) and random.random() < PAYLOAD_SAMPLE_RATE:
+        _payload_logger.debug("[%s] %s: %s", tag, label, payload)
@@ -0,0 +1,476 @@
+import numpy as np
+import os
+import json
+import shutil
+import logging
+from .compiled import CompiledPipeline
+from ..drift import DriftMonitor
+from .uncertainty import AVERAGING_MODELS, bounds, interval_method
+from ..metrics import PREDICTIONS, VALIDATION_ERRORS, timed
+from ..schemas import parse_batch, parse_input
+from ..summaries import DEFAULT_LOCALE, render_summaries
+from ..manifest import ARTIFACT_KINDS, ManifestError, artifact_path, artifact_size, load_manifest, verify_checksums
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), '../../models')
+# Flat, memory-mappable copies of compiled pipelines (see ML_MODEL_LOAD_MODE=mmap)
+FLAT_DIR = os.path.join(MODEL_DIR, 'flat')
+
+# Numeric feature order used by train_yield_irrigation.py, followed by the one-hot crop/soil_type columns.
+NUMERIC_FEATURES = ['rainfall', 'temperature', 'soil_moisture', 'areaSqM', 'rainfall_7d', 'temperature_7d']
+CATEGORICAL_FEATURES = ['crop', 'soil_type']
+
+
+class TabularModel:
+    """
+    Shared loading, feature preparation and prediction for the yield and irrigation wrappers.
+    Subclasses set `name` (which also selects their rules in app/summary_rules.json) and `schema`.
+    With `variant` (an artifact name such as "yield__state_punjab", see app/variants.py) the
+    wrapper serves that regional or per-crop variant instead of the global model.
+    """
+    name = None
+    schema = None
+
+    def __init__(self, valid_crops=None, valid_soil_types=None, compiled=None, load_mode=None, cache=None, rolling=None,
+                 variant=None):
+        self.valid_crops = frozenset(valid_crops) if valid_crops else None
+        self.valid_soil_types = frozenset(valid_soil_types) if valid_soil_types else None
+        self.cache = cache
+        self.rolling = rolling
+        logging.basicConfig(level=logging.INFO)
+        if load_mode is None:
+            load_mode = os.environ.get('ML_MODEL_LOAD_MODE', 'joblib').lower()
+        if compiled is None:
+            compiled = os.environ.get('ML_COMPILED_INFERENCE', '').lower() in ('1', 'true', 'yes')
+        self.model = self.encoder = self.scaler = self.compiled = None
+        self.load_mode = load_mode
+        self.variant = variant
+        self.artifact_name = variant or self.name
+        manifest = self.latest_manifest(variant)
+        self.version = manifest['version']
+        self.feature_order = manifest['feature_order']
+        if load_mode == 'mmap':
+            try:
+                self.compiled = self._load_flat(manifest)
+            except Exception as e:
+                logging.warning(f"{type(self).__name__} mmap loading failed, falling back to joblib: {e}")
+                self.load_mode = 'joblib'
+        if self.compiled is None:
+            self.model, self.encoder, self.scaler = self._load_latest_model(manifest)
+            if compiled:
+                self.compiled = self._compile()
+        self.calibration = self._load_calibration(manifest)
+        self.drift = self._load_drift_monitor(manifest)
+        self._spread = None
+        self.nbytes = self._resident_bytes(manifest)
+        logging.info(f"{type(self).__name__} initialized ({'variant=' + variant + ', ' if variant else ''}version={self.version}, "
+                     f"load_mode={self.load_mode}, compiled={self.compiled is not None}).")
+
+    @classmethod
+    def latest_manifest(cls, variant=None):
+        """
+        Return the manifest of the latest trained version (see app/manifest.py) of the
+        global model, or of `variant`.
+        """
+        return load_manifest(MODEL_DIR, variant or cls.name)
+
+    def _resident_bytes(self, manifest):
+        """
+        Memory accounted to this model: the size of the artifacts it serves from (the
+        unpickled joblib files, or the mapped flat arrays).
+        """
+        if self.model is not None:
+            paths = [artifact_path(MODEL_DIR, manifest, kind) for kind in ARTIFACT_KINDS]
+        elif 'flat' in manifest['files']:
+            paths = [artifact_path(MODEL_DIR, manifest, 'flat')]
+        else:
+            paths = [os.path.join(FLAT_DIR, f"{self.artifact_name}_{self.version}")]
+        return sum(artifact_size(path) for path in paths if os.path.exists(path))
+
+    def _load_latest_model(self, manifest):
+        # Deferred: joblib (and the sklearn classes it unpickles) is only needed when the
+        # artifacts are loaded, not for mmap-loaded flat copies
+        from joblib import load
+        verify_checksums(MODEL_DIR, manifest)
+        model = load(artifact_path(MODEL_DIR, manifest, 'model'))
+        encoder = load(artifact_path(MODEL_DIR, manifest, 'encoder'))
+        scaler = load(artifact_path(MODEL_DIR, manifest, 'scaler'))
+        encoded_names = list(encoder.get_feature_names_out(CATEGORICAL_FEATURES))
+        self._check_feature_order(encoded_names, scaler.n_features_in_, model.n_features_in_)
+        scaler_names = getattr(scaler, 'feature_names_in_', None)
+        if scaler_names is not None and list(scaler_names) != self.feature_order:
+            raise ManifestError(f"{self.artifact_name} version {self.version} scaler was fitted on {list(scaler_names)}")
+        return model, encoder, scaler
+
+    def _check_feature_order(self, encoded_names, *n_features):
+        """
+        Fail fast if the manifest's feature order does not match what this code builds
+        or what the loaded artifacts expect.
+        """
+        expected = NUMERIC_FEATURES + list(encoded_names)
+        if self.feature_order != expected:
+            raise ManifestError(f"{self.artifact_name} version {self.version} feature order {self.feature_order} does not match {expected}")
+        for n in n_features:
+            if n != len(expected):
+                raise ManifestError(f"{self.artifact_name} version {self.version} artifact expects {n} features, manifest lists {len(expected)}")
+
+    def _load_flat(self, manifest):
+        """
+        Memory-map the flat compiled copy of the latest artifacts: the trainer's export when
+        the manifest lists one (no unpickling, no sklearn import), otherwise a copy built from
+        the joblib artifacts on first use. sklearn trees copy their node arrays on unpickle,
+        so joblib's mmap_mode cannot share them between workers; the flat .npy arrays are
+        mapped straight from the page cache.
+        """
+        if 'flat' in manifest['files']:
+            verify_checksums(MODEL_DIR, manifest, kinds=('flat',))
+            pipeline = CompiledPipeline.load(artifact_path(MODEL_DIR, manifest, 'flat'))
+            encoded_names = [f"{col}_{c}" for col, cats in zip(CATEGORICAL_FEATURES, pipeline.categories) for c in cats]
+            self._check_feature_order(encoded_names, pipeline.n_features)
+            return pipeline
+        sources = {kind: manifest['files'][kind] for kind in ARTIFACT_KINDS}
+        flat_path = os.path.join(FLAT_DIR, f"{self.artifact_name}_{self.version}")
+        if os.path.isdir(flat_path):
+            pipeline = CompiledPipeline.load(flat_path)
+            if pipeline.sources == sources and pipeline.averaging is not None:
+                encoded_names = [f"{col}_{c}" for col, cats in zip(CATEGORICAL_FEATURES, pipeline.categories) for c in cats]
+                self._check_feature_order(encoded_names, pipeline.n_features)
+                return pipeline
+            logging.info(f"{type(self).__name__} flat copy at {flat_path} is stale, rebuilding")
+            shutil.rmtree(flat_path, ignore_errors=True)
+        self.model, self.encoder, self.scaler = self._load_latest_model(manifest)
+        compiled = self._compile()
+        if compiled is None:
+            raise RuntimeError('model cannot be compiled')
+        os.makedirs(FLAT_DIR, exist_ok=True)
+        compiled.save(flat_path, sources=sources)
+        self.model = self.encoder = self.scaler = None
+        return CompiledPipeline.load(flat_path)
+
+    def _load_calibration(self, manifest):
+        """
+        Conformal interval calibration from the version's metrics file (see app/models/uncertainty.py),
+        or None for artifacts trained without it.
+        """
+        if 'metrics' not in manifest['files']:
+            return None
+        try:
+            with open(artifact_path(MODEL_DIR, manifest, 'metrics')) as f:
+                return json.load(f).get('conformal')
+        except (OSError, ValueError) as e:
+            logging.warning(f"{type(self).__name__} could not read interval calibration: {e}")
+            return None
+
+    def _load_drift_monitor(self, manifest):
+        """
+        Input drift monitor against the version's training profile (see app/drift.py), or
+        None for artifacts trained without one or when ML_DRIFT_MONITOR=0.
+        """
+        if 'profile' not in manifest['files'] or os.environ.get('ML_DRIFT_MONITOR', '1').lower() in ('0', 'false', 'no'):
+            return None
+        try:
+            verify_checksums(MODEL_DIR, manifest, kinds=('profile',))
+            with open(artifact_path(MODEL_DIR, manifest, 'profile')) as f:
+                return DriftMonitor(json.load(f), NUMERIC_FEATURES, CATEGORICAL_FEATURES)
+        except (OSError, ValueError, KeyError, ManifestError) as e:
+            logging.warning(f"{type(self).__name__} drift monitoring disabled, could not read the training profile: {e}")
+            return None
+
+    def trained_categories(self, feature):
+        """
+        The values of categorical `feature` ('crop' or 'soil_type') the model was trained on.
+        Other values are encoded as all zeros.
+        """
+        i = CATEGORICAL_FEATURES.index(feature)
+        categories = self.compiled.categories[i] if self.compiled is not None else self.encoder.categories_[i]
+        return frozenset(str(c) for c in categories)
+
+    @property
+    def averaging(self):
+        if self.compiled is not None:
+            return self.compiled.averaging
+        return type(self.model).__name__ in AVERAGING_MODELS
+
+    @property
+    def interval_method(self):
+        return interval_method(self.calibration, self.averaging)
+
+    def _spread_pipeline(self):
+        """
+        Node arrays used to read the per-tree spread: the compiled pipeline, or one built (and
+        checked against sklearn) on first use when compiled inference is off. Returns None for
+        non-averaging models.
+        """
+        if not self.averaging:
+            return None
+        if self.compiled is not None:
+            return self.compiled
+        if self._spread is None:
+            pipeline = CompiledPipeline.from_sklearn(self.encoder, self.scaler, self.model, len(NUMERIC_FEATURES))
+            ok, max_err = pipeline.check_parity(self.encoder, self.scaler, self.model)
+            if not ok:
+                logging.warning(f"{type(self).__name__} per-tree spread unavailable (parity error {max_err})")
+            self._spread = pipeline if ok else False
+        return self._spread or None
+
+    def _predict_scaled(self, X_scaled, interval=None):
+        """
+        Predictions for an encoded and scaled matrix, plus the per-tree spread when an
+        interval is requested and the model is an averaging ensemble (else None).
+        """
+        pipeline = self._spread_pipeline() if interval else None
+        if pipeline is not None:
+            if len(X_scaled) == 1:
+                pred, spread = pipeline.predict_scaled_row(X_scaled[0], return_spread=True)
+                return np.array([pred]), np.array([spread])
+            return pipeline.predict_scaled(X_scaled, return_spread=True)
+        if self.compiled is not None:
+            if len(X_scaled) == 1:
+                return np.array([self.compiled.predict_scaled_row(X_scaled[0])]), None
+            return self.compiled.predict_scaled(X_scaled), None
+        return self.model.predict(X_scaled), None
+
+    def _intervals(self, preds, spread, level):
+        """
+        One {"lower", "upper", "level", "method"} dict per prediction at `level`, or None
+        entries when no interval is requested or the model cannot provide one.
+        """
+        method = self.interval_method if level else None
+        if method is None:
+            return [None] * len(preds)
+        lower, upper = bounds(preds, spread, self.calibration, level)
+        return [
+            {"lower": float(lo), "upper": float(hi), "level": level, "method": method}
+            for lo, hi in zip(lower, upper)
+        ]
+
+    def _compile(self):
+        """
+        Build the compiled single-row pipeline and verify it against sklearn.
+        Returns None (sklearn path stays active) if the model is unsupported or parity fails.
+        """
+        try:
+            compiled = CompiledPipeline.from_sklearn(self.encoder, self.scaler, self.model, len(NUMERIC_FEATURES))
+        except (ValueError, AttributeError) as e:
+            logging.warning(f"{type(self).__name__} compiled inference unavailable: {e}")
+            return None
+        ok, max_err = compiled.check_parity(self.encoder, self.scaler, self.model)
+        if not ok:
+            logging.warning(f"{type(self).__name__} compiled inference disabled (parity error {max_err})")
+            return None
+        logging.info(f"{type(self).__name__} compiled inference enabled (parity error {max_err})")
+        return compiled
+
+    def parse(self, features):
+        """
+        Validate and coerce one input row against `schema`. Returns (typed_input, errors).
+        """
+        with timed(self.name, 'validation'):
+            features, errors = parse_input(self.schema, features, self.valid_crops, self.valid_soil_types)
+        if errors:
+            VALIDATION_ERRORS.inc(model=self.name, version=self.version)
+        return features, errors
+
+    def farmer_summaries(self, predictions, rows, locale=DEFAULT_LOCALE):
+        """
+        Farmer-facing summaries for a batch of predictions and their validated inputs (see app/summaries.py).
+        """
+        return render_summaries(self.name, predictions, rows, locale)
+
+    def farmer_summary(self, prediction, features, locale=DEFAULT_LOCALE):
+        return self.farmer_summaries([prediction], [features], locale)[0]
+
+    def predict(self, features, interval=None, summary=DEFAULT_LOCALE):
+        """
+        Predict for one input row (a dict, or an already validated `schema` instance).
+        Returns (prediction, interval, summary). `interval` is a coverage level from
+        uncertainty.LEVELS; the returned interval is None when none was requested or the
+        model cannot provide one. `summary` is the summary's locale, or None to skip it.
+        Predictions are served from `cache` when the same features were scored by the same model version.
+        Each stage is timed in ml_stage_duration_seconds (see app/metrics.py).
+        """
+        features, errors = self.parse(features)
+        if errors:
+            logger.warning("%s input validation failed: %s", type(self).__name__, errors)
+            raise ValueError(f"Input validation failed: {errors}")
+        with timed(self.name, 'features'):
+            numeric = self._numeric_features(features)
+            categories = self._categorical_features(features)
+        if self.drift is not None:
+            with timed(self.name, 'drift'):
+                self.drift.observe([numeric], [categories])
+        key = self._cache_key(numeric, categories, interval)
+        cached = self.cache.get(key) if key is not None else None
+        if cached is not None:
+            PREDICTIONS.inc(model=self.name, version=self.version, source='cache')
+            pred, bound = cached
+        else:
+            with timed(self.name, 'encoding'):
+                X = self._encode(np.array([numeric], dtype=float), [categories])
+            with timed(self.name, 'scaling'):
+                X_scaled = self._scale(X)
+            with timed(self.name, 'predict'):
+                preds, spread = self._predict_scaled(X_scaled, interval)
+                pred = float(preds[0])
+                bound = self._intervals(preds, spread, interval)[0]
+            PREDICTIONS.inc(model=self.name, version=self.version, source='model')
+            if key is not None:
+                self.cache.put(key, (pred, bound))
+        text = None
+        if summary is not None:
+            with timed(self.name, 'summary'):
+                text = self.farmer_summary(pred, features, summary)
+        logger.debug("%s prediction: %s, interval: %s, summary: %s", type(self).__name__, pred, bound, text)
+        return pred, bound, text
+
+    def predict_batch(self, rows, interval=None, summary=DEFAULT_LOCALE):
+        """
+        Predict for a list of input rows (dicts or `schema` instances) with a single
+        encoder, scaler and model call. Returns one entry per row, in order:
+        {"prediction", "interval", "summary"} for valid rows and {"errors": [...]}
+        for rows that failed validation. `interval` and `summary` are as for `predict`;
+        summaries for the whole batch are rendered in one call.
+        """
+        with timed(self.name, 'validation'):
+            inputs, errors = parse_batch(self.schema, rows, self.valid_crops, self.valid_soil_types)
+        results = [None] * len(rows)
+        keys = [None] * len(rows)
+        numeric = [None] * len(rows)
+        categories = [None] * len(rows)
+        todo = []
+        n_invalid = n_cached = 0
+        with timed(self.name, 'features'):
+            # In row order, so readings of one plot within a batch update its rolling window in turn
+            for i, features in enumerate(inputs):
+                if features is not None:
+                    numeric[i] = self._numeric_features(features)
+                    categories[i] = self._categorical_features(features)
+        if self.drift is not None:
+            valid = [i for i, features in enumerate(inputs) if features is not None]
+            if valid:
+                with timed(self.name, 'drift'):
+                    self.drift.observe([numeric[i] for i in valid], [categories[i] for i in valid])
+        for i, features in enumerate(inputs):
+            if features is None:
+                results[i] = {"errors": errors[i]}
+                n_invalid += 1
+                continue
+            keys[i] = self._cache_key(numeric[i], categories[i], interval)
+            if keys[i] is not None:
+                cached = self.cache.get(keys[i])
+                if cached is not None:
+                    pred, bound = cached
+                    results[i] = {"prediction": pred, "interval": bound, "summary": None}
+                    n_cached += 1
+                    continue
+            todo.append(i)
+        if todo:
+            with timed(self.name, 'encoding'):
+                X = self._encode(np.array([numeric[i] for i in todo], dtype=float), [categories[i] for i in todo])
+            with timed(self.name, 'scaling'):
+                X_scaled = self._scale(X)
+            with timed(self.name, 'predict'):
+                preds, spread = self._predict_scaled(X_scaled, interval)
+                intervals = self._intervals(preds, spread, interval)
+            for i, pred, bound in zip(todo, preds.tolist(), intervals):
+                results[i] = {"prediction": pred, "interval": bound, "summary": None}
+                if keys[i] is not None:
+                    self.cache.put(keys[i], (pred, bound))
+        if summary is not None:
+            valid = [i for i, features in enumerate(inputs) if features is not None]
+            if valid:
+                with timed(self.name, 'summary'):
+                    texts = self.farmer_summaries([results[i]["prediction"] for i in valid], [inputs[i] for i in valid], summary)
+                for i, text in zip(valid, texts):
+                    results[i]["summary"] = text
+        if n_invalid:
+            VALIDATION_ERRORS.inc(n_invalid, model=self.name, version=self.version)
+        if n_cached:
+            PREDICTIONS.inc(n_cached, model=self.name, version=self.version, source='cache')
+        if todo:
+            PREDICTIONS.inc(len(todo), model=self.name, version=self.version, source='model')
+        logger.debug("%s batch prediction: %d/%d rows valid, %d scored", type(self).__name__, len(rows) - n_invalid, len(rows), len(todo))
+        return results
+
+    def routes(self, rows):
+        """
+        Routes of `rows` for `score`: None, as this model serves every row itself (see
+        RoutedModel.routes in app/variants.py).
+        """
+        return None
+
+    def score(self, numeric, categories, routes=None):
+        """
+        Predict for an (n, len(NUMERIC_FEATURES)) matrix and n rows of CATEGORICAL_FEATURES
+        values that the caller has already validated (see app/simulation.py). Returns an
+        array of predictions; the cache, rolling store and summaries are not used. `routes`
+        is only used by RoutedModel.
+        """
+        with timed(self.name, 'encoding'):
+            X = self._encode(numeric, categories)
+        with timed(self.name, 'scaling'):
+            X_scaled = self._scale(X)
+        with timed(self.name, 'predict'):
+            if self.compiled is not None:
+                preds = self.compiled.predict_scaled(X_scaled)
+            else:
+                preds = self.model.predict(X_scaled)
+        PREDICTIONS.inc(len(preds), model=self.name, version=self.version, source='model')
+        return preds
+
+    def _encode(self, numeric, categories):
+        """
+        One-hot encode `categories` and append them to the (n, n_numeric) `numeric` matrix.
+        """
+        if self.compiled is not None:
+            return self.compiled.encode_rows(numeric, categories)
+        cat_encoded = self.encoder.transform(np.array(categories, dtype=object))
+        return np.concatenate([numeric, cat_encoded], axis=1)
+
+    def _scale(self, X):
+        if self.compiled is not None:
+            return self.compiled.scale_features(X)
+        return self.scaler.transform(X)
+
+    def _cache_key(self, numeric, categories, interval=None):
+        """
+        Canonical cache key for one validated row: model (or variant) name and version plus the numeric
+        feature vector (coerced floats, so 80, 80.0 and "80" collide, and including the
+        rolling values), categorical values and the requested interval level.
+        Returns None when caching is disabled.
+        """
+        if self.cache is None:
+            return None
+        return (self.artifact_name, self.version, tuple(numeric), tuple(categories), interval)
+
+    def _prepare_features(self, features):
+        # This should match the training script's feature order
+        return self._prepare_features_batch([features])
+
+    def _prepare_features_batch(self, rows):
+        base = np.array([self._numeric_features(r) for r in rows], dtype=float)
+        # Handle unknowns gracefully (encoder uses handle_unknown='ignore')
+        return self._encode(base, [self._categorical_features(r) for r in rows])
+
+    def _numeric_features(self, features):
+        """
+        Numeric feature values in NUMERIC_FEATURES order. The 7-day values come from the
+        plot's recent readings when a `rolling` store is attached and the input has a
+        plot_id and timestamp, and fall back to the current readings otherwise.
+        """
+        if self.rolling is not None:
+            rainfall_7d, temperature_7d = self.rolling.rolling_values(features)
+        else:
+            rainfall_7d, temperature_7d = features.rainfall, features.temperature
+        return [
+            features.rainfall,
+            features.temperature,
+            features.soil_moisture,
+            features.areaSqM,
+            rainfall_7d,
+            temperature_7d,
+        ]
+
+    def _categorical_features(self, features):
+        return [features.crop, features.soil_type]
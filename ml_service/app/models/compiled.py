@@ -0,0 +1,274 @@
+import numpy as np
+import os
+import json
+import shutil
+import logging
+
+# Arrays written by CompiledPipeline.save, one .npy file each
+ARRAY_FIELDS = ['mean', 'scale', 'roots', 'feature', 'threshold', 'left', 'right', 'value']
+# Version of the on-disk layout (meta.json + ARRAY_FIELDS); bump when it changes incompatibly
+FORMAT = 1
+
+
+class CompiledPipeline:
+    """
+    Encoder -> scaler -> tree ensemble pipeline flattened into plain NumPy arrays.
+    Scores rows without calling into sklearn, so a single prediction skips its
+    per-call input validation and dispatch overhead.
+
+    Supports OneHotEncoder (drop=None), StandardScaler, and RandomForest/ExtraTrees,
+    GradientBoosting or single DecisionTree regressors.
+    """
+
+    def __init__(self, categories, n_numeric, mean, scale, roots, feature, threshold, left, right, value, base, weight, depth, averaging=False):
+        self.categories = [list(c) for c in categories]
+        self.n_numeric = n_numeric
+        # One dict per categorical column: category -> column index in the full feature vector
+        self.lookup = []
+        offset = n_numeric
+        for cats in self.categories:
+            self.lookup.append({c: offset + j for j, c in enumerate(cats)})
+            offset += len(cats)
+        self.n_features = offset
+        self.mean = mean
+        self.scale = scale
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.base = base
+        self.weight = weight
+        self.depth = depth
+        # True for RandomForest/ExtraTrees: the prediction is the mean of the trees, so their spread is meaningful
+        self.averaging = averaging
+
+    @classmethod
+    def from_sklearn(cls, encoder, scaler, model, n_numeric):
+        """
+        Build a compiled pipeline from fitted sklearn objects.
+        Raises ValueError if any of them uses an option the compiled path does not replicate.
+        """
+        if getattr(encoder, 'drop_idx_', None) is not None:
+            raise ValueError('OneHotEncoder with drop is not supported')
+        if getattr(encoder, '_infrequent_enabled', False):
+            raise ValueError('OneHotEncoder with infrequent categories is not supported')
+        n_features = n_numeric + sum(len(c) for c in encoder.categories_)
+        mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(n_features)
+        scale = scaler.scale_ if scaler.scale_ is not None else np.ones(n_features)
+        if len(mean) != n_features:
+            raise ValueError(f'Scaler expects {len(mean)} features, encoder produces {n_features}')
+
+        trees, base, weight = _ensemble_trees(model)
+        averaging = type(model).__name__ in ('RandomForestRegressor', 'ExtraTreesRegressor') and len(trees) > 1
+        roots, feature, threshold, left, right, value = [], [], [], [], [], []
+        offset = 0
+        depth = 0
+        for tree in trees:
+            if tree.n_outputs != 1:
+                raise ValueError('Multi-output trees are not supported')
+            n = tree.node_count
+            nodes = np.arange(offset, offset + n)
+            is_leaf = tree.children_left == -1
+            # Leaves point at themselves and always go "left", so every row can be
+            # walked for a fixed number of steps without checking for leaves.
+            roots.append(offset)
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+            left.append(np.where(is_leaf, nodes, tree.children_left + offset))
+            right.append(np.where(is_leaf, nodes, tree.children_right + offset))
+            value.append(tree.value[:, 0, 0])
+            depth = max(depth, tree.max_depth)
+            offset += n
+        return cls(
+            categories=encoder.categories_,
+            n_numeric=n_numeric,
+            mean=np.ascontiguousarray(mean, dtype=np.float64),
+            scale=np.ascontiguousarray(scale, dtype=np.float64),
+            roots=np.array(roots, dtype=np.intp),
+            feature=np.concatenate(feature).astype(np.intp),
+            threshold=np.concatenate(threshold).astype(np.float64),
+            left=np.concatenate(left).astype(np.intp),
+            right=np.concatenate(right).astype(np.intp),
+            value=np.concatenate(value).astype(np.float64),
+            base=float(base),
+            weight=float(weight),
+            depth=int(depth),
+            averaging=averaging,
+        )
+
+    def save(self, path, sources=None, info=None):
+        """
+        Write the pipeline as uncompressed .npy arrays plus meta.json under `path`.
+        The directory is written next to its final location and renamed into place, so
+        concurrent writers (e.g. several workers starting at once) never see a partial copy.
+        `info` is extra provenance for meta.json (model type, parity error, ...).
+        """
+        tmp = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        for field in ARRAY_FIELDS:
+            np.save(os.path.join(tmp, f'{field}.npy'), getattr(self, field))
+        meta = {
+            'format': FORMAT,
+            'categories': self.categories,
+            'n_numeric': self.n_numeric,
+            'base': self.base,
+            'weight': self.weight,
+            'depth': self.depth,
+            'averaging': self.averaging,
+            'sources': sources or {},
+            **(info or {}),
+        }
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Another process finished first; keep its copy
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a pipeline written by `save`. With mmap_mode='r' the node arrays are mapped
+        read-only from the page cache and shared by every process that loads the same files.
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format', 1) > FORMAT:
+            raise ValueError(f"{path} uses flat format {meta['format']}, this code reads up to {FORMAT}")
+        # np.asarray drops the memmap subclass (and its per-index overhead) without copying
+        arrays = {field: np.asarray(np.load(os.path.join(path, f'{field}.npy'), mmap_mode=mmap_mode)) for field in ARRAY_FIELDS}
+        pipeline = cls(
+            categories=meta['categories'],
+            n_numeric=meta['n_numeric'],
+            base=meta['base'],
+            weight=meta['weight'],
+            depth=meta['depth'],
+            # None for copies written before the flag was recorded; callers rebuild those
+            averaging=meta.get('averaging'),
+            **arrays,
+        )
+        pipeline.sources = meta.get('sources', {})
+        return pipeline
+
+    def encode_row(self, numeric, categories):
+        """
+        Build the unscaled feature vector for one row from its numeric values and categorical values.
+        Unknown categories encode to all zeros, like handle_unknown='ignore'.
+        """
+        x = np.zeros(self.n_features)
+        x[:self.n_numeric] = numeric
+        for lookup, value in zip(self.lookup, categories):
+            idx = lookup.get(value)
+            if idx is not None:
+                x[idx] = 1.0
+        return x
+
+    def predict_row(self, numeric, categories):
+        return self.predict_scaled_row(self.scale_features(self.encode_row(numeric, categories)))
+
+    def scale_features(self, X):
+        """
+        StandardScaler transform of an encoded row or matrix.
+        """
+        return (X - self.mean) / self.scale
+
+    def predict_scaled_row(self, x, return_spread=False):
+        """
+        Predict one encoded and scaled row. With return_spread=True, also return the standard
+        deviation of the per-tree predictions (meaningful for averaging ensembles).
+        """
+        # sklearn trees compare float32 inputs against float64 thresholds
+        x = np.asarray(x, dtype=np.float32)
+        node = self.roots
+        for _ in range(self.depth):
+            node = np.where(x[self.feature[node]] <= self.threshold[node], self.left[node], self.right[node])
+        leaves = self.value[node]
+        pred = self.base + self.weight * leaves.sum()
+        if return_spread:
+            return pred, float(leaves.std())
+        return pred
+
+    def encode_rows(self, numeric, categories):
+        """
+        Batch version of `encode_row`: `numeric` is (n, n_numeric), `categories` is n rows of categorical values.
+        """
+        X = np.zeros((len(numeric), self.n_features))
+        X[:, :self.n_numeric] = numeric
+        for j, lookup in enumerate(self.lookup):
+            idx = np.array([lookup.get(row[j], -1) for row in categories], dtype=np.intp)
+            hit = np.nonzero(idx >= 0)[0]
+            X[hit, idx[hit]] = 1.0
+        return X
+
+    def predict_rows(self, numeric, categories):
+        return self.predict_scaled(self.scale_features(self.encode_rows(numeric, categories)))
+
+    def predict_scaled(self, X_scaled, chunk_size=2048, return_spread=False):
+        """
+        Predict for an already encoded and scaled feature matrix. With return_spread=True, also
+        return the per-row standard deviation of the per-tree predictions, taken from the
+        same (rows, trees) leaf matrix as the prediction.
+        """
+        X_scaled = np.asarray(X_scaled, dtype=np.float32)
+        out = np.empty(len(X_scaled))
+        spread = np.empty(len(X_scaled)) if return_spread else None
+        for start in range(0, len(X_scaled), chunk_size):
+            X = X_scaled[start:start + chunk_size]
+            rows = np.arange(len(X))[:, None]
+            node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+            for _ in range(self.depth):
+                node = np.where(X[rows, self.feature[node]] <= self.threshold[node], self.left[node], self.right[node])
+            leaves = self.value[node]
+            out[start:start + len(X)] = self.base + self.weight * leaves.sum(axis=1)
+            if return_spread:
+                spread[start:start + len(X)] = leaves.std(axis=1)
+        if return_spread:
+            return out, spread
+        return out
+
+    def check_parity(self, encoder, scaler, model, n_samples=256, seed=0, tol=1e-6):
+        """
+        Compare compiled predictions against the sklearn pipeline on synthetic rows drawn
+        around the scaler's training mean, including unknown categories.
+        Returns (ok, max_abs_error).
+        """
+        rng = np.random.default_rng(seed)
+        numeric = rng.normal(self.mean[:self.n_numeric], self.scale[:self.n_numeric], size=(n_samples, self.n_numeric))
+        cats = [
+            [cats[j] if j < len(cats) else '__unknown__' for j in rng.integers(0, len(cats) + 1, size=n_samples)]
+            for cats in self.categories
+        ]
+        cat_rows = np.array(list(zip(*cats)), dtype=object)
+        X = np.concatenate([numeric, encoder.transform(cat_rows)], axis=1)
+        expected = model.predict(scaler.transform(X))
+        actual = np.array([self.predict_row(numeric[i], cat_rows[i]) for i in range(n_samples)])
+        max_err = float(np.max(np.abs(expected - actual)))
+        ok = max_err <= tol * max(1.0, float(np.max(np.abs(expected))))
+        if not ok:
+            logging.warning(f"Compiled pipeline parity check failed: max abs error {max_err}")
+        return ok, max_err
+
+
+def _ensemble_trees(model):
+    """
+    Return (trees, base, weight) such that prediction = base + weight * sum(tree leaf values).
+    """
+    name = type(model).__name__
+    if name in ('RandomForestRegressor', 'ExtraTreesRegressor'):
+        trees = [est.tree_ for est in model.estimators_]
+        return trees, 0.0, 1.0 / len(trees)
+    if name == 'GradientBoostingRegressor':
+        if model.init_ == 'zero':
+            base = 0.0
+        elif type(model.init_).__name__ == 'DummyRegressor':
+            base = float(np.ravel(model.init_.constant_)[0])
+        else:
+            raise ValueError(f'Unsupported GradientBoosting init estimator: {type(model.init_).__name__}')
+        trees = [est.tree_ for est in model.estimators_[:, 0]]
+        return trees, base, model.learning_rate
+    if name in ('DecisionTreeRegressor', 'ExtraTreeRegressor'):
+        return [model.tree_], 0.0, 1.0
+    raise ValueError(f'Unsupported model type for compiled inference: {name}')
@@ -0,0 +1,115 @@
+"""
+Prediction intervals for the tree-ensemble models.
+
+For averaging ensembles (RandomForest, ExtraTrees) the spread of a row is the standard
+deviation of the per-tree predictions. At serving time it comes from the same vectorized
+walk over the compiled node arrays that produces the prediction, so it costs one extra
+reduction per row.
+
+Intervals are split-conformal and stored under "conformal" in the version's
+*_metrics_*.json. A full training run calibrates them on a calibration split
+(CALIBRATION_SIZE of the training rows in train_yield_irrigation.py) that neither the
+search nor the choice of model family on the test split sees. An incremental update
+recalibrates on a share of its new rows held out of the update (training/incremental.py).
+Two scores are used:
+
+- "normalized" (averaging ensembles): score = |y - pred| / (spread + epsilon), so the
+  interval pred ± q * (spread + epsilon) is wider where the trees disagree.
+- "absolute" (other models): score = |y - pred|, a constant-width interval pred ± q.
+
+Artifacts trained before calibration existed, and incremental updates with too few new rows
+to calibrate on, fall back to an uncalibrated Gaussian interval pred ± z * spread
+("tree_spread"), or no interval for non-averaging models.
+"""
+import math
+import numpy as np
+
+# Supported coverage levels
+LEVELS = (0.8, 0.9, 0.95)
+DEFAULT_LEVEL = 0.9
+# Two-sided standard normal quantiles for the uncalibrated fallback
+Z = {0.8: 1.2816, 0.9: 1.6449, 0.95: 1.9600}
+AVERAGING_MODELS = ('RandomForestRegressor', 'ExtraTreesRegressor')
+
+
+def tree_spread(model, X):
+    """
+    Standard deviation of the per-tree predictions of a fitted averaging ensemble
+    (training-time helper; serving uses CompiledPipeline.predict_scaled).
+    """
+    per_tree = np.stack([est.predict(X) for est in model.estimators_], axis=1)
+    return per_tree.std(axis=1)
+
+
+def _conformal_quantile(scores, level):
+    # Finite-sample split-conformal quantile: the ceil((n + 1) * level)-th smallest score
+    n = len(scores)
+    k = min(n, math.ceil((n + 1) * level))
+    return float(np.sort(scores)[k - 1])
+
+
+def calibrate(model, X_cal, y_cal, levels=LEVELS):
+    """
+    Conformal calibration of `model` on held-out rows. Returns the dict stored under
+    "conformal" in the metrics file.
+    """
+    y_cal = np.asarray(y_cal, dtype=float)
+    preds = model.predict(X_cal)
+    residuals = np.abs(y_cal - preds)
+    if type(model).__name__ in AVERAGING_MODELS:
+        spread = tree_spread(model, X_cal)
+        epsilon = max(float(spread.mean()) * 0.1, 1e-9)
+        scores = residuals / (spread + epsilon)
+        method = "normalized"
+    else:
+        epsilon = 0.0
+        scores = residuals
+        method = "absolute"
+    return {
+        "method": method,
+        "epsilon": epsilon,
+        "n_calibration": int(len(scores)),
+        "quantiles": {str(level): _conformal_quantile(scores, level) for level in levels},
+    }
+
+
+def interval_method(calibration, averaging):
+    """
+    The interval method a model will use, or None when it cannot produce intervals.
+    """
+    if calibration:
+        if calibration["method"] == "normalized" and not averaging:
+            return None
+        return calibration["method"]
+    return "tree_spread" if averaging else None
+
+
+def bounds(preds, spread, calibration, level):
+    """
+    Lower and upper bounds for `preds` at `level`. `spread` is None for non-averaging models.
+    """
+    preds = np.asarray(preds, dtype=float)
+    if calibration:
+        q = calibration["quantiles"][str(level)]
+        half = q * (spread + calibration["epsilon"]) if calibration["method"] == "normalized" else np.full_like(preds, q)
+    else:
+        half = Z[level] * spread
+    return preds - half, preds + half
+
+
+def parse_level(value):
+    """
+    Interval level from a request option: true/1/yes means the default level, otherwise one
+    of LEVELS. Returns (level or None, error or None).
+    """
+    if value is None or value is False or (isinstance(value, str) and value.lower() in ("", "0", "false", "no")):
+        return None, None
+    if value is True or (isinstance(value, str) and value.lower() in ("1", "true", "yes")):
+        return DEFAULT_LEVEL, None
+    try:
+        level = float(value)
+    except (TypeError, ValueError):
+        level = None
+    if level not in LEVELS:
+        return None, f"interval must be true or one of {sorted(LEVELS)}"
+    return level, None
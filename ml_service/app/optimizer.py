@@ -0,0 +1,298 @@
+"""
+Irrigation scheduling: spread a farm-level water budget over plots and forecast days to
+maximize the total predicted yield.
+
+Model of a schedule:
+
+- Each (plot, day) gets one amount from a small set of candidate levels. By default the
+  levels are fractions of the irrigation model's recommendation for that plot and day.
+- Irrigation counts as extra rainfall on its day. The 7-day features follow the forecast
+  rainfall and temperature (trailing mean over the forecast, as in app/features.py), so
+  each (plot, day) choice is scored independently of the others.
+- A plot's expected yield is the mean of the yield model's predictions over the days.
+  Water is charged in liters: 1 mm on 1 m² is 1 liter.
+
+All candidate rows are built as one matrix. Duplicate rows (plots with the same crop,
+soil, model variants, area and moisture, or levels that coincide) are scored once, so each
+model is called once per unique row, or once per variant when plots route to regional or
+per-crop variants (see app/variants.py). The search is greedy over the upper concave hull
+of each (plot, day) gain curve, followed by a time-bounded local improvement that spends
+any leftover water and tries exchanges between (plot, day) pairs.
+"""
+import os
+import logging
+from time import monotonic
+import numpy as np
+from .features import WINDOW
+from .models.base import CATEGORICAL_FEATURES, NUMERIC_FEATURES
+
+logger = logging.getLogger(__name__)
+
+# Fractions of the recommended amount tried for each (plot, day); 0 is always included
+DEFAULT_FRACTIONS = (0.0, 0.25, 0.5, 0.75, 1.0, 1.5)
+MAX_PLOTS = int(os.environ.get("ML_SCHEDULE_MAX_PLOTS", "10000"))
+TIME_LIMIT = float(os.environ.get("ML_SCHEDULE_TIME_LIMIT", "1.0"))
+# Downgrades tried per exchange round during local improvement
+EXCHANGE_CANDIDATES = 16
+
+
+def trailing_mean(values, window=WINDOW):
+    """
+    Mean of the last `window` values up to and including each position, along the last axis.
+    """
+    csum = np.cumsum(values, axis=-1)
+    shifted = np.zeros_like(csum)
+    shifted[..., window:] = csum[..., :-window]
+    counts = np.minimum(np.arange(1, values.shape[-1] + 1), window)
+    return (csum - shifted) / counts
+
+
+def _mix(x):
+    # splitmix64 finalizer; uint64 arithmetic wraps around
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xbf58476d1ce4e5b9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def score_unique(model, numeric, categories, codes, routes=None):
+    """
+    Score each distinct (numeric, categorical) row once. `codes` holds an integer per row
+    identifying its categorical values and region, and `routes` the model's routes of every
+    row (see RoutedModel.routes). Returns the predictions for all rows and the number of
+    distinct rows scored.
+    """
+    # Rows are matched on a 64-bit hash of their values (like the training-data dedup keys),
+    # which is much cheaper than sorting the rows themselves. + 0.0 folds -0.0 into 0.0.
+    bits = np.ascontiguousarray(numeric, dtype=np.float64) + 0.0
+    keys = _mix(np.asarray(codes, dtype=np.uint64))
+    for column in bits.view(np.uint64).T:
+        keys = _mix(keys ^ _mix(column))
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    if routes is not None:
+        routes = (routes[0], routes[1][first])
+    preds = model.score(numeric[first], categories[first], routes)
+    return preds[inverse.reshape(-1)], len(first)
+
+
+class Schedule:
+    def __init__(self, levels, cost, gain, choice, baseline, recommended, stats):
+        self.levels = levels
+        self.cost = cost
+        self.gain = gain
+        self.choice = choice
+        self.baseline = baseline
+        self.recommended = recommended
+        self.stats = stats
+
+    @property
+    def amounts(self):
+        """
+        Chosen irrigation (mm) per plot and day.
+        """
+        return np.take_along_axis(self.levels, self.choice[..., None], axis=-1)[..., 0]
+
+    @property
+    def water(self):
+        """
+        Liters per plot and day.
+        """
+        return np.take_along_axis(self.cost, self.choice[..., None], axis=-1)[..., 0]
+
+    def expected_yield(self):
+        """
+        Expected yield per plot (kg, mean over days) under this schedule.
+        """
+        gain = np.take_along_axis(self.gain, self.choice[..., None], axis=-1)[..., 0]
+        return self.baseline + gain.sum(axis=1)
+
+
+def _hull_increments(cost, gain):
+    """
+    Steps along the upper concave hull of each item's (cost, gain) curve, starting at level 0.
+    Returns flat arrays (item, to_level, d_cost, d_gain), only for steps that gain.
+    """
+    n, n_levels = cost.shape
+    current = np.zeros(n, dtype=np.intp)
+    items = np.arange(n)
+    steps = []
+    for _ in range(n_levels - 1):
+        d_cost = cost - cost[items, current][:, None]
+        d_gain = gain - gain[items, current][:, None]
+        valid = (d_cost > 0) & (d_gain > 0)
+        slope = np.where(valid, d_gain / np.where(valid, d_cost, 1.0), -np.inf)
+        best = slope.argmax(axis=1)
+        active = np.isfinite(slope[items, best])
+        if not active.any():
+            break
+        idx = items[active]
+        steps.append((idx, best[active], d_cost[idx, best[active]], d_gain[idx, best[active]]))
+        current[active] = best[active]
+    if not steps:
+        empty = np.array([], dtype=np.intp)
+        return empty, empty, np.array([]), np.array([])
+    return tuple(np.concatenate(parts) for parts in zip(*steps))
+
+
+def _greedy(cost, gain, budget):
+    """
+    Take hull steps in decreasing gain per liter while the budget lasts. Steps of one item
+    have decreasing slopes, so this order always extends an item's current level.
+    """
+    choice = np.zeros(cost.shape[0], dtype=np.intp)
+    item, level, d_cost, d_gain = _hull_increments(cost, gain)
+    order = np.argsort(-(d_gain / d_cost), kind="stable")
+    spent = np.cumsum(d_cost[order])
+    taken = order[spent <= budget]
+    # Levels are sorted by cost, so an item ends at the highest level among its taken steps
+    np.maximum.at(choice, item[taken], level[taken])
+    return choice, float(spent[len(taken) - 1]) if len(taken) else 0.0, len(taken)
+
+
+def _best_upgrade(cost, gain, choice, available, exclude=None):
+    """
+    The single level change with the largest gain that costs at most `available` liters.
+    Returns (item, level, d_gain, d_cost) or None.
+    """
+    items = np.arange(len(choice))
+    d_cost = cost - cost[items, choice][:, None]
+    d_gain = gain - gain[items, choice][:, None]
+    feasible = (d_cost <= available + 1e-9) & (d_gain > 1e-12)
+    if exclude is not None:
+        feasible[exclude] = False
+    if not feasible.any():
+        return None
+    flat = np.where(feasible, d_gain, -np.inf).argmax()
+    i, j = divmod(int(flat), cost.shape[1])
+    return i, j, float(d_gain[i, j]), float(d_cost[i, j])
+
+
+def _improve(cost, gain, choice, remaining, deadline):
+    """
+    Local improvement until no move helps or the deadline passes:
+    spend leftover water on the best affordable upgrade, then try freeing water from the
+    cheapest downgrades (least gain lost per liter) and re-spending it elsewhere.
+    Returns (remaining, moves, timed_out).
+    """
+    items = np.arange(len(choice))
+    moves = 0
+    while True:
+        if monotonic() >= deadline:
+            return remaining, moves, True
+        upgrade = _best_upgrade(cost, gain, choice, remaining)
+        if upgrade is not None:
+            i, j, _, d_cost = upgrade
+            choice[i] = j
+            remaining -= d_cost
+            moves += 1
+            continue
+        # Exchange: the downgrade to level 0 of the items with the lowest gain per liter
+        current_cost = cost[items, choice]
+        current_gain = gain[items, choice]
+        funded = np.nonzero(current_cost > 0)[0]
+        if not len(funded):
+            return remaining, moves, False
+        efficiency = current_gain[funded] / current_cost[funded]
+        improved = False
+        for i in funded[np.argsort(efficiency)[:EXCHANGE_CANDIDATES]]:
+            if monotonic() >= deadline:
+                return remaining, moves, True
+            upgrade = _best_upgrade(cost, gain, choice, remaining + current_cost[i], exclude=i)
+            if upgrade is not None and upgrade[2] > current_gain[i] + 1e-9:
+                j, level, _, d_cost = upgrade
+                remaining += current_cost[i] - d_cost
+                choice[i] = 0
+                choice[j] = level
+                moves += 1
+                improved = True
+                break
+        if not improved:
+            return remaining, moves, False
+
+
+def optimize(request, yield_model, irrigation_model, time_limit=None):
+    """
+    Build and solve the schedule for a validated ScheduleRequest (app/schemas.py).
+    Returns a Schedule with arrays shaped (plots, days[, levels]).
+    """
+    started = monotonic()
+    time_limit = request.time_limit or time_limit or TIME_LIMIT
+    plots = request.plots
+    n_plots, n_days = len(plots), len(request.forecast)
+    farm_weather = np.array([[d.rainfall, d.temperature] for d in request.forecast], dtype=float)
+    # (plots, days, 2): rainfall and temperature per plot and day
+    weather = np.array([
+        [[d.rainfall, d.temperature] for d in p.forecast] if p.forecast else farm_weather
+        for p in plots
+    ], dtype=float)
+    rain, temp = weather[..., 0], weather[..., 1]
+    rain_7d, temp_7d = trailing_mean(rain), trailing_mean(temp)
+    static = np.array([[p.soil_moisture, p.areaSqM] for p in plots], dtype=float)
+    moisture = np.broadcast_to(static[:, None, 0], (n_plots, n_days))
+    area = np.broadcast_to(static[:, None, 1], (n_plots, n_days))
+    plot_categories = np.array([[p.crop, p.soil_type] for p in plots], dtype=object)
+    # Plots are routed to model variants once; their rows share the route
+    plot_routes = {'yield': yield_model.routes(plots), 'irrigation': irrigation_model.routes(plots)}
+    route_keys = [routes[1] for routes in plot_routes.values() if routes is not None]
+    # One code per distinct (crop, soil_type, routes), so rows are deduplicated without comparing strings
+    pairs = {}
+    plot_codes = np.array([pairs.setdefault((p.crop, p.soil_type, *(int(k[i]) for k in route_keys)), len(pairs))
+                           for i, p in enumerate(plots)], dtype=np.int64)
+
+    def row_routes(name, shape):
+        routes = plot_routes[name]
+        return None if routes is None else (routes[0], np.broadcast_to(routes[1][:, None, None], shape).reshape(-1))
+
+    def feature_rows(rainfall, shape):
+        # NUMERIC_FEATURES order: rainfall, temperature, soil_moisture, areaSqM, rainfall_7d, temperature_7d
+        columns = {
+            'rainfall': rainfall, 'temperature': temp[..., None], 'soil_moisture': moisture[..., None],
+            'areaSqM': area[..., None], 'rainfall_7d': rain_7d[..., None], 'temperature_7d': temp_7d[..., None],
+        }
+        numeric = np.stack([np.broadcast_to(columns[f], shape) for f in NUMERIC_FEATURES], axis=-1).reshape(-1, len(NUMERIC_FEATURES))
+        categories = np.broadcast_to(plot_categories[:, None, None, :], shape + (len(CATEGORICAL_FEATURES),))
+        codes = np.broadcast_to(plot_codes[:, None, None], shape).reshape(-1)
+        return numeric, categories.reshape(-1, len(CATEGORICAL_FEATURES)), codes
+
+    # Recommendation per (plot, day) without extra water
+    numeric, categories, codes = feature_rows(rain[..., None], (n_plots, n_days, 1))
+    recommended, n_irrigation_rows = score_unique(irrigation_model, numeric, categories, codes,
+                                                  row_routes('irrigation', (n_plots, n_days, 1)))
+    recommended = np.maximum(recommended.reshape(n_plots, n_days), 0.0)
+
+    if request.levels_mm is not None:
+        custom = np.unique([0.0, *request.levels_mm])
+        levels = np.broadcast_to(custom, (n_plots, n_days, len(custom)))
+    else:
+        levels = recommended[..., None] * np.array(DEFAULT_FRACTIONS)
+    levels = np.ascontiguousarray(levels)
+    n_levels = levels.shape[-1]
+    shape = (n_plots, n_days, n_levels)
+
+    numeric, categories, codes = feature_rows(rain[..., None] + levels, shape)
+    predicted, n_yield_rows = score_unique(yield_model, numeric, categories, codes, row_routes('yield', shape))
+    predicted = predicted.reshape(shape) / n_days
+    baseline = predicted[..., 0].sum(axis=1)
+    gain = (predicted - predicted[..., :1]).reshape(-1, n_levels)
+    cost = (levels * area[..., None]).reshape(-1, n_levels)
+    scored = monotonic()
+
+    choice, spent, n_greedy = _greedy(cost, gain, request.water_budget_liters)
+    remaining, n_moves, timed_out = _improve(cost, gain, choice, request.water_budget_liters - spent, scored + time_limit)
+    stats = {
+        "candidate_rows": int(np.prod(shape)) + n_plots * n_days,
+        "unique_rows_scored": int(n_yield_rows + n_irrigation_rows),
+        "levels": n_levels,
+        "greedy_steps": int(n_greedy),
+        "improvement_moves": int(n_moves),
+        "stopped_by_time_limit": bool(timed_out),
+        "scoring_ms": round((scored - started) * 1000, 1),
+        "search_ms": round((monotonic() - scored) * 1000, 1),
+    }
+    logger.debug("Irrigation schedule: %s", stats)
+    return Schedule(
+        levels=levels, cost=cost.reshape(shape), gain=gain.reshape(shape),
+        choice=choice.reshape(n_plots, n_days), baseline=baseline,
+        recommended=recommended, stats=stats,
+    )
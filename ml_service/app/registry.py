@@ -0,0 +1,357 @@
+import os
+import json
+import glob
+import time
+import logging
+import threading
+from time import perf_counter
+from .manifest import ManifestError, load_variant_index
+from .models.base import MODEL_DIR
+from .models.yield_model import YieldModel
+from .models.irrigation_model import IrrigationModel
+from .variants import ModelPool, RoutedModel, VariantRouter, variant_kind, variants_enabled
+
+# Touched by /api/reload-models so every worker's watcher reloads, not just the one that got the request
+RELOAD_SIGNAL = os.path.join(MODEL_DIR, '.reload')
+# One status file per serving process, so any worker can report what all of them serve
+STATUS_DIR = os.path.join(MODEL_DIR, '.workers')
+
+# Plot used to warm freshly loaded models before they take traffic
+WARMUP_PLOT = {
+    "rainfall": 50.0,
+    "temperature": 25.0,
+    "soil_moisture": 40.0,
+    "soil_type": "loam",
+    "crop": "wheat",
+    "areaSqM": 1000.0,
+}
+MODEL_CLASSES = {cls.name: cls for cls in (YieldModel, IrrigationModel)}
+
+
+def eager_load_enabled():
+    # ML_EAGER_LOAD=1 loads and warms every model before the app is returned (the default under gunicorn preload)
+    return os.environ.get('ML_EAGER_LOAD', '').lower() in ('1', 'true', 'yes')
+
+
+class ModelSet:
+    """
+    A yield/irrigation model pair from one artifact set. Request handlers read
+    `registry.current` once and use that pair for the whole request, so a concurrent swap
+    is never half-seen. Each model is loaded and warmed by `loader(name)` on first access,
+    once; concurrent first requests for the same model wait for that load. Regional and
+    per-crop variants listed in the variant indexes are loaded by `variant_loader(variant)`
+    into a bounded pool (see app/variants.py). `on_load(models)` is called after every model
+    or variant load, successful or not.
+    """
+    def __init__(self, loader, variant_loader=None, on_load=None):
+        self._loader = loader
+        self._on_load = on_load
+        self.routers = {}
+        if variant_loader is not None and variants_enabled():
+            for name in MODEL_CLASSES:
+                try:
+                    router = VariantRouter(load_variant_index(MODEL_DIR, name))
+                except (ManifestError, OSError, ValueError, KeyError) as e:
+                    logging.warning(f"[registry] Ignoring the {name} variant index: {e}")
+                    continue
+                if len(router):
+                    self.routers[name] = router
+        self.pool = ModelPool(variant_loader, on_load=self._loaded)
+        self._models = {}
+        self._locks = {name: threading.Lock() for name in MODEL_CLASSES}
+        self.states = {name: "unloaded" for name in MODEL_CLASSES}
+        self.timings = {}
+        self.errors = {}
+        self.loaded_at = time.time()
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is None:
+                self.states[name] = "loading"
+                try:
+                    model, self.timings[name] = self._loader(name)
+                except Exception as e:
+                    self.states[name] = "error"
+                    self.errors[name] = str(e)
+                    self._loaded()
+                    raise
+                self._models[name] = model
+                self.states[name] = "ready"
+                self.errors.pop(name, None)
+                self._loaded()
+        return model
+
+    def _loaded(self):
+        if self._on_load is not None:
+            self._on_load(self)
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def routed(self, name):
+        """
+        Model `name` with requests routed to its variants: the global model itself when it has none.
+        """
+        model = self.get(name)
+        router = self.routers.get(name)
+        return model if router is None else RoutedModel(model, router, self.pool)
+
+    def load_all(self):
+        for name in MODEL_CLASSES:
+            self.get(name)
+
+    @property
+    def yield_model(self):
+        return self.get('yield')
+
+    @property
+    def irrigation_model(self):
+        return self.get('irrigation')
+
+    @property
+    def versions(self):
+        # Versions of the loaded models; None until a model is first used
+        return {name: self._models[name].version if name in self._models else None for name in MODEL_CLASSES}
+
+
+class ModelRegistry:
+    """
+    Holds the model pair currently being served. Models are loaded lazily, on their first
+    request, unless `eager` (default: ML_EAGER_LOAD) loads and warms both up front.
+    Reloads build and warm a new pair in a background thread and then swap a single
+    reference. A watcher thread in each worker polls the artifact directory and reload
+    signal so all gunicorn workers pick up new models.
+    """
+    def __init__(self, cache=None, watch_interval=None, warmup_rows=8, rolling=None, eager=None):
+        self.cache = cache
+        self.rolling = rolling
+        self.warmup_rows = warmup_rows
+        self.eager = eager_load_enabled() if eager is None else eager
+        if watch_interval is None:
+            watch_interval = float(os.environ.get('ML_MODEL_WATCH_INTERVAL', '5'))
+        self.watch_interval = watch_interval
+        self.state = "loading"
+        self.last_error = None
+        # Phase durations in seconds for the startup report; create_app() adds its own phases
+        self.startup = {}
+        self._reload_lock = threading.Lock()
+        self._preload_lock = threading.Lock()
+        self._watcher_pid = None
+        self._fingerprint = self._read_fingerprint()
+        self._current = self._load()
+        self.state = "ready"
+
+    @property
+    def current(self):
+        return self._current
+
+    def _load(self, preload=None):
+        """
+        A new ModelSet for the artifacts on disk. `preload` names the models to load and
+        warm before returning; by default all of them when eager, none otherwise.
+        """
+        models = ModelSet(self._load_model, self._load_variant, on_load=self._models_loaded)
+        for name in (MODEL_CLASSES if self.eager else ()) if preload is None else preload:
+            models.get(name)
+        return models
+
+    def _load_model(self, name, variant=None):
+        started = perf_counter()
+        model = MODEL_CLASSES[name](variant=variant)
+        loaded = perf_counter()
+        # Warm without the cache, rolling store or drift monitor so dummy rows don't pollute them, then attach them for serving
+        drift, model.drift = model.drift, None
+        model.predict(WARMUP_PLOT)
+        model.predict_batch([WARMUP_PLOT] * self.warmup_rows)
+        model.drift = drift
+        model.cache = self.cache
+        model.rolling = self.rolling
+        timings = {"load_s": round(loaded - started, 4), "warmup_s": round(perf_counter() - loaded, 4)}
+        logging.info(f"[{'pool' if variant else 'startup'}] {model.artifact_name} model {model.version} loaded in {timings['load_s']:.3f}s, warmed in {timings['warmup_s']:.3f}s")
+        return model, timings
+
+    def _load_variant(self, variant):
+        return self._load_model(variant_kind(variant), variant)[0]
+
+    def _models_loaded(self, models):
+        # Lazy loads change what this worker serves; a set still being built for a reload is reported after the swap
+        if self._watcher_pid == os.getpid() and models is getattr(self, '_current', None):
+            self._write_status()
+
+    def preload_async(self):
+        """
+        Load and warm every model of the current set in a background thread (used by the
+        readiness probe in lazy mode). Returns False if a preload is already running.
+        """
+        if not self._preload_lock.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                self._current.load_all()
+            except Exception:
+                logging.exception("[registry] Model preload failed")
+            finally:
+                self._preload_lock.release()
+        threading.Thread(target=run, name="model-preload", daemon=True).start()
+        return True
+
+    def readiness(self):
+        """
+        Per-model load state and timings of the current set, plus the startup report.
+        Ready once every model is loaded and warmed.
+        """
+        models = self._current
+        return {
+            "ready": all(state == "ready" for state in models.states.values()),
+            "eager": self.eager,
+            "models": {
+                name: {"state": state, "version": models.versions[name], **models.timings.get(name, {}),
+                       **({"error": models.errors[name]} if name in models.errors else {})}
+                for name, state in models.states.items()
+            },
+            "startup": self.startup,
+        }
+
+    def _read_fingerprint(self):
+        """
+        Identify the artifact set on disk: the latest manifest versions, the variant indexes
+        and the reload signal token.
+        """
+        versions = []
+        for name, cls in MODEL_CLASSES.items():
+            try:
+                versions.append(cls.latest_manifest()['version'])
+            except RuntimeError:
+                versions.append(None)
+            try:
+                versions.append(load_variant_index(MODEL_DIR, name)['updated_at'])
+            except (ManifestError, OSError, ValueError):
+                versions.append(None)
+        try:
+            with open(RELOAD_SIGNAL) as f:
+                token = f.read()
+        except OSError:
+            token = None
+        return (tuple(versions), token)
+
+    def reload(self):
+        """
+        Load, warm and swap in a new model pair. Blocks the calling thread; returns True on success.
+        """
+        with self._reload_lock:
+            self.state = "loading"
+            fingerprint = self._read_fingerprint()
+            # Models already serving traffic are loaded and warmed before the swap; the others stay lazy
+            current = self._current
+            preload = None if self.eager else [name for name in MODEL_CLASSES if current.is_loaded(name)]
+            try:
+                models = self._load(preload)
+            except Exception as e:
+                logging.exception("[registry] Model reload failed; still serving previous models")
+                self.state = "error"
+                self.last_error = str(e)
+                self._write_status()
+                return False
+            self._current = models
+            self._fingerprint = fingerprint
+            if self.cache is not None:
+                self.cache.clear()
+            self.state = "ready"
+            self.last_error = None
+            logging.info(f"[registry] Serving models {models.versions} in pid {os.getpid()}")
+            self._write_status()
+            return True
+
+    def reload_async(self):
+        """
+        Start a background reload. Returns False if one is already running.
+        """
+        if self._reload_lock.locked():
+            return False
+        threading.Thread(target=self.reload, name="model-reload", daemon=True).start()
+        return True
+
+    def signal_reload(self):
+        """
+        Ask every worker to reload by updating the shared reload signal file.
+        """
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        tmp = f"{RELOAD_SIGNAL}.tmp-{os.getpid()}"
+        with open(tmp, 'w') as f:
+            f.write(f"{time.time_ns()}-{os.getpid()}")
+        os.replace(tmp, RELOAD_SIGNAL)
+
+    def ensure_watcher(self):
+        """
+        Start the watcher thread in this process if it is not running yet. Safe to call on
+        every request; threads do not survive fork, so each worker starts its own.
+        """
+        if self._watcher_pid == os.getpid():
+            return
+        self._watcher_pid = os.getpid()
+        self._write_status()
+        if self.watch_interval > 0:
+            threading.Thread(target=self._watch, name="model-watcher", daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                if not self._reload_lock.locked() and self._read_fingerprint() != self._fingerprint:
+                    logging.info(f"[registry] Model artifacts changed, reloading in pid {os.getpid()}")
+                    self.reload()
+            except Exception:
+                logging.exception("[registry] Model watcher error")
+
+    def status(self):
+        models = self._current
+        return {
+            "pid": os.getpid(),
+            "state": self.state,
+            "versions": models.versions,
+            "models": dict(models.states),
+            "variants": {name: len(router) for name, router in models.routers.items()},
+            "pool": models.pool.stats(),
+            "loaded_at": models.loaded_at,
+            "last_error": self.last_error,
+        }
+
+    def _write_status(self):
+        try:
+            os.makedirs(STATUS_DIR, exist_ok=True)
+            path = os.path.join(STATUS_DIR, f"{os.getpid()}.json")
+            with open(f"{path}.tmp", 'w') as f:
+                json.dump(self.status(), f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logging.warning(f"[registry] Could not write worker status: {e}")
+
+    def worker_statuses(self):
+        """
+        Return the status reported by every live serving process.
+        """
+        statuses = []
+        for path in glob.glob(os.path.join(STATUS_DIR, '*.json')):
+            pid = int(os.path.splitext(os.path.basename(path))[0])
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                # Worker is gone (restarted or scaled down)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path) as f:
+                    statuses.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(statuses, key=lambda s: s["pid"])
@@ -0,0 +1,259 @@
+from datetime import datetime
+from typing import List, Optional
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, ValidationInfo, field_validator
+
+# Human-readable ranges used in error messages, matching the original hand-written checks
+RANGES = {
+    "rainfall": "0-1000 mm",
+    "temperature": "-30 to 60 °C",
+    "areaSqM": "0-10,000,000",
+    "soil_moisture": "0-100%",
+    "water_budget_liters": "must be 0 or more",
+}
+_RANGE_ERRORS = frozenset({"greater_than", "greater_than_equal", "less_than", "less_than_equal", "finite_number"})
+_NUMBER_ERRORS = frozenset({"float_parsing", "float_type"})
+
+
+def _id_as_string(value):
+    # Numeric ids from CSV exports are accepted as strings
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+
+def _check_allowed(value, info, field):
+    allowed = (info.context or {}).get(f"valid_{field}s")
+    if allowed and value not in allowed:
+        raise ValueError(f"Invalid {field}: {value}. Allowed: {sorted(allowed)}")
+    return value
+
+
+class PlotInput(BaseModel):
+    """
+    Fields shared by every prediction request. Extra fields (farm metadata, ...) are ignored.
+    Categorical values are checked against the frozensets passed in the validation context.
+    `plot_id` and `timestamp` are optional; with both, the 7-day features use the plot's
+    recent readings (see app/features.py). The optional `state` and `district` (as on the
+    Prisma Farm) route the row to a regional model variant (see app/variants.py).
+    """
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+    rainfall: float = Field(ge=0, le=1000)
+    temperature: float = Field(ge=-30, le=60)
+    soil_type: str
+    crop: str
+    areaSqM: float = Field(gt=0, lt=1e7)
+    plot_id: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    state: Optional[str] = None
+    district: Optional[str] = None
+
+    @field_validator("plot_id", mode="before")
+    @classmethod
+    def _plot_id_as_string(cls, value):
+        return _id_as_string(value)
+
+    @field_validator("crop")
+    @classmethod
+    def _known_crop(cls, value, info: ValidationInfo):
+        return _check_allowed(value, info, "crop")
+
+    @field_validator("soil_type")
+    @classmethod
+    def _known_soil_type(cls, value, info: ValidationInfo):
+        return _check_allowed(value, info, "soil_type")
+
+
+class YieldInput(PlotInput):
+    soil_moisture: float = 0.0
+
+
+class IrrigationInput(PlotInput):
+    soil_moisture: float = Field(ge=0, le=100)
+
+
+class ForecastDay(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+    rainfall: float = Field(ge=0, le=1000)
+    temperature: float = Field(ge=-30, le=60)
+
+
+class SchedulePlot(BaseModel):
+    """
+    A plot to schedule irrigation for (see app/optimizer.py). `forecast` overrides the
+    farm-level forecast for this plot and must cover the same days. `state` and `district`
+    select a regional model variant as for predictions.
+    """
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+    plot_id: Optional[str] = None
+    soil_type: str
+    crop: str
+    areaSqM: float = Field(gt=0, lt=1e7)
+    soil_moisture: float = Field(ge=0, le=100)
+    forecast: Optional[List[ForecastDay]] = None
+    state: Optional[str] = None
+    district: Optional[str] = None
+
+    @field_validator("plot_id", mode="before")
+    @classmethod
+    def _plot_id_as_string(cls, value):
+        return _id_as_string(value)
+
+    @field_validator("crop")
+    @classmethod
+    def _known_crop(cls, value, info: ValidationInfo):
+        return _check_allowed(value, info, "crop")
+
+    @field_validator("soil_type")
+    @classmethod
+    def _known_soil_type(cls, value, info: ValidationInfo):
+        return _check_allowed(value, info, "soil_type")
+
+
+class SensorPlot(BaseModel):
+    """
+    Static attributes of a plot whose sensor readings are aggregated server-side
+    (see app/sensors.py). Accepts the Prisma field names (plotId, soilType) as well.
+    `state` and `district` select a regional model variant as for predictions.
+    """
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+    plot_id: str = Field(min_length=1, validation_alias=AliasChoices("plot_id", "plotId"))
+    soil_type: str = Field(validation_alias=AliasChoices("soil_type", "soilType"))
+    crop: str
+    areaSqM: float = Field(gt=0, lt=1e7)
+    state: Optional[str] = None
+    district: Optional[str] = None
+
+    @field_validator("plot_id", mode="before")
+    @classmethod
+    def _plot_id_as_string(cls, value):
+        return _id_as_string(value)
+
+    @field_validator("crop")
+    @classmethod
+    def _known_crop(cls, value, info: ValidationInfo):
+        return _check_allowed(value, info, "crop")
+
+    @field_validator("soil_type")
+    @classmethod
+    def _known_soil_type(cls, value, info: ValidationInfo):
+        return _check_allowed(value, info, "soil_type")
+
+
+class ScheduleRequest(BaseModel):
+    """
+    Irrigation scheduling request: plots, a per-day forecast and a farm water budget in liters
+    (1 mm of water on 1 m² is 1 liter). `levels_mm` fixes the candidate daily amounts;
+    by default they are fractions of the irrigation model's recommendation.
+    """
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+    plots: List[SchedulePlot] = Field(min_length=1)
+    forecast: List[ForecastDay] = Field(min_length=1, max_length=31)
+    water_budget_liters: float = Field(ge=0)
+    levels_mm: Optional[List[float]] = Field(default=None, min_length=1, max_length=16)
+    time_limit: Optional[float] = Field(default=None, gt=0, le=30)
+
+    @field_validator("levels_mm")
+    @classmethod
+    def _levels_in_range(cls, value):
+        if value is not None and any(not 0 <= v <= 1000 for v in value):
+            raise ValueError("levels_mm must be between 0 and 1000 mm")
+        return value
+
+
+# Adapters are built once; pydantic-core compiles the validator for the whole list
+_LIST_ADAPTERS = {schema: TypeAdapter(List[schema]) for schema in (YieldInput, IrrigationInput, SensorPlot)}
+
+
+def _context(valid_crops, valid_soil_types):
+    return {
+        "valid_crops": frozenset(valid_crops) if valid_crops else None,
+        "valid_soil_types": frozenset(valid_soil_types) if valid_soil_types else None,
+    }
+
+
+def format_errors(errors, skip=0):
+    """
+    Convert pydantic error dicts to the service's error strings (e.g. "Missing field: crop").
+    `skip` drops leading location parts, such as the row index of a batch.
+    """
+    messages = []
+    for err in errors:
+        loc = err["loc"][skip:]
+        field = str(loc[0]) if loc else "input"
+        kind = err["type"]
+        if kind == "missing":
+            messages.append(f"Missing field: {field}")
+        elif kind in _NUMBER_ERRORS:
+            messages.append(f"{field} must be a number")
+        elif kind == "string_type":
+            messages.append(f"{field} must be a string")
+        elif kind in _RANGE_ERRORS and field in RANGES:
+            messages.append(f"{field} out of range ({RANGES[field]})")
+        elif kind == "value_error":
+            messages.append(str(err["ctx"]["error"]))
+        elif kind == "model_type":
+            messages.append("Each plot must be a JSON object")
+        else:
+            messages.append(f"{field}: {err['msg']}")
+    return messages
+
+
+def parse_input(schema, data, valid_crops: Optional[frozenset] = None, valid_soil_types: Optional[frozenset] = None):
+    """
+    Validate and coerce one request in a single pass. Returns (typed_input, errors);
+    typed_input is None when errors is non-empty.
+    """
+    if isinstance(data, schema):
+        return data, []
+    try:
+        return schema.model_validate(data, context=_context(valid_crops, valid_soil_types)), []
+    except ValidationError as e:
+        return None, format_errors(e.errors(include_url=False))
+
+
+def parse_batch(schema, rows, valid_crops: Optional[frozenset] = None, valid_soil_types: Optional[frozenset] = None):
+    """
+    Validate a list of requests. Returns (inputs, errors): two lists aligned with `rows`,
+    holding the typed input or None, and the row's error messages or None.
+    """
+    context = _context(valid_crops, valid_soil_types)
+    if all(isinstance(r, schema) for r in rows):
+        return list(rows), [None] * len(rows)
+    try:
+        # Fast path: the whole batch validates in one call
+        return _LIST_ADAPTERS[schema].validate_python(rows, context=context), [None] * len(rows)
+    except ValidationError as e:
+        bad = {}
+        for err in e.errors(include_url=False):
+            bad.setdefault(err["loc"][0], []).append(err)
+    inputs, errors = [], []
+    for i, row in enumerate(rows):
+        if i in bad:
+            inputs.append(None)
+            errors.append(format_errors(bad[i], skip=1))
+        else:
+            inputs.append(row if isinstance(row, schema) else schema.model_validate(row, context=context))
+            errors.append(None)
+    return inputs, errors
+
+
+def parse_schedule(data, valid_crops: Optional[frozenset] = None, valid_soil_types: Optional[frozenset] = None):
+    """
+    Validate an irrigation scheduling request. Returns (ScheduleRequest, errors); errors
+    name the offending item, e.g. "plots[3]: Missing field: crop".
+    """
+    try:
+        return ScheduleRequest.model_validate(data, context=_context(valid_crops, valid_soil_types)), []
+    except ValidationError as e:
+        messages = []
+        for err in e.errors(include_url=False):
+            loc = err["loc"]
+            path = "".join(f"[{part}]" if isinstance(part, int) else f".{part}" for part in loc[:-1]).lstrip(".")
+            message = format_errors([err], skip=max(len(loc) - 1, 0))[0]
+            messages.append(f"{path}: {message}" if path else message)
+        return None, messages
@@ -0,0 +1,424 @@
+"""
+Server-side aggregation of raw sensor readings (the SensorReading rows of the Prisma
+schema) into model inputs, with predictions recomputed only for plots whose inputs moved.
+
+Readings arrive in bulk as NDJSON, one {"plot_id", "type", "value", "timestamp"} object per
+line (plotId/sensorType are accepted too), or as a compact binary payload:
+
+    uint32 header length | UTF-8 JSON header {"plots": [plot ids], "types": [SensorType names]}
+    | packed little-endian records (uint32 plot index, uint8 type index, float64 epoch seconds, float32 value)
+
+Each plot keeps a ring of time buckets per sensor type (bucket sums and counts), covering
+the last ML_SENSOR_RETENTION_S seconds before the plot's newest reading, so memory per plot
+is fixed and at most ML_SENSOR_MAX_PLOTS plots are kept (least recently updated dropped
+first). Model inputs are reduced from the buckets: mean temperature, total rainfall and
+the newest bucket's soil moisture. After each ingest, plots with metadata (crop, soil type,
+area; see SensorPlot in app/schemas.py) whose inputs moved more than THRESHOLDS since their
+last prediction are scored in one batch per model. Every new result is an event with a
+sequence number, served by polling (`since`) or as a server-sent-events stream (ASGI app only).
+
+State is per process and cannot be shared between workers, so /api/sensors/* must be
+served by a single process. ML_SENSORS=0 leaves the sensor routes out of an app, and
+gunicorn.conf.py refuses to start several workers with them in. Run the prediction API with
+ML_SENSORS=0 and the sensor endpoints in a separate single-worker or ASGI process. For
+servers that fork without that config (e.g. uvicorn --workers), the first process to use a
+SensorHub takes an exclusive lock on models/.sensors.lock (see claim_sensor_state), and the
+sensor endpoints of every other process answer 503, so readings are never split across
+workers.
+"""
+import os
+import json
+import time
+import fcntl
+import struct
+import itertools
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+import numpy as np
+from .models.base import MODEL_DIR
+from .schemas import SensorPlot, parse_batch
+
+logger = logging.getLogger(__name__)
+
+# SensorType -> (model input, reducer over the retained buckets); other types are accepted and ignored
+AGGREGATES = {
+    'Temperature': ('temperature', 'mean'),
+    'Rainfall': ('rainfall', 'sum'),
+    'SoilMoisture': ('soil_moisture', 'latest'),
+}
+TYPES = list(AGGREGATES)
+# A plot is re-scored when any input moves by more than this since its last prediction
+THRESHOLDS = {'temperature': 0.5, 'rainfall': 1.0, 'soil_moisture': 1.0}
+RECORD_DTYPE = np.dtype([('plot', '<u4'), ('type', 'u1'), ('timestamp', '<f8'), ('value', '<f4')])
+RETENTION_S = float(os.environ.get('ML_SENSOR_RETENTION_S', str(24 * 3600)))
+BUCKET_S = float(os.environ.get('ML_SENSOR_BUCKET_S', '3600'))
+MAX_PLOTS = int(os.environ.get('ML_SENSOR_MAX_PLOTS', '50000'))
+MAX_EVENTS = int(os.environ.get('ML_SENSOR_MAX_EVENTS', '10000'))
+MAX_BODY_BYTES = int(os.environ.get('ML_SENSOR_MAX_BYTES', str(16 << 20)))
+# SSE connections are closed after this long; EventSource clients reconnect with Last-Event-ID
+STREAM_S = float(os.environ.get('ML_SENSOR_STREAM_S', '300'))
+LOCK_PATH = os.path.join(MODEL_DIR, '.sensors.lock')
+# Parse errors reported back per request
+MAX_ERRORS = 20
+
+
+def sensors_enabled():
+    # ML_SENSORS=0 serves the app without /api/sensors/*
+    return os.environ.get('ML_SENSORS', '1').lower() not in ('0', 'false', 'no')
+
+
+class ReadingBatch:
+    """
+    Parsed readings as parallel arrays. `plot` indexes into `plot_ids`; `type` indexes into TYPES.
+    """
+    def __init__(self, plot_ids, plot, type_, timestamp, value, ignored=0, errors=(), rejected=0):
+        self.plot_ids = plot_ids
+        self.plot = plot
+        self.type = type_
+        self.timestamp = timestamp
+        self.value = value
+        self.ignored = ignored
+        self.rejected = rejected
+        self.errors = list(errors)
+
+    def __len__(self):
+        return len(self.plot)
+
+
+def _epoch(value, now):
+    if value is None:
+        return now
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    ts = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def parse_ndjson(body):
+    """
+    Parse NDJSON readings. Lines with unknown sensor types are counted as ignored; malformed
+    lines are rejected with a message naming the line (1-based).
+    """
+    now = time.time()
+    ids, plot, type_, timestamp, value = {}, [], [], [], []
+    ignored = rejected = 0
+    errors = []
+    codes = {name: i for i, name in enumerate(TYPES)}
+    for n, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            reading = json.loads(line)
+            plot_id = reading.get('plot_id', reading.get('plotId'))
+            kind = reading.get('type', reading.get('sensorType'))
+            if plot_id is None or kind is None or 'value' not in reading:
+                raise ValueError("expected plot_id, type and value")
+            if kind not in codes:
+                ignored += 1
+                continue
+            v = float(reading['value'])
+            if not np.isfinite(v):
+                raise ValueError("value must be a finite number")
+            ts = _epoch(reading.get('timestamp'), now)
+        except (ValueError, TypeError, AttributeError) as e:
+            rejected += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append(f"line {n}: {e}")
+            continue
+        plot.append(ids.setdefault(str(plot_id), len(ids)))
+        type_.append(codes[kind])
+        timestamp.append(ts)
+        value.append(v)
+    return ReadingBatch(list(ids), np.array(plot, dtype=np.intp), np.array(type_, dtype=np.intp),
+                        np.array(timestamp, dtype=float), np.array(value, dtype=float), ignored, errors, rejected)
+
+
+def parse_binary(body):
+    """
+    Parse the binary payload described in the module docstring. Raises ValueError if the
+    payload is malformed as a whole; records with out-of-range indexes or non-finite values
+    are rejected individually.
+    """
+    if len(body) < 4:
+        raise ValueError("payload too short")
+    (header_len,) = struct.unpack_from('<I', body)
+    try:
+        header = json.loads(bytes(body[4:4 + header_len]))
+        plot_ids = [str(p) for p in header['plots']]
+        types = list(header.get('types', TYPES))
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"invalid header: {e}")
+    payload = memoryview(body)[4 + header_len:]
+    if len(payload) % RECORD_DTYPE.itemsize:
+        raise ValueError(f"record section is not a multiple of {RECORD_DTYPE.itemsize} bytes")
+    records = np.frombuffer(payload, dtype=RECORD_DTYPE)
+    # Header type index -> TYPES index, -1 for types that are not aggregated
+    type_map = np.array([TYPES.index(t) if t in AGGREGATES else -1 for t in types] + [-2], dtype=np.intp)
+    type_ = type_map[np.minimum(records['type'], len(types))]
+    valid_plot = records['plot'] < len(plot_ids)
+    finite = np.isfinite(records['value']) & np.isfinite(records['timestamp'])
+    bad = ~valid_plot | ~finite | (type_ == -2)
+    ignored = int(np.count_nonzero(~bad & (type_ == -1)))
+    keep = ~bad & (type_ >= 0)
+    errors = [f"record {i}: invalid plot or type index, or non-finite value" for i in np.nonzero(bad)[0][:MAX_ERRORS]]
+    return ReadingBatch(plot_ids, records['plot'][keep].astype(np.intp), type_[keep],
+                        records['timestamp'][keep].astype(float), records['value'][keep].astype(float),
+                        ignored, errors, int(np.count_nonzero(bad)))
+
+
+class _PlotState:
+    __slots__ = ('buckets', 'sums', 'counts', 'newest', 'seen', 'meta', 'inputs', 'predicted', 'updated_at')
+
+    def __init__(self, n_buckets):
+        # Bucket number held by each ring slot (-1: empty)
+        self.buckets = np.full(n_buckets, -1, dtype=np.int64)
+        self.sums = np.zeros((len(TYPES), n_buckets))
+        self.counts = np.zeros((len(TYPES), n_buckets))
+        self.newest = -1
+        self.seen = np.zeros(len(TYPES), dtype=bool)
+        self.meta = None
+        # Inputs of the last prediction (None: never predicted or must be re-scored)
+        self.inputs = None
+        self.predicted = None
+        self.updated_at = None
+
+    def add(self, bucket, type_, total, count):
+        slot = bucket % len(self.buckets)
+        if self.buckets[slot] != bucket:
+            if bucket < self.buckets[slot] or bucket <= self.newest - len(self.buckets):
+                # Older than the retained window
+                return
+            self.buckets[slot] = bucket
+            self.sums[:, slot] = 0.0
+            self.counts[:, slot] = 0.0
+        self.sums[type_, slot] += total
+        self.counts[type_, slot] += count
+        self.seen[type_] = True
+        self.newest = max(self.newest, bucket)
+
+    def features(self):
+        """
+        Current model inputs from the retained buckets, or None until every aggregated type has been seen.
+        """
+        if not self.seen.all():
+            return None
+        live = self.buckets > self.newest - len(self.buckets)
+        values = {}
+        for i, (name, reducer) in enumerate(AGGREGATES.values()):
+            sums, counts = self.sums[i, live], self.counts[i, live]
+            if reducer == 'sum':
+                values[name] = round(float(sums.sum()), 4)
+            elif reducer == 'mean':
+                values[name] = float(sums.sum() / counts.sum()) if counts.sum() else None
+            else:
+                slots = np.nonzero(counts)[0]
+                newest = slots[np.argmax(self.buckets[live][slots])] if len(slots) else None
+                values[name] = float(sums[newest] / counts[newest]) if newest is not None else None
+        return None if any(v is None for v in values.values()) else values
+
+
+class SensorHub:
+    """
+    Per-plot sensor aggregates, change-triggered predictions and the event log served to
+    pollers and SSE clients. Thread-safe.
+    """
+    def __init__(self, retention_s=RETENTION_S, bucket_s=BUCKET_S, max_plots=MAX_PLOTS, max_events=MAX_EVENTS,
+                 thresholds=None):
+        self.bucket_s = bucket_s
+        self.n_buckets = max(1, int(round(retention_s / bucket_s)))
+        self.max_plots = max_plots
+        self.thresholds = dict(THRESHOLDS, **(thresholds or {}))
+        self._plots = OrderedDict()
+        self._events = deque(maxlen=max_events)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.counters = {"readings": 0, "ignored": 0, "rejected": 0, "predictions": 0, "evicted_plots": 0}
+
+    def _plot(self, plot_id):
+        state = self._plots.get(plot_id)
+        if state is None:
+            state = self._plots[plot_id] = _PlotState(self.n_buckets)
+            if len(self._plots) > self.max_plots:
+                self._plots.popitem(last=False)
+                self.counters["evicted_plots"] += 1
+        else:
+            self._plots.move_to_end(plot_id)
+        return state
+
+    def register_plots(self, rows, valid_crops=None, valid_soil_types=None):
+        """
+        Add or update plot metadata. Returns (number stored, errors per rejected row).
+        """
+        plots, errors = parse_batch(SensorPlot, rows, valid_crops, valid_soil_types)
+        stored = 0
+        with self._lock:
+            for plot in plots:
+                if plot is None:
+                    continue
+                state = self._plot(plot.plot_id)
+                if state.meta != plot:
+                    state.meta = plot
+                    state.inputs = None
+                stored += 1
+        return stored, [f"plots[{i}]: {e}" for i, errs in enumerate(errors) if errs for e in errs]
+
+    def ingest(self, batch):
+        """
+        Fold a ReadingBatch into the plot aggregates. Readings are summed per
+        (plot, type, bucket) with one vectorized pass before touching the per-plot rings.
+        Returns the plot ids that received readings.
+        """
+        self.counters["ignored"] += batch.ignored
+        self.counters["rejected"] += batch.rejected
+        if not len(batch):
+            return []
+        bucket = np.floor(batch.timestamp / self.bucket_s).astype(np.int64)
+        keys = np.stack([batch.plot, batch.type, bucket], axis=1)
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        totals = np.bincount(inverse, weights=batch.value, minlength=len(groups))
+        counts = np.bincount(inverse, minlength=len(groups))
+        # Newest buckets last, so a plot's window has moved forward before older buckets are checked against it
+        order = np.argsort(groups[:, 2], kind='stable')
+        touched = set()
+        with self._lock:
+            for g in order:
+                plot_id = batch.plot_ids[groups[g, 0]]
+                self._plot(plot_id).add(int(groups[g, 2]), int(groups[g, 1]), totals[g], counts[g])
+                touched.add(plot_id)
+            self.counters["readings"] += len(batch)
+        return sorted(touched)
+
+    def _changed_plots(self, plot_ids=None):
+        """
+        (plot_id, metadata, inputs) for plots whose inputs moved beyond the thresholds.
+        """
+        out = []
+        candidates = self._plots if plot_ids is None else plot_ids
+        for plot_id in candidates:
+            state = self._plots.get(plot_id)
+            if state is None or state.meta is None:
+                continue
+            inputs = state.features()
+            if inputs is None:
+                continue
+            if state.inputs is not None and all(abs(inputs[k] - state.inputs[k]) <= self.thresholds[k] for k in inputs):
+                continue
+            out.append((plot_id, state.meta, inputs))
+        return out
+
+    def recompute(self, models, plot_ids=None):
+        """
+        Score the plots (all, or `plot_ids`) whose inputs changed, one predict_batch per model,
+        and publish an event per plot. `models` is a registry ModelSet. Returns the events.
+        """
+        with self._lock:
+            changed = self._changed_plots(plot_ids)
+        if not changed:
+            return []
+        rows = [{**inputs, "crop": meta.crop, "soil_type": meta.soil_type, "areaSqM": meta.areaSqM,
+                 "state": meta.state, "district": meta.district} for _, meta, inputs in changed]
+        results = {kind: models.routed(kind).predict_batch(rows, summary=None) for kind in ("yield", "irrigation")}
+        versions = models.versions
+        now = time.time()
+        events = []
+        with self._lock:
+            for i, (plot_id, _, inputs) in enumerate(changed):
+                state = self._plots.get(plot_id)
+                if state is None:
+                    continue
+                event = {"plot_id": plot_id, "inputs": inputs, "updated_at": now, "versions": versions}
+                for kind, kind_results in results.items():
+                    result = kind_results[i]
+                    if "errors" in result:
+                        event.setdefault("errors", []).extend(f"{kind}: {e}" for e in result["errors"])
+                    else:
+                        event[kind] = result["prediction"]
+                        if "variant" in result:
+                            event.setdefault("variants", {})[kind] = result["variant"]
+                # Out-of-range aggregates are reported once and retried when the inputs move again
+                state.inputs = inputs
+                state.predicted = event
+                state.updated_at = now
+                self._seq += 1
+                event["seq"] = self._seq
+                self._events.append(event)
+                events.append(event)
+            self.counters["predictions"] += len(events)
+        return events
+
+    def events_since(self, since, limit=1000):
+        """
+        Events after sequence number `since`. Returns (events, next_since, reset): when
+        `since` is older than the retained log (or newer than any event, e.g. from before a
+        restart), `reset` is True and the events are the latest prediction of each plot instead.
+        """
+        with self._lock:
+            oldest = self._events[0]["seq"] if self._events else self._seq + 1
+            reset = since > self._seq or since < oldest - 1
+            if reset:
+                latest = sorted((s.predicted for s in self._plots.values() if s.predicted is not None), key=lambda e: e["seq"])
+                events, next_since = latest[-limit:], self._seq
+            else:
+                start = len(self._events) - (self._seq - since)
+                events = list(itertools.islice(self._events, start, start + limit))
+                next_since = events[-1]["seq"] if events else since
+        return events, next_since, reset
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def stats(self):
+        with self._lock:
+            ready = sum(1 for s in self._plots.values() if s.meta is not None and s.seen.all())
+            return {
+                "plots": len(self._plots), "plots_ready": ready, "max_plots": self.max_plots,
+                "retention_s": self.n_buckets * self.bucket_s, "bucket_s": self.bucket_s,
+                "seq": self._seq, "events_buffered": len(self._events), **self.counters,
+            }
+
+
+_claim = {"pid": None, "file": None}
+_claim_lock = threading.Lock()
+
+
+def claim_sensor_state(path=LOCK_PATH):
+    """
+    Make this process the one that holds sensor state. Returns None if it does (or just
+    became it), else a message naming the process that does. The lock is released when
+    the owning process exits, so a restarted worker takes over.
+    """
+    pid = os.getpid()
+    if _claim["pid"] == pid:
+        return None
+    with _claim_lock:
+        if _claim["pid"] == pid:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = open(path, 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.seek(0)
+            owner = f.read().strip() or "unknown"
+            f.close()
+            return f"Sensor state is held by process {owner}; serve /api/sensors/* from a single worker"
+        f.seek(0)
+        f.truncate()
+        f.write(str(pid))
+        f.flush()
+        _claim.update(pid=pid, file=f)
+        logger.info("[sensors] Process %d holds the sensor state", pid)
+        return None
+
+
+def sse_event(event):
+    return f"id: {event['seq']}\nevent: prediction\ndata: {json.dumps(event)}\n\n"
+
+
+SSE_KEEPALIVE = ": keepalive\n\n"
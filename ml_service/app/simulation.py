@@ -0,0 +1,230 @@
+"""
+What-if simulation over a farm grid, for the digital-twin playground (/api/simulate).
+
+A request holds a base plot state, optional grid cells that override it, and a sweep of
+values for some fields. Every combination of cell and swept values is scored. The
+combinations are expanded in chunks: each chunk is one NumPy feature matrix, scored with
+one call per model and streamed back as NDJSON lines while the next chunk is computed.
+
+Request body:
+
+    {"base": {"crop": "maize", "soil_type": "loam", "rainfall": 50, "temperature": 25,
+              "soil_moisture": 30, "areaSqM": 100},
+     "cells": [{"row": 0, "column": 0}, {"row": 0, "column": 1, "crop": "rice"}],
+     "sweep": {"rainfall": {"start": 0, "stop": 200, "num": 5}, "crop": ["maize", "wheat"]},
+     "models": ["yield", "irrigation"]}
+
+Precedence is base < cell < sweep. Swept values are lists or inclusive
+{"start", "stop", "num"} ranges. Simulated plots have no history, so the 7-day features
+equal the current readings and the rolling store is neither read nor updated. With `state`
+and `district` in the base or a cell, combinations are scored by the regional or per-crop
+variant they route to, as predictions are (see app/variants.py).
+"""
+import os
+import json
+import logging
+from collections import namedtuple
+from time import perf_counter
+import numpy as np
+from .features import ROLLING_FEATURES
+from .models.base import CATEGORICAL_FEATURES, NUMERIC_FEATURES
+
+logger = logging.getLogger(__name__)
+
+MODELS = ("yield", "irrigation")
+NUMERIC_FIELDS = ("rainfall", "temperature", "soil_moisture", "areaSqM")
+SWEEP_FIELDS = NUMERIC_FIELDS + tuple(CATEGORICAL_FEATURES)
+# Cell keys echoed back on every result line
+CELL_KEYS = ("row", "column")
+# Fields a combination is routed to a model variant by
+REGION_FIELDS = ("state", "district")
+_Route = namedtuple("_Route", REGION_FIELDS + tuple(CATEGORICAL_FEATURES))
+
+MAX_ROWS = int(os.environ.get("ML_SIMULATE_MAX_ROWS", "100000"))
+CHUNK_ROWS = int(os.environ.get("ML_SIMULATE_CHUNK_ROWS", "2048"))
+
+
+def _axis_values(field, spec):
+    """
+    Expand one sweep entry into a list of raw values, or return an error string.
+    """
+    if isinstance(spec, list):
+        values = spec
+    elif isinstance(spec, dict) and field in NUMERIC_FIELDS:
+        try:
+            start, stop, num = float(spec["start"]), float(spec["stop"]), int(spec["num"])
+        except (KeyError, TypeError, ValueError):
+            return None, f"sweep.{field} must be a list or {{\"start\", \"stop\", \"num\"}}"
+        if not 1 <= num <= MAX_ROWS:
+            return None, f"sweep.{field}.num must be between 1 and {MAX_ROWS}"
+        values = np.linspace(start, stop, num).tolist()
+    else:
+        return None, f"sweep.{field} must be a list" + (" or {\"start\", \"stop\", \"num\"}" if field in NUMERIC_FIELDS else "")
+    if not values:
+        return None, f"sweep.{field} must not be empty"
+    return values, None
+
+
+class Simulation:
+    """
+    A validated simulation request. Combination k is (cell, v_1, ..., v_m) in C order over
+    (cells, axis_1, ..., axis_m), so results stream cell by cell.
+    """
+    def __init__(self, models, cells, cell_values, axes, chunk_size):
+        self.models = models
+        self.cells = cells
+        self.cell_values = cell_values
+        self.axes = axes
+        self.chunk_size = chunk_size
+        self.shape = (len(cells),) + tuple(len(values) for _, values in axes)
+        self.total = int(np.prod(self.shape))
+
+    def columns(self, start, stop):
+        """
+        Raw field values for combinations [start, stop): a dict of arrays plus the cell index of each row.
+        """
+        multi = np.unravel_index(np.arange(start, stop), self.shape)
+        cell_idx = multi[0]
+        columns = {field: values[cell_idx] for field, values in self.cell_values.items()}
+        for (field, values), idx in zip(self.axes, multi[1:]):
+            columns[field] = values[idx]
+        return columns, cell_idx
+
+    def score(self, start, stop):
+        """
+        Predictions of every model for combinations [start, stop), built as one feature matrix.
+        """
+        columns, cell_idx = self.columns(start, stop)
+        sources = {feature: ROLLING_FEATURES.get(feature, feature) for feature in NUMERIC_FEATURES}
+        numeric = np.column_stack([columns[sources[feature]] for feature in NUMERIC_FEATURES]).astype(float)
+        categories = np.column_stack([columns[field] for field in CATEGORICAL_FEATURES])
+        rows = [_Route(*values) for values in zip(*(columns[field] for field in _Route._fields))]
+        preds = {name: model.score(numeric, categories, model.routes(rows)) for name, model in self.models.items()}
+        return columns, cell_idx, preds
+
+    def results(self, start, stop):
+        """
+        Result lines (dicts) for combinations [start, stop).
+        """
+        columns, cell_idx, preds = self.score(start, stop)
+        swept = [(field, columns[field].tolist()) for field, _ in self.axes]
+        cell_info = [{k: cell[k] for k in CELL_KEYS if k in cell} for cell in self.cells]
+        preds = {name: p.tolist() for name, p in preds.items()}
+        rows = []
+        for j, ci in enumerate(cell_idx.tolist()):
+            row = {"index": start + j, "cell": ci, **cell_info[ci]}
+            for field, values in swept:
+                row[field] = values[j]
+            for name, p in preds.items():
+                row[name] = p[j]
+            rows.append(row)
+        return rows
+
+    def header(self):
+        return {"meta": {
+            "count": self.total,
+            "cells": len(self.cells),
+            "sweep": {field: values.tolist() for field, values in self.axes},
+            "models": {name: model.version for name, model in self.models.items()},
+            "chunk_size": self.chunk_size,
+        }}
+
+    def chunks(self):
+        """
+        Yield one NDJSON string per chunk: the header first, then the results, then a footer.
+        A failing chunk ends the stream with an error line, since the status is already sent.
+        """
+        started = perf_counter()
+        yield json.dumps(self.header()) + "\n"
+        done = 0
+        for start in range(0, self.total, self.chunk_size):
+            stop = min(start + self.chunk_size, self.total)
+            try:
+                rows = self.results(start, stop)
+            except Exception as e:
+                logger.exception("[simulate] Scoring rows %d-%d failed", start, stop)
+                yield json.dumps({"error": "Prediction failed", "details": str(e), "index": start}) + "\n"
+                return
+            done = stop
+            yield "".join(json.dumps(row) + "\n" for row in rows)
+        yield json.dumps({"done": True, "count": done, "elapsed_ms": round((perf_counter() - started) * 1000, 1)}) + "\n"
+
+
+def parse_simulation(models, data):
+    """
+    Validate a simulation request against the schema of every requested model.
+    `models` maps model names to the current model objects.
+    Returns (Simulation, None) or (None, (payload, status)) on error.
+    """
+    if not isinstance(data, dict):
+        return None, ({"error": "Invalid input", "details": ["Expected a JSON object"]}, 400)
+    base = data.get("base", {})
+    cells = data.get("cells") or [{}]
+    sweep = data.get("sweep", {})
+    names = data.get("models", list(MODELS))
+    errors = []
+    if not isinstance(base, dict):
+        errors.append("base must be a JSON object")
+    if not isinstance(cells, list) or not all(isinstance(c, dict) for c in cells):
+        errors.append("cells must be a list of JSON objects")
+    if not isinstance(sweep, dict):
+        errors.append("sweep must be a JSON object")
+    if not isinstance(names, list) or not names or any(n not in MODELS for n in names):
+        errors.append(f"models must be a non-empty list drawn from {list(MODELS)}")
+    try:
+        chunk_size = min(int(data.get("chunk_size", CHUNK_ROWS)), CHUNK_ROWS)
+        if chunk_size < 1:
+            raise ValueError
+    except (TypeError, ValueError):
+        errors.append(f"chunk_size must be an integer between 1 and {CHUNK_ROWS}")
+    if errors:
+        return None, ({"error": "Invalid input", "details": errors}, 400)
+
+    axes = []
+    for field, spec in sweep.items():
+        if field not in SWEEP_FIELDS:
+            errors.append(f"sweep.{field}: cannot be swept (allowed: {list(SWEEP_FIELDS)})")
+            continue
+        values, error = _axis_values(field, spec)
+        if error:
+            errors.append(error)
+        else:
+            axes.append((field, values))
+    if errors:
+        return None, ({"error": "Invalid input", "details": errors}, 400)
+    total = len(cells)
+    for _, values in axes:
+        total *= len(values)
+    if total > MAX_ROWS:
+        return None, ({"error": "Simulation too large", "details": [f"At most {MAX_ROWS} combinations per request, got {total}"]}, 413)
+
+    # Fields are checked independently, so validating every cell and every swept value
+    # once against a reference combination covers every combination
+    selected = {name: models[name] for name in names}
+    reference = {field: values[0] for field, values in axes}
+
+    def check(where, row):
+        typed = None
+        for model in selected.values():
+            typed, row_errors = model.parse(row)
+            if row_errors:
+                errors.extend(f"{where}: {e}" for e in row_errors)
+                return None
+        return typed
+
+    typed_cells = [check(f"cells[{i}]", {**base, **cell, **reference}) for i, cell in enumerate(cells)]
+    typed_axes = []
+    for field, values in axes:
+        typed = [check(f"sweep.{field}[{j}]", {**base, **cells[0], **reference, field: v}) for j, v in enumerate(values)]
+        typed_axes.append((field, typed))
+    if errors:
+        return None, ({"error": "Invalid input", "details": errors}, 400)
+
+    cell_values = {field: np.array([getattr(t, field) for t in typed_cells], dtype=float) for field in NUMERIC_FIELDS}
+    cell_values.update({field: np.array([getattr(t, field) for t in typed_cells], dtype=object)
+                        for field in (*CATEGORICAL_FEATURES, *REGION_FIELDS)})
+    axis_arrays = [
+        (field, np.array([getattr(t, field) for t in typed], dtype=float if field in NUMERIC_FIELDS else object))
+        for field, typed in typed_axes
+    ]
+    return Simulation(selected, cells, cell_values, axis_arrays, chunk_size), None
@@ -0,0 +1,143 @@
+"""
+Farmer-facing summaries, rendered from a rule table (summary_rules.json) and one message
+catalog per locale (locales/<code>.json).
+
+A summary is the model's headline ("Expected yield: 234.59 kg.") followed by the advice
+of the first rule whose condition holds, or the default advice. Rules are compiled once
+into (field, comparison, threshold) triples, so a whole batch is classified with one
+vectorized comparison per rule. Advice text depends only on (locale, rule, crop) and is
+rendered once and reused. Adding a locale means adding locales/<code>.json with the same
+message keys; missing keys fall back to the default locale.
+"""
+import os
+import json
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RULES_PATH = os.path.join(os.path.dirname(__file__), 'summary_rules.json')
+LOCALES_DIR = os.path.join(os.path.dirname(__file__), 'locales')
+DEFAULT_LOCALE = 'en'
+OPS = {'gt': np.greater, 'ge': np.greater_equal, 'lt': np.less, 'le': np.less_equal}
+# Bound on memoized advice strings (crops are free text when no valid_crops are configured)
+MAX_ADVICE_ENTRIES = 4096
+
+
+def _load_locales():
+    locales = {}
+    for name in sorted(os.listdir(LOCALES_DIR)):
+        if name.endswith('.json'):
+            with open(os.path.join(LOCALES_DIR, name), encoding='utf-8') as f:
+                locales[name[:-len('.json')]] = json.load(f)
+    return locales
+
+
+class SummaryRenderer:
+    """
+    Summaries for one model, compiled from its entry in summary_rules.json.
+    """
+    def __init__(self, spec, locales):
+        self.rules = [(rule['field'], OPS[rule['op']], float(rule['value'])) for rule in spec['rules']]
+        # Message key per rule index; the last index is the default advice
+        self.advice_keys = [rule['message'] for rule in spec['rules']] + [spec['default']]
+        self.fields = sorted({field for field, _, _ in self.rules})
+        self.headline_key = spec['headline']
+        self.fallback_key = spec['fallback']
+        self.locales = locales
+        self._advice = {}
+
+    def message(self, locale, key):
+        messages = self.locales[locale]['messages']
+        return messages[key] if key in messages else self.locales[DEFAULT_LOCALE]['messages'][key]
+
+    def advice(self, locale, rule, crop):
+        key = (locale, rule, crop)
+        text = self._advice.get(key)
+        if text is None:
+            catalog = self.locales[locale]
+            name = catalog['crops'].get(crop, crop) if crop else catalog['your_crop']
+            text = self.message(locale, self.advice_keys[rule]).format(crop=name)
+            if len(self._advice) < MAX_ADVICE_ENTRIES:
+                self._advice[key] = text
+        return text
+
+    def classify(self, rows):
+        """
+        Index of the first matching rule for each row (len(rules) for the default advice).
+        """
+        columns = {field: np.array([getattr(row, field) for row in rows], dtype=float) for field in self.fields}
+        choice = np.full(len(rows), len(self.rules))
+        # Applied last-to-first, so the first matching rule wins
+        for i in range(len(self.rules) - 1, -1, -1):
+            field, op, value = self.rules[i]
+            choice[op(columns[field], value)] = i
+        return choice
+
+    def render(self, predictions, rows, locale=DEFAULT_LOCALE):
+        """
+        One summary per (prediction, validated input row).
+        """
+        if locale not in self.locales:
+            locale = DEFAULT_LOCALE
+        headline = self.message(locale, self.headline_key)
+        summaries = []
+        for prediction, rule, row in zip(predictions, self.classify(rows).tolist(), rows):
+            try:
+                summaries.append(f"{headline.format(prediction=prediction)} {self.advice(locale, rule, row.crop)}")
+            except (KeyError, ValueError, TypeError, IndexError) as e:
+                logger.warning("Summary rendering failed (%s), using the fallback text", e)
+                summaries.append(self.message(locale, self.fallback_key).format(prediction=prediction))
+        return summaries
+
+
+_renderers = None
+
+
+def renderers():
+    """
+    Compiled renderers by model name, loaded on first use.
+    """
+    global _renderers
+    if _renderers is None:
+        with open(RULES_PATH, encoding='utf-8') as f:
+            specs = json.load(f)
+        locales = _load_locales()
+        _renderers = {name: SummaryRenderer(spec, locales) for name, spec in specs.items()}
+    return _renderers
+
+
+def render_summaries(model_name, predictions, rows, locale=DEFAULT_LOCALE):
+    return renderers()[model_name].render(predictions, rows, locale)
+
+
+def supported_locales():
+    return sorted(next(iter(renderers().values())).locales)
+
+
+def resolve_locale(value, accept_language=None):
+    """
+    Locale for a request: the explicit `value` if supported (exact, or its language part,
+    so "hi-IN" matches "hi"), else the first supported language in an Accept-Language
+    header, else the default. Returns (locale, error or None); an unsupported explicit
+    value is an error.
+    """
+    available = set(supported_locales())
+
+    def match(tag):
+        tag = tag.strip().lower()
+        if tag in available:
+            return tag
+        language = tag.split('-')[0]
+        return language if language in available else None
+
+    if value:
+        locale = match(value)
+        if locale is None:
+            return None, f"locale must be one of {sorted(available)}"
+        return locale, None
+    for part in (accept_language or '').split(','):
+        locale = match(part.split(';')[0]) if part.strip() else None
+        if locale:
+            return locale, None
+    return DEFAULT_LOCALE, None
@@ -0,0 +1,287 @@
+"""
+Regional and per-crop model variants.
+
+With `--variants`, the trainer also fits each model on the rows of every district, state
+or crop that has enough labeled rows. It exports each fit as a separately versioned model,
+e.g. `yield__state_punjab` (see training/variants.py), and lists them in
+`<name>_variants.json`. The service routes each validated row to the most specific variant
+that matches its district, then state, then crop. The variant must also have been trained
+on the row's crop and soil type, because unseen categories are one-hot encoded as zeros.
+Rows that match no variant go to the global model. Batch predictions, simulations, irrigation
+schedules and the offline scorer (score_batch.py) route every row the same way.
+
+Variants are loaded on first use into a ModelPool. The pool is an LRU bounded by model
+count (ML_MODEL_POOL_SIZE) and by the artifact bytes of the resident models
+(ML_MODEL_POOL_MB), so dozens of regional models can be served without every worker
+holding all of them. ML_MODEL_VARIANTS=0 serves the global models only.
+"""
+import os
+import re
+import logging
+import time
+import threading
+from collections import OrderedDict
+from time import perf_counter
+import numpy as np
+from .metrics import ROUTED_PREDICTIONS, VALIDATION_ERRORS, timed
+from .schemas import parse_batch
+from .summaries import DEFAULT_LOCALE
+
+logger = logging.getLogger(__name__)
+
+# Routing order, most specific first
+DIMENSIONS = ('district', 'state', 'crop')
+POOL_SIZE = int(os.environ.get('ML_MODEL_POOL_SIZE', '8'))
+POOL_MB = float(os.environ.get('ML_MODEL_POOL_MB', '1024'))
+# A variant that failed to load is not retried for this long; its rows use the global model meanwhile
+RETRY_S = 60.0
+
+
+def variants_enabled():
+    return os.environ.get('ML_MODEL_VARIANTS', '1').lower() not in ('0', 'false', 'no')
+
+
+def normalize(value):
+    return ' '.join(str(value).split()).casefold()
+
+
+def region_key(dimension, state=None, district=None, crop=None):
+    """
+    Lookup key of a row for one dimension, or None if the row lacks the fields. District
+    names repeat across states, so districts are keyed as "state/district".
+    """
+    if dimension == 'district':
+        return f"{normalize(state)}/{normalize(district)}" if state and district else None
+    value = state if dimension == 'state' else crop
+    return normalize(value) if value else None
+
+
+def variant_name(name, dimension, key):
+    """
+    Artifact name of a variant, safe for file names: yield__district_punjab-ludhiana.
+    """
+    return f"{name}__{dimension}_{re.sub(r'[^a-z0-9]+', '-', key).strip('-')}"
+
+
+def variant_kind(variant):
+    return variant.partition('__')[0]
+
+
+class VariantRouter:
+    """
+    Picks the variant for a validated row from one model's variant index.
+    """
+    def __init__(self, index):
+        self.index = index
+        self._lookup = {dimension: {} for dimension in DIMENSIONS}
+        for entry in index['variants']:
+            self._lookup[entry['dimension']][entry['key']] = (
+                entry['name'], frozenset(entry['categories']['crop']), frozenset(entry['categories']['soil_type']))
+
+    def __len__(self):
+        return len(self.index['variants'])
+
+    def route(self, row):
+        """
+        Variant name for `row`, or None for the global model.
+        """
+        state, district = getattr(row, 'state', None), getattr(row, 'district', None)
+        for dimension in DIMENSIONS:
+            table = self._lookup[dimension]
+            if not table:
+                continue
+            match = table.get(region_key(dimension, state, district, row.crop))
+            if match is not None and row.crop in match[1] and row.soil_type in match[2]:
+                return match[0]
+        return None
+
+
+class ModelPool:
+    """
+    LRU pool of loaded variant models, bounded by count and by their artifact bytes (see
+    TabularModel.nbytes). Each variant is loaded by `loader(name)` once, even under
+    concurrent first requests. Evicted models stay usable by requests that already hold them.
+    `on_load()` is called after every load attempt.
+    """
+    def __init__(self, loader, max_models=POOL_SIZE, max_bytes=POOL_MB * 1024 * 1024, on_load=None):
+        self._loader = loader
+        self._on_load = on_load
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "load_errors": 0}
+        self.load_seconds = {}
+        self._failed = {}
+
+    def get(self, name):
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                self._models.move_to_end(name)
+                self.counters["hits"] += 1
+                return model
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            with self._lock:
+                model = self._models.get(name)
+                if model is not None:
+                    self._models.move_to_end(name)
+                    self.counters["hits"] += 1
+                    return model
+                failed = self._failed.get(name)
+                if failed is not None and time.monotonic() - failed[0] < RETRY_S:
+                    raise RuntimeError(f"loading {name} failed {time.monotonic() - failed[0]:.0f}s ago: {failed[1]}")
+                self.counters["misses"] += 1
+            started = perf_counter()
+            try:
+                model = self._loader(name)
+            except Exception as e:
+                with self._lock:
+                    self.counters["load_errors"] += 1
+                    self._failed[name] = (time.monotonic(), str(e))
+                if self._on_load is not None:
+                    self._on_load()
+                raise
+            with self._lock:
+                self._failed.pop(name, None)
+                self.load_seconds[name] = round(perf_counter() - started, 4)
+                self._models[name] = model
+                self._evict()
+            if self._on_load is not None:
+                self._on_load()
+        return model
+
+    def _evict(self):
+        # The newest model always stays, even if it alone exceeds max_bytes
+        while len(self._models) > 1 and (len(self._models) > self.max_models or self.nbytes > self.max_bytes):
+            name, _ = self._models.popitem(last=False)
+            self.counters["evictions"] += 1
+            logger.info("[pool] Evicted model variant %s", name)
+
+    @property
+    def nbytes(self):
+        return sum(model.nbytes for model in self._models.values())
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models.items())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "models": {name: {"version": m.version, "bytes": m.nbytes, "load_s": self.load_seconds.get(name)}
+                           for name, m in self._models.items()},
+                "size": len(self._models), "max_size": self.max_models,
+                "bytes": self.nbytes, "max_bytes": int(self.max_bytes), **self.counters,
+            }
+
+
+class RoutedModel:
+    """
+    The predict/predict_batch/score interface of a TabularModel, with each row served by
+    its variant (see VariantRouter) or by the global model.
+    """
+    def __init__(self, model, router, pool):
+        self.model = model
+        self.router = router
+        self.pool = pool
+        self.name = model.name
+        self.schema = model.schema
+        self.version = model.version
+        self.valid_crops = model.valid_crops
+        self.valid_soil_types = model.valid_soil_types
+
+    def parse(self, features):
+        return self.model.parse(features)
+
+    def _variant(self, variant):
+        """
+        The loaded variant, or the global model if it cannot be loaded.
+        """
+        if variant is None:
+            return self.model
+        try:
+            return self.pool.get(variant)
+        except Exception:
+            logger.exception("[pool] Could not load model variant %s, using the global %s model", variant, self.name)
+            return self.model
+
+    def predict(self, features, interval=None, summary=DEFAULT_LOCALE):
+        """
+        As TabularModel.predict.
+        """
+        features, errors = self.parse(features)
+        if errors:
+            raise ValueError(f"Input validation failed: {errors}")
+        variant = self.router.route(features)
+        model = self._variant(variant)
+        ROUTED_PREDICTIONS.inc(model=self.name, variant=variant if model is not self.model else "global")
+        return model.predict(features, interval=interval, summary=summary)
+
+    def predict_batch(self, rows, interval=None, summary=DEFAULT_LOCALE):
+        """
+        As TabularModel.predict_batch: rows are validated once, grouped by variant and
+        scored with one predict_batch call per variant. Results of rows served by a variant
+        carry its name as "variant".
+        """
+        with timed(self.name, 'validation'):
+            inputs, errors = parse_batch(self.schema, rows, self.model.valid_crops, self.model.valid_soil_types)
+        results = [None] * len(rows)
+        groups = {}
+        for i, features in enumerate(inputs):
+            if features is None:
+                results[i] = {"errors": errors[i]}
+            else:
+                groups.setdefault(self.router.route(features), []).append(i)
+        n_invalid = len(rows) - sum(len(members) for members in groups.values())
+        if n_invalid:
+            VALIDATION_ERRORS.inc(n_invalid, model=self.name, version=self.model.version)
+        for variant, members in groups.items():
+            model = self._variant(variant)
+            served_by = variant if model is not self.model else None
+            scored = model.predict_batch([inputs[i] for i in members], interval=interval, summary=summary)
+            for i, result in zip(members, scored):
+                if served_by is not None:
+                    result["variant"] = served_by
+                results[i] = result
+            ROUTED_PREDICTIONS.inc(len(members), model=self.name, variant=served_by or "global")
+        return results
+
+    def routes(self, rows):
+        """
+        Route rows for `score`. `rows` are objects with crop, soil_type and optionally state
+        and district. Returns (variants, index): the distinct variants (None for the global
+        model) and each row's position in them. Each distinct row is routed once.
+        """
+        positions, seen = {}, {}
+        index = np.empty(len(rows), dtype=np.intp)
+        for i, row in enumerate(rows):
+            key = (getattr(row, 'state', None), getattr(row, 'district', None), row.crop, row.soil_type)
+            code = seen.get(key)
+            if code is None:
+                code = seen[key] = positions.setdefault(self.router.route(row), len(positions))
+            index[i] = code
+        return list(positions), index
+
+    def score(self, numeric, categories, routes=None):
+        """
+        As TabularModel.score, with the rows grouped by `routes` (see `routes`) and each group
+        scored by its variant. Without routes every row is scored by the global model.
+        """
+        if routes is None:
+            return self.model.score(numeric, categories)
+        variants, index = routes
+        if len(variants) == 1:
+            model = self._variant(variants[0])
+            ROUTED_PREDICTIONS.inc(len(index), model=self.name, variant=variants[0] if model is not self.model else "global")
+            return model.score(numeric, categories)
+        numeric, categories = np.asarray(numeric), np.asarray(categories, dtype=object)
+        preds = np.empty(len(index), dtype=float)
+        for code, variant in enumerate(variants):
+            members = np.nonzero(index == code)[0]
+            model = self._variant(variant)
+            preds[members] = model.score(numeric[members], categories[members])
+            ROUTED_PREDICTIONS.inc(len(members), model=self.name, variant=variant if model is not self.model else "global")
+        return preds
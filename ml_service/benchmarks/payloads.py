@@ -0,0 +1,35 @@
+"""
+Synthetic plot payloads drawn from the value ranges in app/synthetic_farm_data.csv.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'app', 'synthetic_farm_data.csv')
+
+# CSV column -> request field, as in train_yield_irrigation.py
+NUMERIC_COLUMNS = {'rainfall': 'rainfall', 'temperature': 'temperature', 'soil_moisture': 'soil_moisture', 'area': 'areaSqM'}
+CATEGORICAL_COLUMNS = {'crop_type': 'crop', 'soil_type': 'soil_type'}
+
+
+def load_ranges(path=DATA_PATH):
+    """
+    Return ({field: (min, max)}, {field: [values]}) for the request fields.
+    """
+    df = pd.read_csv(path)
+    numeric = {field: (float(df[col].min()), float(df[col].max())) for col, field in NUMERIC_COLUMNS.items()}
+    categorical = {field: sorted(df[col].dropna().unique().tolist()) for col, field in CATEGORICAL_COLUMNS.items()}
+    return numeric, categorical
+
+
+def make_payloads(n, seed=0, path=DATA_PATH):
+    """
+    Generate `n` request payloads with numeric values drawn uniformly within the observed
+    ranges (so few repeat and the prediction cache stays cold) and categories drawn from
+    the observed values.
+    """
+    rng = np.random.default_rng(seed)
+    numeric, categorical = load_ranges(path)
+    columns = {field: rng.uniform(lo, hi, n).round(2) for field, (lo, hi) in numeric.items()}
+    columns.update({field: rng.choice(values, n) for field, values in categorical.items()})
+    return [{field: values[i].item() for field, values in columns.items()} for i in range(n)]
@@ -0,0 +1,419 @@
+"""
+Offline inference benchmarks. Run from ml_service/:
+
+    python -m benchmarks.run                       # all suites, results in benchmarks/results/
+    python -m benchmarks.run --suite latency --suite http --output before.json
+    python -m benchmarks.run --compare before.json # exit 1 if a tracked metric regressed
+
+No network or external services are needed: models are loaded from models/ and the
+HTTP suite drives create_app() through Flask's test client.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+
+from .payloads import make_payloads
+
+SUITES = ('latency', 'throughput', 'interval', 'drift', 'parity', 'cold_start', 'startup', 'http')
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Lower is better for every tracked metric; throughput is compared as time per row
+TRACKED = {
+    'latency': ('p50_ms', 'p95_ms', 'p99_ms'),
+    'throughput': ('ms_per_row',),
+    'interval': ('ms_per_row',),
+    'drift': ('p50_ms', 'ms_per_row', 'report_ms'),
+    'parity': ('max_abs_error', 'p50_ms', 'ms_per_row'),
+    'cold_start': ('load_s', 'first_predict_ms', 'unique_mb'),
+    'startup': ('import_s', 'create_app_s', 'first_request_ms'),
+    'http': ('p50_ms', 'p95_ms', 'p99_ms'),
+}
+
+
+def percentiles(samples_s):
+    ms = np.asarray(samples_s) * 1000.0
+    return {
+        "n": len(ms),
+        "mean_ms": round(float(ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "max_ms": round(float(ms.max()), 4),
+    }
+
+
+def load_models(compiled, load_mode):
+    from app.models.yield_model import YieldModel
+    from app.models.irrigation_model import IrrigationModel
+    return {cls.name: cls(compiled=compiled, load_mode=load_mode) for cls in (YieldModel, IrrigationModel)}
+
+
+def model_info(model):
+    """
+    Size of the loaded model, so results from differently sized models can be told apart.
+    """
+    if model.compiled is not None:
+        return {"trees": int(len(model.compiled.roots)), "nodes": int(len(model.compiled.feature)), "depth": int(model.compiled.depth)}
+    estimators = getattr(model.model, 'estimators_', [model.model])
+    trees = [getattr(e, 'tree_', None) for e in np.ravel(estimators)]
+    return {
+        "trees": len(trees),
+        "nodes": int(sum(t.node_count for t in trees if t is not None)),
+        "depth": int(max((t.max_depth for t in trees if t is not None), default=0)),
+    }
+
+
+def bench_latency(models, payloads, warmup=20):
+    results = {}
+    for name, model in models.items():
+        for row in payloads[:warmup]:
+            model.predict(row)
+        samples = []
+        for row in payloads:
+            start = time.perf_counter()
+            model.predict(row)
+            samples.append(time.perf_counter() - start)
+        results[name] = percentiles(samples)
+    return results
+
+
+def bench_throughput(models, payloads, batch_sizes, min_rows=2000):
+    results = {}
+    for name, model in models.items():
+        model.predict_batch(payloads[:max(batch_sizes)])
+        per_size = {}
+        for size in batch_sizes:
+            batches = [payloads[i:i + size] for i in range(0, len(payloads) - size + 1, size)]
+            repeats = max(1, -(-min_rows // (len(batches) * size)))
+            rows = 0
+            start = time.perf_counter()
+            for _ in range(repeats):
+                for batch in batches:
+                    model.predict_batch(batch)
+                    rows += len(batch)
+            elapsed = time.perf_counter() - start
+            per_size[str(size)] = {
+                "rows": rows,
+                "rows_per_s": round(rows / elapsed, 1),
+                "ms_per_row": round(elapsed * 1000.0 / rows, 5),
+            }
+        results[name] = per_size
+    return results
+
+
+def bench_interval(models, payloads, batch_sizes, level=0.9, min_rows=2000):
+    """
+    Cost of prediction intervals: per batch size, time per row without and with
+    `interval=level`, and the relative overhead.
+    """
+    results = {}
+    for name, model in models.items():
+        model.predict_batch(payloads[:max(batch_sizes)], interval=level)
+        per_size = {}
+        for size in batch_sizes:
+            batches = [payloads[i:i + size] for i in range(0, len(payloads) - size + 1, size)]
+            repeats = max(1, -(-min_rows // (len(batches) * size)))
+            timings = {}
+            for label, interval in (("plain", None), ("interval", level)):
+                rows = 0
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    for batch in batches:
+                        model.predict_batch(batch, interval=interval)
+                        rows += len(batch)
+                timings[label] = (time.perf_counter() - start) * 1000.0 / rows
+            per_size[str(size)] = {
+                "plain_ms_per_row": round(timings["plain"], 5),
+                "ms_per_row": round(timings["interval"], 5),
+                "overhead": round(timings["interval"] / timings["plain"] - 1.0, 3),
+            }
+        results[name] = {"method": model.interval_method, "level": level, "batch_sizes": per_size}
+    return results
+
+
+def bench_drift(models, payloads, batch_size=512, min_rows=2000):
+    """
+    Cost of input drift monitoring (see app/drift.py): single-row p50 and time per row at
+    `batch_size` with and without the monitor, and the time to build a drift report.
+    """
+    results = {}
+    for name, model in models.items():
+        monitor = model.drift
+        if monitor is None:
+            results[name] = {"skipped": "no training profile"}
+            continue
+        batches = [payloads[i:i + batch_size] for i in range(0, len(payloads) - batch_size + 1, batch_size)]
+        repeats = max(1, -(-min_rows // (len(batches) * batch_size)))
+        timings = {}
+        for label, drift in (("off", None), ("on", monitor)):
+            model.drift = drift
+            single = []
+            for row in payloads:
+                start = time.perf_counter()
+                model.predict(row)
+                single.append(time.perf_counter() - start)
+            rows = 0
+            start = time.perf_counter()
+            for _ in range(repeats):
+                for batch in batches:
+                    model.predict_batch(batch)
+                    rows += len(batch)
+            timings[label] = (percentiles(single)["p50_ms"], (time.perf_counter() - start) * 1000.0 / rows)
+        model.drift = monitor
+        start = time.perf_counter()
+        for _ in range(100):
+            monitor.report()
+        results[name] = {
+            "off_p50_ms": timings["off"][0],
+            "p50_ms": timings["on"][0],
+            "off_ms_per_row": round(timings["off"][1], 5),
+            "ms_per_row": round(timings["on"][1], 5),
+            "report_ms": round((time.perf_counter() - start) * 10.0, 4),
+        }
+    return results
+
+
+def bench_parity(payloads, batch_size=512):
+    """
+    The flat export (load_mode='mmap') against the joblib/sklearn pipeline: largest absolute
+    difference between their predictions on `payloads`, and single-row and batch timings of each.
+    """
+    loaded = {'joblib': load_models(False, 'joblib'), 'flat': load_models(True, 'mmap')}
+    results = {}
+    for name in loaded['joblib']:
+        per_mode = {}
+        preds = {}
+        for mode, models in loaded.items():
+            model = models[name]
+            preds[mode] = np.array([r["prediction"] for r in model.predict_batch(payloads, summary=None)])
+            latency = bench_latency({name: model}, payloads[:200])[name]
+            start = time.perf_counter()
+            for i in range(0, len(payloads), batch_size):
+                model.predict_batch(payloads[i:i + batch_size], summary=None)
+            per_mode[mode] = {"load_mode": model.load_mode, "p50_ms": latency["p50_ms"], "p99_ms": latency["p99_ms"],
+                              "ms_per_row": round((time.perf_counter() - start) * 1000.0 / len(payloads), 5)}
+        results[name] = {"rows": len(payloads), "max_abs_error": float(np.abs(preds['flat'] - preds['joblib']).max()), **per_mode}
+    return results
+
+
+_COLD_START_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+from app.models.yield_model import YieldModel
+from app.models.irrigation_model import IrrigationModel
+from app.memory import memory_report
+t1 = time.perf_counter()
+models = [cls(compiled={compiled}, load_mode={load_mode!r}) for cls in (YieldModel, IrrigationModel)]
+t2 = time.perf_counter()
+for m in models:
+    m.predict({row!r})
+t3 = time.perf_counter()
+print(json.dumps(dict(import_s=t1 - t0, load_s=t2 - t1, first_predict_ms=(t3 - t2) * 1000.0 / len(models),
+                      sklearn_imported='sklearn' in sys.modules, **memory_report())))
+"""
+
+
+def bench_cold_start(configs, row, runs=3):
+    """
+    Load both models in fresh interpreter processes, one per configuration, and report
+    import time, load time, first-prediction time and the worker's memory after loading.
+    The best of `runs` is kept to reduce noise from the page cache and scheduler.
+    """
+    results = {}
+    for label, compiled, load_mode in configs:
+        script = _COLD_START_SCRIPT.format(compiled=compiled, load_mode=load_mode, row=row)
+        best = None
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, '-c', script], cwd=SERVICE_DIR, capture_output=True, text=True,
+                                 env={**os.environ, 'PYTHONWARNINGS': 'ignore'})
+            if out.returncode != 0:
+                raise RuntimeError(f"cold start ({label}) failed:\n{out.stderr}")
+            run = json.loads(out.stdout.strip().splitlines()[-1])
+            if best is None or run['load_s'] < best['load_s']:
+                best = run
+        results[label] = {k: round(v, 4) if isinstance(v, float) else v for k, v in best.items()}
+    return results
+
+
+_STARTUP_SCRIPT = """
+import json, time
+t0 = time.perf_counter()
+from app import create_app
+app = create_app(eager={eager})
+t1 = time.perf_counter()
+client = app.test_client()
+client.post('/api/predict-yield', json={row!r})
+t2 = time.perf_counter()
+print(json.dumps(dict(import_s=app.extensions['ml_service']['registry'].startup['import_s'],
+                      create_app_s=t1 - t0, first_request_ms=(t2 - t1) * 1000.0)))
+"""
+
+
+def bench_startup(row, runs=3):
+    """
+    Time from a fresh interpreter to a serving Flask app (imports and create_app) and to the
+    first yield response, with lazy and with eager model loading. The best of `runs` is kept.
+    """
+    results = {}
+    for label, eager in (('lazy', False), ('eager', True)):
+        best = None
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT.format(eager=eager, row=row)], cwd=SERVICE_DIR,
+                                 capture_output=True, text=True, env={**os.environ, 'PYTHONWARNINGS': 'ignore'})
+            if out.returncode != 0:
+                raise RuntimeError(f"startup ({label}) failed:\n{out.stderr}")
+            run = json.loads(out.stdout.strip().splitlines()[-1])
+            if best is None or run['create_app_s'] < best['create_app_s']:
+                best = run
+        results[label] = {k: round(v, 4) for k, v in best.items()}
+    return results
+
+
+def bench_http(payloads, concurrency=8):
+    """
+    Drive the Flask app in-process through its test client from `concurrency` threads.
+    """
+    from app import create_app
+    app = create_app()
+    endpoints = ('/api/predict-yield', '/api/predict-irrigation')
+    local = threading.local()
+
+    def call(i):
+        # One test client per thread; the app and its models are shared
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        start = time.perf_counter()
+        response = client.post(endpoints[i % len(endpoints)], json=payloads[i])
+        return time.perf_counter() - start, response.status_code
+
+    for i in range(min(20, len(payloads))):
+        call(i)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(len(payloads))))
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for _, status in results if status != 200)
+    return {
+        "concurrency": concurrency,
+        "requests_per_s": round(len(results) / elapsed, 1),
+        "errors": errors,
+        **percentiles([latency for latency, _ in results]),
+    }
+
+
+def compare(current, baseline, tolerance):
+    """
+    Return a list of (metric, baseline, current) for tracked metrics that got more than
+    `tolerance` (a fraction) worse than in `baseline`.
+    """
+    regressions = []
+
+    def walk(path, cur, base, keys):
+        for key, value in cur.items():
+            if key not in base:
+                continue
+            if isinstance(value, dict):
+                walk(path + (key,), value, base[key], keys)
+            elif key in keys and base[key] and value > base[key] * (1 + tolerance):
+                regressions.append(('.'.join(path + (key,)), base[key], value))
+
+    for suite, keys in TRACKED.items():
+        if suite in current.get('results', {}) and suite in baseline.get('results', {}):
+            walk((suite,), current['results'][suite], baseline['results'][suite], keys)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suite', action='append', choices=SUITES, help='suite to run (repeatable, default: all)')
+    parser.add_argument('--rows', type=int, default=1000, help='payloads per latency/HTTP run')
+    parser.add_argument('--batch-sizes', default='1,8,64,512', help='comma-separated batch sizes for the throughput suite')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads for the HTTP suite')
+    parser.add_argument('--compiled', action='store_true', help='benchmark the compiled inference path')
+    parser.add_argument('--load-mode', default='joblib', choices=('joblib', 'mmap'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='result file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='baseline result file; exit 1 if a tracked metric regressed')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before a metric counts as regressed')
+    args = parser.parse_args(argv)
+
+    # Measure the models, not the prediction cache
+    os.environ['ML_CACHE_SIZE'] = '0'
+    os.environ['ML_COMPILED_INFERENCE'] = '1' if args.compiled else '0'
+    os.environ['ML_MODEL_LOAD_MODE'] = args.load_mode
+    suites = args.suite or list(SUITES)
+    batch_sizes = [int(s) for s in args.batch_sizes.split(',')]
+    payloads = make_payloads(max(args.rows, max(batch_sizes)), seed=args.seed)
+
+    results = {}
+    if 'parity' in suites:
+        print('Running parity suite...')
+        results['parity'] = bench_parity(payloads[:max(args.rows, max(batch_sizes))])
+    if any(suite in suites for suite in ('latency', 'throughput', 'interval', 'drift')):
+        models = load_models(args.compiled, args.load_mode)
+        results['models'] = {name: {"version": m.version, **model_info(m)} for name, m in models.items()}
+        if 'latency' in suites:
+            print('Running latency suite...')
+            results['latency'] = bench_latency(models, payloads[:args.rows])
+        if 'throughput' in suites:
+            print('Running throughput suite...')
+            results['throughput'] = bench_throughput(models, payloads, batch_sizes)
+        if 'interval' in suites:
+            print('Running interval suite...')
+            results['interval'] = bench_interval(models, payloads, batch_sizes)
+        if 'drift' in suites:
+            print('Running drift suite...')
+            results['drift'] = bench_drift(models, payloads[:max(args.rows, max(batch_sizes))], max(batch_sizes))
+    if 'cold_start' in suites:
+        print('Running cold start suite...')
+        configs = [('joblib', False, 'joblib'), ('joblib_compiled', True, 'joblib'), ('mmap', True, 'mmap')]
+        results['cold_start'] = bench_cold_start(configs, payloads[0])
+    if 'startup' in suites:
+        print('Running startup suite...')
+        results['startup'] = bench_startup(payloads[0])
+    if 'http' in suites:
+        print('Running HTTP suite...')
+        results['http'] = bench_http(payloads[:args.rows], concurrency=args.concurrency)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "config": {"compiled": args.compiled, "load_mode": args.load_mode, "rows": args.rows,
+                   "batch_sizes": batch_sizes, "concurrency": args.concurrency, "seed": args.seed},
+        "results": results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.now().strftime('%Y%m%d%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for metric, before, after in regressions:
+            print(f"REGRESSION {metric}: {before} -> {after}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+import os
+from app.memory import memory_report
+from app.sensors import sensors_enabled
+
+bind = "0.0.0.0:5000"
+
+# Import the app (and load both models) once in the master so workers share the
+# model memory copy-on-write instead of each loading a private copy. Combine with
+# ML_MODEL_LOAD_MODE=mmap to also share the tree arrays through the page cache.
+preload_app = os.environ.get("ML_PRELOAD_APP", "1").lower() in ("1", "true", "yes")
+# Preloading only shares memory if the models are loaded in the master, so load them eagerly there.
+# Without preload each worker starts immediately and loads a model on its first request.
+os.environ.setdefault("ML_EAGER_LOAD", "1" if preload_app else "0")
+
+
+def check_sensor_workers(workers):
+    """
+    Sensor aggregates are per process (see app/sensors.py), so the sensor routes can only be
+    served by a single worker. Raises RuntimeError for any other configuration.
+    """
+    if workers > 1 and sensors_enabled():
+        raise RuntimeError(f"{workers} workers cannot serve /api/sensors/*, whose state lives in one process. "
+                           "Set ML_SENSORS=0 for this server and run the sensor endpoints in a separate "
+                           "single-worker process (gunicorn -w 1) or the ASGI app (python run_asgi.py).")
+
+
+def when_ready(server):
+    server.log.info(f"[memory] master pid={os.getpid()} {memory_report()}")
+    # Raised before any worker is spawned; gunicorn prints the error and exits
+    check_sensor_workers(server.cfg.workers)
+
+
+def post_worker_init(worker):
+    # Start the model watcher now rather than on the first request, so idle workers also follow reloads.
+    # The ASGI app (run_asgi:app) starts its own watcher from its lifespan handler.
+    state = getattr(worker.wsgi, "extensions", {}).get("ml_service")
+    if state is not None:
+        state["registry"].ensure_watcher()
+    worker.log.info(f"[memory] worker pid={worker.pid} {memory_report()}")
@@ -0,0 +1,315 @@
+"""
+Offline batch scoring of farm exports (CSV or Parquet) with the latest yield and
+irrigation models, without going through the HTTP service:
+
+    python score_batch.py ../exported_farm_data.csv -o scored.csv
+    python score_batch.py plots.parquet -o scored.parquet --workers 4 --models yield
+
+The input is read in chunks and column aliases (crop_type -> crop, area -> areaSqM) are
+mapped as in training (training/ingest.py). Chunks are scored in a process pool whose
+workers load the models once, with at most two chunks per worker in flight, and written in
+input order, so memory stays bounded by the chunk size rather than the file size.
+
+Each output row keeps the input columns plus `input_row` (0-based position in the input)
+and one `<model>_prediction` column per model. If the input already has an `input_row`
+column, the position is written as `_input_row` (with more leading underscores as needed).
+Rows that cannot be scored, such as rows with empty rainfall, temperature or soil_moisture
+cells, go to a side file (`--rejects`, default <output>.rejects.csv) with their validation
+errors instead of aborting the run.
+
+The 7-day features follow each plot's readings across chunks (assuming the file is in time
+order per plot), carrying the last readings of every plot seen so far; rows without a
+plot_id or timestamp use their own readings, as in the service.
+
+Rows are scored by the regional or per-crop variant their state, district and crop route
+to, as in the service (see app/variants.py). Each worker loads the variants it needs into
+its own pool (ML_MODEL_POOL_SIZE, ML_MODEL_POOL_MB); ML_MODEL_VARIANTS=0 scores every
+row with the global models.
+"""
+import os
+import sys
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from app.features import ROLLING_FEATURES, SOURCES, WINDOW, add_rolling_features
+from app.schemas import parse_batch
+from training.ingest import NUMERIC_COLUMNS, normalize_chunk
+
+# Optional: Parquet input/output needs pyarrow
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    has_pyarrow = True
+except ImportError:
+    has_pyarrow = False
+
+CHUNK_SIZE = 50_000
+# Fields a row must have to be scored; the schemas alone would default soil_moisture to 0 for yield
+REQUIRED = ('rainfall', 'temperature', 'soil_moisture', 'crop')
+# Filled like the training script when the column is empty or absent
+DEFAULT_SOIL_TYPE = 'unknown'
+# Column holding each row's position in the input
+ROW_COLUMN = 'input_row'
+
+_models = {}
+
+
+def load_models(names, compiled=None, load_mode=None):
+    """
+    The latest model of each of `names`, routed to its variants when it has any.
+    """
+    from app.manifest import load_variant_index
+    from app.models.base import MODEL_DIR
+    from app.models.yield_model import YieldModel
+    from app.models.irrigation_model import IrrigationModel
+    from app.variants import ModelPool, RoutedModel, VariantRouter, variant_kind, variants_enabled
+    classes = {cls.name: cls for cls in (YieldModel, IrrigationModel)}
+    pool = ModelPool(lambda variant: classes[variant_kind(variant)](compiled=compiled, load_mode=load_mode, variant=variant))
+    models = {}
+    for name in names:
+        model = classes[name](compiled=compiled, load_mode=load_mode)
+        router = VariantRouter(load_variant_index(MODEL_DIR, name)) if variants_enabled() else None
+        models[name] = RoutedModel(model, router, pool) if router else model
+    return models
+
+
+def _init_worker(names, compiled, load_mode):
+    _models.update(load_models(names, compiled, load_mode))
+
+
+def read_chunks(path, chunk_size):
+    """
+    Yield DataFrame chunks of a CSV or Parquet file. Non-numeric columns are read as strings,
+    so every chunk has the same column types.
+    """
+    if path.endswith('.parquet'):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+        return
+    columns = pd.read_csv(path, nrows=0).columns
+    dtypes = {c: 'string' for c in columns if c not in NUMERIC_COLUMNS}
+    yield from pd.read_csv(path, dtype=dtypes, chunksize=chunk_size)
+
+
+class RollingCarry:
+    """
+    Last WINDOW - 1 readings per plot from earlier chunks, so the rolling features of a chunk
+    see the plot's history. Memory grows with the number of plots, not rows.
+    """
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.history = None
+
+    def apply(self, chunk):
+        chunk = chunk.copy()
+        for feature, source in ROLLING_FEATURES.items():
+            chunk[feature] = chunk[source] if source in chunk.columns else np.nan
+        if 'plot_id' not in chunk.columns or 'timestamp' not in chunk.columns:
+            return chunk
+        # Only readings that can be scored enter a window, as in training (rows are dropped before rolling)
+        readings = chunk.loc[chunk[list(SOURCES)].notna().all(axis=1), ['plot_id', 'timestamp', *SOURCES]]
+        readings = readings[readings['plot_id'].notna() & readings['timestamp'].notna()]
+        if readings.empty:
+            return chunk
+        carried = len(self.history) if self.history is not None else 0
+        rolled = add_rolling_features(pd.concat([self.history, readings], ignore_index=True) if carried else
+                                      readings.reset_index(drop=True), self.window)
+        chunk.loc[readings.index, list(ROLLING_FEATURES)] = rolled[list(ROLLING_FEATURES)].to_numpy()[carried:]
+        ordered = rolled.sort_values(['plot_id', 'timestamp'], kind='stable')
+        self.history = ordered.groupby('plot_id', sort=False).tail(self.window - 1)[['plot_id', 'timestamp', *SOURCES]]
+        return chunk
+
+
+def prepare_chunk(chunk, default_area=None):
+    """
+    Canonical columns for one raw chunk: aliases mapped and types coerced as in training,
+    and soil_type (and areaSqM, if `default_area` is set) filled where missing.
+    """
+    chunk = normalize_chunk(chunk)
+    if 'soil_type' not in chunk.columns:
+        chunk['soil_type'] = DEFAULT_SOIL_TYPE
+    chunk['soil_type'] = chunk['soil_type'].fillna(DEFAULT_SOIL_TYPE)
+    if default_area is not None:
+        chunk['areaSqM'] = chunk['areaSqM'].fillna(default_area) if 'areaSqM' in chunk.columns else float(default_area)
+    return chunk
+
+
+def position_column(columns):
+    """
+    Name for the input position column that none of the input `columns` uses.
+    """
+    name = ROW_COLUMN
+    while name in columns:
+        name = f"_{name}"
+    return name
+
+
+def _records(chunk, fields):
+    # Missing cells are left out of the row, so they are reported as "Missing field: ..."
+    values = chunk.reindex(columns=fields).astype(object)
+    values = values.where(values.notna(), None)
+    return [{k: v for k, v in zip(fields, row) if v is not None} for row in values.itertuples(index=False)]
+
+
+def score_chunk(chunk, models=None):
+    """
+    Validate and score one prepared chunk. Returns (scored, rejects): the valid rows with a
+    `<model>_prediction` column per model, and the other rows with an `errors` column.
+    """
+    models = models if models is not None else _models
+    n = len(chunk)
+    errors = [[] for _ in range(n)]
+    for field in REQUIRED:
+        missing = chunk[field].isna().to_numpy() if field in chunk.columns else np.ones(n, dtype=bool)
+        for i in np.nonzero(missing)[0]:
+            errors[i].append(f"Missing field: {field}")
+    # Rows already missing a field skip the schemas, so a clean batch validates in one call
+    candidates = np.array([not e for e in errors], dtype=bool)
+    positions = np.nonzero(candidates)[0]
+    typed = {}
+    for name, model in models.items():
+        fields = list(model.schema.model_fields)
+        inputs, row_errors = parse_batch(model.schema, _records(chunk[candidates], fields), model.valid_crops, model.valid_soil_types)
+        typed[name] = inputs
+        for i, errs in zip(positions, row_errors):
+            for e in errs or ():
+                if e not in errors[i]:
+                    errors[i].append(e)
+    valid = np.array([not e for e in errors], dtype=bool)
+    scored = chunk[valid].copy()
+    # Added even when nothing in the chunk is scorable, so every chunk has the same columns
+    for name in models:
+        scored[f"{name}_prediction"] = np.nan
+    if valid.any():
+        rolling = scored[list(ROLLING_FEATURES)].to_numpy(dtype=float)
+        for name, model in models.items():
+            rows = [r for r, ok in zip(typed[name], valid[positions]) if ok]
+            base = np.array([[r.rainfall, r.temperature, r.soil_moisture, r.areaSqM] for r in rows], dtype=float)
+            # Rows outside a plot's history fall back to their own readings
+            own = base[:, [0, 1]]
+            numeric = np.concatenate([base, np.where(np.isnan(rolling), own, rolling)], axis=1)
+            categories = [[r.crop, r.soil_type] for r in rows]
+            scored[f"{name}_prediction"] = model.score(numeric, categories, model.routes(rows))
+    rejects = chunk[~valid].copy()
+    rejects['errors'] = ['; '.join(e) for e, ok in zip(errors, valid) if not ok]
+    return scored.drop(columns=list(ROLLING_FEATURES)), rejects.drop(columns=list(ROLLING_FEATURES))
+
+
+class _Writer:
+    """
+    Appends chunks to a CSV or Parquet file. Parquet keeps the schema of the first chunk
+    with rows; empty chunks before it are skipped (and written alone if all are empty).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith('.parquet')
+        self.writer = None
+        self.empty = None
+        self.rows = 0
+
+    def write(self, frame):
+        if self.parquet:
+            if self.writer is None and frame.empty:
+                # All-missing columns of an empty chunk would fix a null type in the schema
+                self.empty = frame
+                return
+            if self.writer is None:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                table = pa.Table.from_pandas(frame, schema=self.writer.schema, preserve_index=False)
+            self.writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode='w' if self.writer is None else 'a', header=self.writer is None, index=False)
+            self.writer = True
+        self.rows += len(frame)
+
+    def close(self):
+        if self.parquet and self.writer is None and self.empty is not None:
+            pq.write_table(pa.Table.from_pandas(self.empty, preserve_index=False), self.path)
+        elif self.parquet and self.writer is not None:
+            self.writer.close()
+
+
+def score_file(input_path, output_path, rejects_path, names, workers, chunk_size=CHUNK_SIZE, default_area=None,
+               compiled=None, load_mode=None):
+    """
+    Score `input_path` into `output_path`, writing unscorable rows to `rejects_path`.
+    With `workers` == 0 chunks are scored in this process. Returns (scored, rejected) row counts.
+    """
+    output, rejects = _Writer(output_path), _Writer(rejects_path)
+    carry = RollingCarry()
+    offset = 0
+    row_column = None
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(names, compiled, load_mode)) \
+        if workers else None
+    models = load_models(names, compiled, load_mode) if pool is None else None
+    pending = deque()
+
+    def drain(limit):
+        while len(pending) > limit:
+            scored, rejected = pending.popleft().result()
+            output.write(scored)
+            if len(rejected):
+                rejects.write(rejected)
+
+    try:
+        for chunk in read_chunks(input_path, chunk_size):
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            chunk = carry.apply(prepare_chunk(chunk, default_area))
+            # Every chunk has the same columns, so the name is picked once
+            row_column = row_column or position_column(chunk.columns)
+            chunk.insert(0, row_column, chunk.index)
+            if pool is None:
+                scored, rejected = score_chunk(chunk, models)
+                output.write(scored)
+                if len(rejected):
+                    rejects.write(rejected)
+                continue
+            pending.append(pool.submit(score_chunk, chunk))
+            # Bounded read-ahead: results are written in order while later chunks are scored
+            drain(2 * workers)
+        drain(0)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        output.close()
+        rejects.close()
+    return output.rows, rejects.rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='CSV or .parquet file to score')
+    parser.add_argument('-o', '--output', required=True, help='scored rows, written as Parquet if it ends in .parquet, else CSV')
+    parser.add_argument('--rejects', help='rows that could not be scored (CSV or .parquet, default: <output>.rejects.csv)')
+    parser.add_argument('--models', default='yield,irrigation', help='comma-separated models to run')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='scoring processes (0 = score in this process)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows read and scored at a time')
+    parser.add_argument('--default-area', type=float, default=None,
+                        help='areaSqM for rows without an areaSqM or area value; without it such rows are rejected')
+    parser.add_argument('--compiled', action='store_true', help='use the compiled inference path')
+    parser.add_argument('--load-mode', choices=('joblib', 'mmap'), default=None)
+    args = parser.parse_args(argv)
+
+    names = [n.strip() for n in args.models.split(',') if n.strip()]
+    unknown = set(names) - {'yield', 'irrigation'}
+    if not names or unknown:
+        parser.error(f"unknown models: {sorted(unknown)}" if unknown else "no models given")
+    if not has_pyarrow and any(p and p.endswith('.parquet') for p in (args.input, args.output, args.rejects)):
+        parser.error("Parquet files need pyarrow (pip install pyarrow)")
+    rejects = args.rejects or os.path.splitext(args.output)[0] + '.rejects.csv'
+    start = time.perf_counter()
+    scored, rejected = score_file(args.input, args.output, rejects, names, args.workers, args.chunk_size,
+                                  args.default_area, args.compiled or None, args.load_mode)
+    print(f"Scored {scored} rows into {args.output} in {time.perf_counter() - start:.1f}s; "
+          f"{rejected} rows rejected" + (f" (see {rejects})" if rejected else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import pytest
+from sklearn.ensemble import ExtraTreesRegressor, GradientBoostingRegressor, RandomForestRegressor
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.tree import DecisionTreeRegressor
+from app.models.compiled import ARRAY_FIELDS, CompiledPipeline
+from app.models.uncertainty import tree_spread
+
+N_NUMERIC = 6
+CROPS = ["maize", "rice", "wheat"]
+SOILS = ["clay", "loam", "sandy"]
+MODELS = {
+    "RandomForest": lambda: RandomForestRegressor(n_estimators=20, max_depth=8, random_state=0),
+    "ExtraTrees": lambda: ExtraTreesRegressor(n_estimators=20, random_state=0),
+    "GradientBoosting": lambda: GradientBoostingRegressor(n_estimators=30, max_depth=3, random_state=0),
+    "DecisionTree": lambda: DecisionTreeRegressor(max_depth=6, random_state=0),
+}
+
+
+def _rows(n, seed):
+    rng = np.random.default_rng(seed)
+    numeric = rng.uniform(0, 100, size=(n, N_NUMERIC))
+    # Serving sees categories the encoder never did
+    categories = np.array([[rng.choice(CROPS + ["barley"]), rng.choice(SOILS)] for _ in range(n)], dtype=object)
+    return numeric, categories
+
+
+def _fit(name):
+    numeric, categories = _rows(300, seed=0)
+    categories[categories == "barley"] = "maize"
+    encoder = OneHotEncoder(handle_unknown="ignore", sparse_output=False).fit(categories)
+    X = np.concatenate([numeric, encoder.transform(categories)], axis=1)
+    scaler = StandardScaler().fit(X)
+    y = 3 * numeric[:, 0] - numeric[:, 1] + 10 * (categories[:, 0] == "rice") + np.random.default_rng(1).normal(0, 5, len(X))
+    model = MODELS[name]().fit(scaler.transform(X), y)
+    return encoder, scaler, model
+
+
+def _sklearn(encoder, scaler, model, numeric, categories):
+    return scaler.transform(np.concatenate([numeric, encoder.transform(categories)], axis=1))
+
+
+@pytest.mark.parametrize("name", list(MODELS))
+def test_compiled_matches_sklearn(name):
+    encoder, scaler, model = _fit(name)
+    compiled = CompiledPipeline.from_sklearn(encoder, scaler, model, N_NUMERIC)
+    numeric, categories = _rows(200, seed=2)
+    X_scaled = _sklearn(encoder, scaler, model, numeric, categories)
+
+    expected = model.predict(X_scaled)
+    preds, spread = compiled.predict_scaled(compiled.scale_features(compiled.encode_rows(numeric, categories)), return_spread=True)
+    assert np.allclose(preds, expected, rtol=1e-9, atol=1e-9)
+    assert np.allclose(compiled.predict_rows(numeric, categories), expected, rtol=1e-9, atol=1e-9)
+    assert np.isclose(compiled.predict_row(numeric[0], categories[0]), expected[0], rtol=1e-9, atol=1e-9)
+    assert compiled.averaging == (name in ("RandomForest", "ExtraTrees"))
+    if compiled.averaging:
+        assert np.allclose(spread, tree_spread(model, X_scaled), rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize("name", list(MODELS))
+def test_save_and_mmap_load_round_trip(name, tmp_path):
+    encoder, scaler, model = _fit(name)
+    compiled = CompiledPipeline.from_sklearn(encoder, scaler, model, N_NUMERIC)
+    path = str(tmp_path / "flat")
+    compiled.save(path, sources={"model": "model.joblib"})
+    assert sorted(os.listdir(path)) == sorted([f"{field}.npy" for field in ARRAY_FIELDS] + ["meta.json"])
+
+    loaded = CompiledPipeline.load(path, mmap_mode="r")
+    assert isinstance(loaded.value.base, np.memmap) and not loaded.value.flags.writeable
+    assert loaded.sources == {"model": "model.joblib"}
+    assert loaded.averaging == compiled.averaging and loaded.categories == compiled.categories
+    numeric, categories = _rows(200, seed=3)
+    X_scaled = compiled.scale_features(compiled.encode_rows(numeric, categories))
+    preds, spread = loaded.predict_scaled(X_scaled, return_spread=True)
+    expected, expected_spread = compiled.predict_scaled(X_scaled, return_spread=True)
+    assert np.array_equal(preds, expected) and np.array_equal(spread, expected_spread)
+    assert np.allclose(preds, model.predict(_sklearn(encoder, scaler, model, numeric, categories)), rtol=1e-9, atol=1e-9)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from app.features import SOURCES, ROLLING_FEATURES, RollingStore, add_rolling_features
+from training.ingest import ingest
+
+
+def _readings(n_plots=3, per_plot=10, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = [{"plot_id": f"plot-{p}", "timestamp": pd.Timestamp("2024-06-01") + pd.Timedelta(days=d),
+             "rainfall": rng.uniform(0, 200), "temperature": rng.uniform(10, 40)}
+            for p in range(n_plots) for d in range(per_plot)]
+    # Training sees the rows in file order, not per plot or by time
+    return pd.DataFrame(rows).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def test_training_and_serving_rolling_features_agree():
+    df = _readings()
+    trained = add_rolling_features(df)
+    store = RollingStore()
+    for i in df.sort_values("timestamp", kind="stable").index:
+        row = df.loc[i]
+        served = store.observe(row["plot_id"], row["timestamp"].to_pydatetime(), [row[s] for s in SOURCES])
+        expected = [trained.loc[i, feature] for feature in ROLLING_FEATURES]
+        assert np.allclose(served, expected, rtol=0, atol=1e-9), (i, served, expected)
+
+
+def test_repeated_timestamp_matches_serving():
+    df = pd.DataFrame({"plot_id": ["a"] * 3, "rainfall": [10.0, 20.0, 99.0], "temperature": [20.0, 30.0, 0.0],
+                       "timestamp": pd.to_datetime(["2024-06-01", "2024-06-02", "2024-06-02"])})
+    trained = add_rolling_features(df)
+    store = RollingStore()
+    served = [store.observe("a", row.timestamp.to_pydatetime(), [row.rainfall, row.temperature]) for row in df.itertuples()]
+    assert np.allclose(trained[list(ROLLING_FEATURES)].to_numpy(), served)
+
+
+def test_ingest_keeps_one_row_per_plot_reading(tmp_path):
+    df = _readings()
+    data_path = tmp_path / "data.csv"
+    df.assign(crop="wheat", soil_type="loam").to_csv(data_path, index=False)
+    # The same readings uploaded again are dropped
+    (tmp_path / "historical").mkdir()
+    df.head(5).assign(crop="wheat", soil_type="loam").to_csv(tmp_path / "historical" / "upload.csv", index=False)
+
+    cached = ingest(str(data_path), str(tmp_path / "historical"), str(tmp_path / "cache"))
+
+    assert len(cached) == len(df)
+    rolled = add_rolling_features(cached)
+    assert not np.allclose(rolled["rainfall_7d"], rolled["rainfall"])
@@ -0,0 +1,21 @@
+import pandas as pd
+from score_batch import score_file
+
+
+def test_input_with_row_column_is_scored(tmp_path):
+    # Playground grid exports carry their own row/column, and may already have an input_row
+    rows = [{"row": r, "column": c, "input_row": "a", "crop": "wheat", "soil_type": "loam", "rainfall": 50.0,
+             "temperature": 25.0, "soil_moisture": 30.0, "areaSqM": 100.0} for r in range(2) for c in range(2)]
+    rows[1]["rainfall"] = None
+    data_path = tmp_path / "grid.csv"
+    pd.DataFrame(rows).to_csv(data_path, index=False)
+    output, rejects = tmp_path / "scored.csv", tmp_path / "rejects.csv"
+
+    scored, rejected = score_file(str(data_path), str(output), str(rejects), ["yield"], workers=0)
+
+    assert (scored, rejected) == (3, 1)
+    out = pd.read_csv(output)
+    assert list(out["row"]) == [0, 1, 1] and list(out["input_row"]) == ["a"] * 3
+    assert list(out["_input_row"]) == [0, 2, 3]
+    assert out["yield_prediction"].notna().all()
+    assert list(pd.read_csv(rejects)["_input_row"]) == [1]
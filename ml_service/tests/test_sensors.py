@@ -0,0 +1,45 @@
+import os
+import importlib.util
+import pytest
+from app import create_app, create_asgi_app
+
+CONF_PATH = os.path.join(os.path.dirname(__file__), "..", "gunicorn.conf.py")
+
+
+def _gunicorn_conf(monkeypatch):
+    # The config sets ML_EAGER_LOAD on import; monkeypatch restores it afterwards
+    monkeypatch.setenv("ML_EAGER_LOAD", "0")
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", CONF_PATH)
+    conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(conf)
+    return conf
+
+
+def test_gunicorn_rejects_several_workers_serving_sensors(monkeypatch):
+    conf = _gunicorn_conf(monkeypatch)
+    monkeypatch.delenv("ML_SENSORS", raising=False)
+    conf.check_sensor_workers(1)
+    with pytest.raises(RuntimeError, match="ML_SENSORS=0"):
+        conf.check_sensor_workers(4)
+    monkeypatch.setenv("ML_SENSORS", "0")
+    conf.check_sensor_workers(4)
+
+
+def _sensor_paths(paths):
+    return sorted(p for p in paths if p.startswith("/api/sensors"))
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_sensor_routes_follow_ml_sensors(monkeypatch, enabled):
+    monkeypatch.setenv("ML_EAGER_LOAD", "0")
+    monkeypatch.setenv("ML_SENSORS", "1" if enabled else "0")
+    expected = ["/api/sensors/plots", "/api/sensors/predictions", "/api/sensors/readings",
+                "/api/sensors/stats", "/api/sensors/stream"] if enabled else []
+
+    flask_app = create_app()
+    assert _sensor_paths(rule.rule for rule in flask_app.url_map.iter_rules()) == expected
+    assert (flask_app.extensions["ml_service"]["sensors"] is not None) == enabled
+    asgi_app = create_asgi_app()
+    assert _sensor_paths(route.path for route in asgi_app.routes) == expected
+    # The prediction API is served either way
+    assert "/api/predict-yield" in {rule.rule for rule in flask_app.url_map.iter_rules()}
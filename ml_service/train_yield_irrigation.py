@@ -1,14 +1,22 @@
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor, StackingRegressor
-from sklearn.model_selection import train_test_split, GridSearchCV, cross_val_score, KFold
+from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
-from joblib import dump
 import os
-import json
-from datetime import datetime
-import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from app.drift import build_profile
+from app.features import add_rolling_features
+from app.models.uncertainty import calibrate
+from app.variants import DIMENSIONS
+from training.export import export_version
+from training.incremental import FullRefitRequired, retrain_incremental
+from training.ingest import CACHE_DIR, ingest
+from training.search import STRATEGIES, FoldScoreCache, make_folds, run_search, cv_scores as search_cv_scores
+from training.variants import train_variants
 
 # Optional: Use XGBoost/LightGBM/CatBoost if available
 try:
@@ -32,83 +40,87 @@ except ImportError:
 DATA_PATH = 'app/synthetic_farm_data.csv'  # Default: synthetic data for development
 OUTPUT_DIR = './models'
 HISTORICAL_DIR = '../historical_uploads'
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# --- Load and clean data ---
-df = pd.read_csv(DATA_PATH)
-print(f"Loaded {len(df)} rows from {DATA_PATH}")
-
-# --- Merge with historical data if available ---
-hist_files = glob.glob(os.path.join(HISTORICAL_DIR, '*.csv')) if os.path.exists(HISTORICAL_DIR) else []
-if hist_files:
-    print(f"Merging with {len(hist_files)} historical data file(s)...")
-    hist_dfs = [pd.read_csv(f) for f in hist_files]
-    hist_df = pd.concat(hist_dfs, ignore_index=True)
-    # Merge on plot_id, crop, or other common columns if available
-    # For now, just concatenate and drop duplicates, preferring historical data
-    combined = pd.concat([hist_df, df], ignore_index=True)
-    if 'plot_id' in combined.columns:
-        df = combined.drop_duplicates(subset=['plot_id'], keep='first')
+# Share of the training split held out for conformal calibration
+CALIBRATION_SIZE = 0.2
+
+# --- Targets: (target column, model name, pretty name, units, interpretation) ---
+TARGETS = [
+    ('yield', 'yield', 'Yield', 'kg',
+     "This means your predicted yield is usually within ±{mae:.1f} {units} of the actual value."),
+    ('irrigation_required', 'irrigation', 'Irrigation Requirement', 'mm',
+     "This means you should apply the predicted amount of water (in mm) to your plot. The model is usually within ±{mae:.1f} {units} of the true requirement."),
+]
+
+
+def load_training_data(data_path=DATA_PATH, historical_dir=HISTORICAL_DIR, cache_dir=CACHE_DIR, rebuild_cache=False,
+                       append=False):
+    """
+    Returns (df, data_cache): the cleaned rows, indexed by their position in the training-data
+    cache, and the cache's {"generation", "rows"} for the manifest.
+    """
+    # --- Load, merge and deduplicate the base dataset and historical uploads ---
+    # Streamed in chunks into a columnar cache (see training/ingest.py); historical rows win on duplicate plot_ids,
+    # and crop_type/area are normalized to crop/areaSqM while reading
+    df, meta = ingest(data_path, historical_dir, cache_dir, rebuild=rebuild_cache, append=append, with_meta=True)
+    data_cache = {"generation": meta["generation"], "rows": meta["rows"]}
+    print(f"Final training set: {len(df)} rows")
+
+    # --- Data cleaning: drop rows with missing values in key columns ---
+    required_features = ['rainfall', 'temperature', 'soil_moisture', 'crop']
+    df = df.dropna(subset=required_features)
+
+    # --- Feature Engineering ---
+    # Add soil_type, plot size, rolling weather, etc.
+    if 'soil_type' in df.columns:
+        # Categorical column: 'unknown' is only added when needed, so it only becomes a feature when it occurs
+        if df['soil_type'].isna().any():
+            if 'unknown' not in df['soil_type'].cat.categories:
+                df['soil_type'] = df['soil_type'].cat.add_categories('unknown')
+            df['soil_type'] = df['soil_type'].fillna('unknown')
+    else:
+        df['soil_type'] = 'unknown'
+    if 'areaSqM' in df.columns:
+        df['areaSqM'] = df['areaSqM'].fillna(df['areaSqM'].mean())
     else:
-        df = combined.drop_duplicates(keep='first')
-    print(f"Final training set: {len(df)} rows (after merging historical data)")
-else:
-    print("No historical data found. Using only sensor data.")
-
-# --- Column normalization for compatibility ---
-# Accept both 'crop' and 'crop_type', 'areaSqM' and 'area'
-if 'crop' not in df.columns and 'crop_type' in df.columns:
-    df['crop'] = df['crop_type']
-if 'areaSqM' not in df.columns and 'area' in df.columns:
-    df['areaSqM'] = df['area']
-
-# --- Data cleaning: drop rows with missing values in key columns ---
-required_features = ['rainfall', 'temperature', 'soil_moisture', 'crop']
-df = df.dropna(subset=required_features)
-
-# --- Feature Engineering ---
-# Add soil_type, plot size, rolling weather, etc.
-if 'soil_type' in df.columns:
-    df['soil_type'] = df['soil_type'].fillna('unknown')
-else:
-    df['soil_type'] = 'unknown'
-if 'areaSqM' in df.columns:
-    df['areaSqM'] = df['areaSqM'].fillna(df['areaSqM'].mean())
-else:
-    df['areaSqM'] = 0
-# Rolling rainfall/temperature (last 7 days) if timestamped data is available
-if 'timestamp' in df.columns:
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df = df.sort_values('timestamp')
-    df['rainfall_7d'] = df['rainfall'].rolling(window=7, min_periods=1).mean()
-    df['temperature_7d'] = df['temperature'].rolling(window=7, min_periods=1).mean()
-else:
-    df['rainfall_7d'] = df['rainfall']
-    df['temperature_7d'] = df['temperature']
-
-# --- One-hot encode categorical features ---
-cat_features = ['crop', 'soil_type']
-X = df[['rainfall', 'temperature', 'soil_moisture', 'areaSqM', 'rainfall_7d', 'temperature_7d'] + cat_features].copy()
-encoder = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
-cat_encoded = encoder.fit_transform(X[cat_features])
-cat_feature_names = encoder.get_feature_names_out(cat_features)
-X = X.drop(cat_features, axis=1)
-X[cat_feature_names] = cat_encoded
-
-# --- Standardize features ---
-scaler = StandardScaler()
-X_scaled = scaler.fit_transform(X)
+        df['areaSqM'] = 0
+    # Rolling rainfall/temperature over each plot's last 7 readings; the serving path uses the same definition
+    df = add_rolling_features(df)
+    return df, data_cache
 
-# --- Model training and export ---
-def train_and_export(target_col, model_name, pretty_name, units, interpretation_func=None):
-    if target_col not in df.columns:
-        print(f"No '{target_col}' column found in CSV. Skipping {model_name} model.")
-        return
 
-    y = df[target_col].dropna()
-    X_target = X_scaled[df[target_col].notna()]
-    X_train, X_test, y_train, y_test = train_test_split(X_target, y, test_size=0.2, random_state=42)
+NUMERIC_FEATURES = ['rainfall', 'temperature', 'soil_moisture', 'areaSqM', 'rainfall_7d', 'temperature_7d']
+CATEGORICAL_FEATURES = ['crop', 'soil_type']
+
+
+def build_features(df):
+    """
+    One-hot encode and standardize the feature columns. Returns (X, X_scaled, encoder, scaler),
+    where X is the unscaled DataFrame in the manifest's feature order.
+    """
+    # --- One-hot encode categorical features ---
+    encoder = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
+    encoder.fit(df[CATEGORICAL_FEATURES])
+
+    # --- Standardize features ---
+    scaler = StandardScaler()
+    scaler.fit(transform_features(df, encoder)[0])
+    X, X_scaled = transform_features(df, encoder, scaler)
+    return X, X_scaled, encoder, scaler
 
+
+def transform_features(df, encoder, scaler=None):
+    """
+    Apply already fitted preprocessors. Returns (X, X_scaled); X_scaled is None without a scaler.
+    """
+    X = df[NUMERIC_FEATURES].copy()
+    X[encoder.get_feature_names_out(CATEGORICAL_FEATURES)] = encoder.transform(df[CATEGORICAL_FEATURES])
+    return X, scaler.transform(X) if scaler is not None else None
+
+
+def candidate_models():
+    """
+    Candidate estimators and their search spaces.
+    """
     models = {
         'RandomForest': RandomForestRegressor(random_state=42),
         'GradientBoosting': GradientBoostingRegressor(random_state=42)
@@ -146,6 +158,32 @@ def train_and_export(target_col, model_name, pretty_name, units, interpretation_
             'learning_rate': [0.01, 0.05, 0.1],
             'depth': [3, 5, 7]
         }
+    return models, param_grids
+
+
+# --- Model training and export ---
+def train_and_export(df, X, X_scaled, encoder, scaler, target_col, model_name, pretty_name, units,
+                     interpretation=None, search='halving', n_trials=20, time_budget=None, cv=5,
+                     n_jobs=-1, output_dir=OUTPUT_DIR, data_cache=None):
+    """
+    Search, evaluate and export the model for one target. `data_cache` ({"generation", "rows"}
+    of the training-data cache) is recorded in the manifest for incremental retraining.
+    """
+    if target_col not in df.columns:
+        print(f"No '{target_col}' column found in CSV. Skipping {model_name} model.")
+        return
+
+    y = df[target_col].dropna()
+    X_target = X_scaled[df[target_col].notna()]
+    X_train, X_test, y_train, y_test = train_test_split(X_target, y, test_size=0.2, random_state=42)
+    # Conformal calibration rows, kept out of the search and of the model choice on the test rows
+    X_train, X_cal, y_train, y_cal = train_test_split(X_train, y_train, test_size=CALIBRATION_SIZE, random_state=42)
+
+    models, param_grids = candidate_models()
+    # All candidates are scored on the same folds, so the winner's CV score comes from the search
+    folds = make_folds(cv)
+    fold_cache = FoldScoreCache()
+    deadline = time.monotonic() + time_budget if time_budget else None
 
     best_score = -np.inf
     best_model = None
@@ -154,51 +192,55 @@ def train_and_export(target_col, model_name, pretty_name, units, interpretation_
     best_rmse = None
     best_mae = None
     best_mape = None
-    best_cv_scores = None
+    n_trials_run = 0
 
     for name, model in models.items():
-        print(f"\nTuning {name} for {model_name}...")
-        grid = GridSearchCV(model, param_grids[name], cv=5, scoring='r2', n_jobs=-1)
-        grid.fit(X_train, y_train)
-        preds = grid.predict(X_test)
+        if deadline is not None and best_model is not None and time.monotonic() >= deadline:
+            print(f"[{model_name}] Time budget of {time_budget:.0f}s used up; skipping {name} and the remaining models.")
+            break
+        print(f"\n[{model_name}] Tuning {name} ({search} search)...")
+        result = run_search(name, model, param_grids[name], X_train, y_train, strategy=search, folds=folds,
+                            n_trials=n_trials, deadline=deadline, cache=fold_cache, n_jobs=n_jobs)
+        n_trials_run += result.n_trials
+        preds = result.best_estimator.predict(X_test)
         rmse = mean_squared_error(y_test, preds, squared=False)
         r2 = r2_score(y_test, preds)
         mae = mean_absolute_error(y_test, preds)
         mape = np.mean(np.abs((y_test - preds) / np.clip(y_test, 1e-8, None))) * 100
-        print(f"{name} RMSE: {rmse:.3f} {units}, MAE: {mae:.3f} {units}, MAPE: {mape:.2f}%, R2: {r2:.3f}, Best Params: {grid.best_params_}")
+        print(f"[{model_name}] {name} RMSE: {rmse:.3f} {units}, MAE: {mae:.3f} {units}, MAPE: {mape:.2f}%, R2: {r2:.3f}, "
+              f"Best Params: {result.best_params} ({result.n_trials} trials, {result.elapsed:.1f}s)")
         if r2 > best_score:
             best_score = r2
-            best_model = grid.best_estimator_
+            best_model = result.best_estimator
             best_name = name
-            best_params = grid.best_params_
+            best_params = result.best_params
             best_rmse = rmse
             best_mae = mae
             best_mape = mape
 
-    # Cross-validation on best model
-    kf = KFold(n_splits=10, shuffle=True, random_state=42)
-    cv_scores = cross_val_score(best_model, X_target, y, cv=kf, scoring='r2')
+    # Cross-validation on best model over the search folds of the training split, reusing the search's fold scores when available
+    cv_scores, cv_cached = search_cv_scores(best_name, best_model, best_params, X_train, y_train, folds,
+                                            cache=fold_cache, n_jobs=n_jobs)
     print(f"\nBest model for {model_name}: {best_name}")
     print(f"  Test R2: {best_score:.3f}")
-    print(f"  CV R2: {cv_scores.mean():.3f} ± {cv_scores.std():.3f}")
+    print(f"  CV R2: {cv_scores.mean():.3f} ± {cv_scores.std():.3f} ({len(cv_scores)} folds over {len(y_train)} training rows"
+          f"{', from search' if cv_cached else ''})")
     print(f"  Test RMSE: {best_rmse:.3f} {units}")
     print(f"  Test MAE: {best_mae:.3f} {units}")
     print(f"  Test MAPE: {best_mape:.2f}%")
 
+    # Conformal prediction intervals, calibrated on rows that played no part in choosing the model
+    conformal = calibrate(best_model, X_cal, y_cal)
+    print(f"  Interval half-widths ({conformal['method']}, {conformal['n_calibration']} calibration rows): "
+          + ", ".join(f"{float(level):.0%}: {q:.3f}" for level, q in conformal['quantiles'].items()))
+
     # Print feature importances if available
     if hasattr(best_model, 'feature_importances_'):
         print("Feature importances:")
         for name, importance in zip(list(X.columns), best_model.feature_importances_):
             print(f"  {name}: {importance:.3f}")
 
-    # Export model, encoder, scaler, and metrics with versioning
-    version = datetime.now().strftime('%Y%m%d%H%M%S')
-    dump(best_model, os.path.join(OUTPUT_DIR, f'{model_name}_model_{version}.joblib'))
-    dump(encoder, os.path.join(OUTPUT_DIR, f'{model_name}_encoder_{version}.joblib'))
-    dump(scaler, os.path.join(OUTPUT_DIR, f'{model_name}_scaler_{version}.joblib'))
-    print(f"Saved {model_name} model and preprocessors to {OUTPUT_DIR}/ (version {version})")
-
-    # --- Save metrics for this model ---
+    # --- Export model, encoder, scaler, metrics and manifest with versioning ---
     metrics = {
         "model": best_name,
         "test_rmse": best_rmse,
@@ -207,41 +249,116 @@ def train_and_export(target_col, model_name, pretty_name, units, interpretation_
         "test_r2": best_score,
         "cv_r2_mean": float(cv_scores.mean()),
         "cv_r2_std": float(cv_scores.std()),
+        "cv_r2_folds": [float(s) for s in cv_scores],
+        # The baseline ran 10-fold CV on all labeled rows; these scores use the search folds of the training split
+        "cv": {"folds": len(cv_scores), "rows": int(len(y_train)), "from_search": bool(cv_cached)},
         "params": best_params,
+        "search": {"strategy": search, "trials": n_trials_run, "time_budget": time_budget},
         "feature_importances": getattr(best_model, 'feature_importances_', None).tolist() if hasattr(best_model, 'feature_importances_') else None,
+        "conformal": conformal,
         "units": units
     }
-    with open(os.path.join(OUTPUT_DIR, f'{model_name}_metrics_{version}.json'), 'w') as f:
-        json.dump(metrics, f, indent=2)
-    print(f"Saved metrics to {OUTPUT_DIR}/{model_name}_metrics_{version}.json")
+    labeled = df[target_col].notna()
+    version = export_version(output_dir, model_name, best_model, encoder, scaler, metrics, X.columns,
+                             extra={'data_cache': data_cache} if data_cache else None,
+                             profile=build_profile(X.loc[labeled, NUMERIC_FEATURES], df.loc[labeled, CATEGORICAL_FEATURES]))
 
     # --- Farmer-friendly summary ---
     print("\n--- Farmer-friendly summary ---")
     print(f"{pretty_name} prediction is in {units}.")
     print(f"Typical prediction range: {y.min():.1f} to {y.max():.1f} {units}.")
     print(f"On average, the model's error is ±{best_mae:.1f} {units}.")
-    if interpretation_func:
-        print(interpretation_func(best_mae, units))
+    if interpretation:
+        print(interpretation.format(mae=best_mae, units=units))
     print("------------------------------\n")
+    return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train and export the yield and irrigation models.")
+    parser.add_argument('--data', default=DATA_PATH, help='training CSV')
+    parser.add_argument('--historical-dir', default=HISTORICAL_DIR, help='directory of historical CSVs to merge')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='columnar cache of the ingested training data')
+    parser.add_argument('--rebuild-cache', action='store_true', help='re-ingest the CSVs even if none changed')
+    parser.add_argument('--search', choices=STRATEGIES, default='halving',
+                        help='hyperparameter search: successive halving (default), random, or the full grid')
+    parser.add_argument('--trials', type=int, default=20,
+                        help='candidates per model family (initial candidates for halving)')
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help='wall-clock seconds per target; remaining candidates are skipped once it is spent')
+    parser.add_argument('--cv', type=int, default=5, help='cross-validation folds')
+    parser.add_argument('--target-jobs', type=int, default=len(TARGETS),
+                        help='targets trained concurrently in separate processes (1 = sequential)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only ingest new historical files and extend the latest models with their rows; '
+                             'falls back to full training when a refit is required')
+    parser.add_argument('--extra-estimators', type=int, default=None,
+                        help='trees/boosting rounds added per incremental update (default: 10%% of the model, at least 10)')
+    parser.add_argument('--variants', default='',
+                        help=f'also train regional/per-crop model variants, comma-separated from {",".join(DIMENSIONS)}; '
+                             'without it the existing variant index is left as it is')
+    parser.add_argument('--min-variant-rows', type=int, default=100,
+                        help='labeled rows a district, state or crop needs to get its own variant')
+    args = parser.parse_args(argv)
+    dimensions = [d.strip() for d in args.variants.split(',') if d.strip()]
+    if any(d not in DIMENSIONS for d in dimensions):
+        parser.error(f"--variants takes a comma-separated subset of {','.join(DIMENSIONS)}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    df, data_cache = load_training_data(args.data, args.historical_dir, args.cache_dir, args.rebuild_cache,
+                                        append=args.incremental)
+
+    targets = TARGETS
+    if args.incremental:
+        targets = []
+        for target_col, model_name, pretty_name, units, interpretation in TARGETS:
+            try:
+                retrain_incremental(df, data_cache, transform_features, target_col, model_name, units,
+                                    args.output_dir, extra_estimators=args.extra_estimators)
+            except FullRefitRequired as e:
+                print(f"[{model_name}] Full refit required: {e}")
+                targets.append((target_col, model_name, pretty_name, units, interpretation))
+        if not targets and not dimensions:
+            print(f"Done. Incremental update finished; models are in {args.output_dir}/")
+            return
+
+    # Split the CPUs between the concurrently trained targets
+    target_jobs = max(1, min(args.target_jobs, len(targets)))
+    n_jobs = max(1, (os.cpu_count() or 1) // target_jobs)
+    options = dict(search=args.search, n_trials=args.trials, time_budget=args.time_budget, cv=args.cv,
+                   n_jobs=n_jobs, output_dir=args.output_dir, data_cache=data_cache)
+
+    # --- Train both models ---
+    if targets:
+        X, X_scaled, encoder, scaler = build_features(df)
+        if target_jobs == 1:
+            for target in targets:
+                train_and_export(df, X, X_scaled, encoder, scaler, *target, **options)
+        else:
+            with ProcessPoolExecutor(max_workers=target_jobs) as pool:
+                futures = [pool.submit(train_and_export, df, X, X_scaled, encoder, scaler, *target, **options)
+                           for target in targets]
+                for future in futures:
+                    future.result()
+
+    # --- Regional/per-crop variants, one at a time with all CPUs; always refit in full ---
+    if dimensions:
+        def fit_variant(rows, target, name):
+            target_col, _, pretty_name, units, interpretation = target
+            return train_and_export(rows, *build_features(rows), target_col, name, pretty_name, units, interpretation,
+                                    **{**options, 'n_jobs': max(1, os.cpu_count() or 1), 'data_cache': None})
+        train_variants(df, TARGETS, dimensions, args.min_variant_rows, fit_variant, args.output_dir)
+
+    print(f"Done. Models and metrics saved in {args.output_dir}/")
+
 
-# --- Train both models ---
-train_and_export(
-    target_col='yield',
-    model_name='yield',
-    pretty_name='Yield',
-    units='kg',
-    interpretation_func=lambda mae, units: f"This means your predicted yield is usually within ±{mae:.1f} {units} of the actual value."
-)
-train_and_export(
-    target_col='irrigation_required',
-    model_name='irrigation',
-    pretty_name='Irrigation Requirement',
-    units='mm',
-    interpretation_func=lambda mae, units: f"This means you should apply the predicted amount of water (in mm) to your plot. The model is usually within ±{mae:.1f} {units} of the true requirement."
-)
-
-print("Done. Models and metrics saved in ./models/")
+if __name__ == '__main__':
+    main()
 
 # --- USAGE NOTE ---
-# To use a different dataset, change DATA_PATH above.
-# To add more data, generate/merge CSVs with the same columns as synthetic_farm_data.csv. 
\ No newline at end of file
+# To use a different dataset, pass --data (or change DATA_PATH above).
+# To add more data, generate/merge CSVs with the same columns as synthetic_farm_data.csv.
+# For a quick retrain, limit the search: --search random --trials 10 --time-budget 120
+# For nightly retraining on new uploads only: --incremental
+# For per-state models served alongside the global ones: --variants state --min-variant-rows 200
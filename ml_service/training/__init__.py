@@ -0,0 +1,3 @@
+"""
+Helpers for train_yield_irrigation.py.
+"""
@@ -0,0 +1,150 @@
+"""
+Versioned export of trained artifacts, shared by full and incremental training.
+
+Besides the joblib pickles, each version gets a flat NumPy export of the encoder, scaler
+and tree ensemble (`<name>_flat_<version>/`, see app/models/compiled.py) when the model
+type supports it. The service serves that copy with ML_MODEL_LOAD_MODE=mmap without
+unpickling anything or importing sklearn. To add flat exports to versions trained before
+they existed:
+
+    python -m training.export
+
+It also writes a profile of the training inputs (`<name>_profile_<version>.json`, see
+app/drift.py) that the service compares live inputs against; the command above backfills
+profiles from the current training data for versions that have none.
+"""
+import os
+import json
+from datetime import datetime
+import sklearn
+from joblib import dump, load
+from app.manifest import ARTIFACT_KINDS, artifact_path, load_manifest, write_manifest
+from app.models.base import MODEL_DIR, NUMERIC_FEATURES
+from app.models.compiled import FORMAT, CompiledPipeline
+
+
+def export_flat(output_dir, model_name, version, model, encoder, scaler, sources):
+    """
+    Write the flat NumPy export of a fitted pipeline after checking it against the sklearn
+    pipeline. Returns its directory name in `output_dir`, or None if the model type is not
+    supported or parity fails (the version is then served from joblib only).
+    """
+    try:
+        pipeline = CompiledPipeline.from_sklearn(encoder, scaler, model, len(NUMERIC_FEATURES))
+    except ValueError as e:
+        print(f"No flat export for {model_name}: {e}")
+        return None
+    ok, max_err = pipeline.check_parity(encoder, scaler, model)
+    if not ok:
+        print(f"No flat export for {model_name}: parity error {max_err} against sklearn")
+        return None
+    name = f'{model_name}_flat_{version}'
+    pipeline.save(os.path.join(output_dir, name), sources=sources, info={
+        'model_type': type(model).__name__,
+        'trees': int(len(pipeline.roots)),
+        'parity_max_abs_error': max_err,
+        'exported_with': {'sklearn': sklearn.__version__},
+    })
+    print(f"Saved flat export (format {FORMAT}, parity error {max_err:.2e}) to {output_dir}/{name}/")
+    return name
+
+
+def write_profile(output_dir, model_name, version, profile):
+    name = f'{model_name}_profile_{version}.json'
+    with open(os.path.join(output_dir, name), 'w') as f:
+        json.dump(profile, f, indent=2)
+    print(f"Saved training profile ({profile['rows']} rows) to {output_dir}/{name}")
+    return name
+
+
+def export_version(output_dir, model_name, model, encoder, scaler, metrics, feature_order, extra=None, profile=None):
+    """
+    Save model, encoder, scaler, metrics, the training `profile` (app.drift.build_profile)
+    and the flat export under a new version, then write the manifest last so loaders only
+    ever see a complete artifact set. Returns the version.
+    """
+    version = datetime.now().strftime('%Y%m%d%H%M%S')
+    dump(model, os.path.join(output_dir, f'{model_name}_model_{version}.joblib'))
+    dump(encoder, os.path.join(output_dir, f'{model_name}_encoder_{version}.joblib'))
+    dump(scaler, os.path.join(output_dir, f'{model_name}_scaler_{version}.joblib'))
+    print(f"Saved {model_name} model and preprocessors to {output_dir}/ (version {version})")
+
+    # --- Save metrics for this model ---
+    with open(os.path.join(output_dir, f'{model_name}_metrics_{version}.json'), 'w') as f:
+        json.dump(metrics, f, indent=2, default=str)
+    print(f"Saved metrics to {output_dir}/{model_name}_metrics_{version}.json")
+
+    files = {
+        'model': f'{model_name}_model_{version}.joblib',
+        'encoder': f'{model_name}_encoder_{version}.joblib',
+        'scaler': f'{model_name}_scaler_{version}.joblib',
+        'metrics': f'{model_name}_metrics_{version}.json',
+    }
+    if profile is not None:
+        files['profile'] = write_profile(output_dir, model_name, version, profile)
+    flat = export_flat(output_dir, model_name, version, model, encoder, scaler,
+                       sources={kind: files[kind] for kind in ARTIFACT_KINDS})
+    if flat:
+        files['flat'] = flat
+
+    # --- Write the manifest last, so loaders only ever see a complete artifact set ---
+    write_manifest(
+        output_dir, model_name, version,
+        files=files,
+        feature_order=list(feature_order),
+        extra={'sklearn_version': sklearn.__version__, **(extra or {})},
+    )
+    print(f"Saved manifest to {output_dir}/{model_name}_manifest_{version}.json")
+    return version
+
+
+def backfill_flat(output_dir, model_name):
+    """
+    Add the flat export to the latest version of `model_name` if it has none, rewriting its
+    manifest in place. Returns the manifest.
+    """
+    manifest = load_manifest(output_dir, model_name)
+    if 'flat' in manifest['files']:
+        print(f"{model_name} version {manifest['version']} already has a flat export")
+        return manifest
+    model, encoder, scaler = (load(artifact_path(output_dir, manifest, kind)) for kind in ARTIFACT_KINDS)
+    files = {kind: entry['path'] for kind, entry in manifest['files'].items()}
+    flat = export_flat(output_dir, model_name, manifest['version'], model, encoder, scaler,
+                       sources={kind: files[kind] for kind in ARTIFACT_KINDS})
+    if flat is None:
+        return manifest
+    files['flat'] = flat
+    extra = {k: v for k, v in manifest.items() if k not in ('format', 'name', 'version', 'created_at', 'feature_order', 'files')}
+    return write_manifest(output_dir, model_name, manifest['version'], files, manifest['feature_order'], extra=extra)
+
+
+def backfill_profile(output_dir, model_name, profile):
+    """
+    Add `profile` to the latest version of `model_name` if it has none, rewriting its
+    manifest in place. Returns the manifest.
+    """
+    manifest = load_manifest(output_dir, model_name)
+    if 'profile' in manifest['files']:
+        print(f"{model_name} version {manifest['version']} already has a training profile")
+        return manifest
+    files = {kind: entry['path'] for kind, entry in manifest['files'].items()}
+    files['profile'] = write_profile(output_dir, model_name, manifest['version'], profile)
+    extra = {k: v for k, v in manifest.items() if k not in ('format', 'name', 'version', 'created_at', 'feature_order', 'files')}
+    return write_manifest(output_dir, model_name, manifest['version'], files, manifest['feature_order'], extra=extra)
+
+
+if __name__ == '__main__':
+    # Deferred: the training pipeline imports this module
+    from train_yield_irrigation import CATEGORICAL_FEATURES, TARGETS, load_training_data
+    from app.drift import build_profile
+
+    output_dir = os.path.normpath(MODEL_DIR)
+    df = None
+    for target_col, name, *_ in TARGETS:
+        backfill_flat(output_dir, name)
+        if 'profile' not in load_manifest(output_dir, name)['files']:
+            if df is None:
+                df, _ = load_training_data()
+            rows = df[df[target_col].notna()]
+            backfill_profile(output_dir, name, build_profile(rows[NUMERIC_FEATURES], rows[CATEGORICAL_FEATURES],
+                                                             info={'source': 'backfill'}))
@@ -0,0 +1,179 @@
+"""
+Incremental retraining: extend the latest exported model with rows ingested since it was trained.
+
+The manifest of every trained version records the training-data cache generation and row
+count it saw (see training/ingest.py). When the cache has only been appended to since, the
+new rows are checked against the fitted encoder and the model gets extra estimators:
+warm_start for the sklearn ensembles, continued boosting for XGBoost, LightGBM and CatBoost.
+The encoder and scaler are kept as they are. A full refit is required when the cache was
+rebuilt, a new crop or soil type appears, or the model type cannot be extended.
+
+The conformal intervals are recalibrated for every update. A share of the new rows is held
+out of the extension fit and used as calibration rows; those rows are learned at the next
+full refit. With too few new rows the version has no conformal calibration.
+"""
+import numpy as np
+from joblib import load
+from sklearn.metrics import mean_absolute_error, mean_squared_error
+from sklearn.model_selection import train_test_split
+from app.drift import build_profile
+from app.manifest import ManifestError, artifact_path, load_manifest, verify_checksums
+from app.models.base import CATEGORICAL_FEATURES, NUMERIC_FEATURES
+from app.models.uncertainty import calibrate
+from training.export import export_version
+
+# sklearn ensembles that grow with warm_start=True and a larger n_estimators
+WARM_START_MODELS = ('RandomForestRegressor', 'ExtraTreesRegressor', 'GradientBoostingRegressor')
+# Share of the new rows held out of the update for conformal calibration, and the fewest rows to calibrate on
+CALIBRATION_SIZE = 0.2
+MIN_CALIBRATION_ROWS = 10
+
+
+class FullRefitRequired(Exception):
+    pass
+
+
+def load_latest(output_dir, model_name):
+    try:
+        manifest = load_manifest(output_dir, model_name)
+        verify_checksums(output_dir, manifest)
+    except ManifestError as e:
+        raise FullRefitRequired(f"no usable {model_name} model to extend ({e})")
+    model = load(artifact_path(output_dir, manifest, 'model'))
+    encoder = load(artifact_path(output_dir, manifest, 'encoder'))
+    scaler = load(artifact_path(output_dir, manifest, 'scaler'))
+    return manifest, model, encoder, scaler
+
+
+def split_calibration(added):
+    """
+    Split the new rows into (fit rows, calibration rows). The calibration rows are None when
+    there are too few new rows to hold out MIN_CALIBRATION_ROWS of them.
+    """
+    n_cal = int(len(added) * CALIBRATION_SIZE)
+    if n_cal < MIN_CALIBRATION_ROWS:
+        return added, None
+    fit, cal = train_test_split(added, test_size=n_cal, random_state=42)
+    return fit, cal
+
+
+def new_rows(df, manifest, data_cache):
+    """
+    Rows of `df` (indexed by cache position) that the manifest's model has not seen.
+    """
+    trained_on = manifest.get('data_cache')
+    if not trained_on:
+        raise FullRefitRequired(f"{manifest['name']} version {manifest['version']} does not record its training data")
+    if trained_on['generation'] != data_cache['generation']:
+        raise FullRefitRequired("the training-data cache was rebuilt (a source file changed or was removed)")
+    return df[df.index >= trained_on['rows']]
+
+
+def check_categories(df, encoder, columns):
+    for col, known in zip(columns, encoder.categories_):
+        unseen = set(df[col].dropna().astype(str)) - set(map(str, known))
+        if unseen:
+            raise FullRefitRequired(f"new {col} values {sorted(unseen)}")
+
+
+def extend_model(model, X, y, n_new):
+    """
+    Add `n_new` estimators (trees or boosting rounds) fitted on X, y. Returns the extended model.
+    """
+    kind = type(model).__name__
+    if kind in WARM_START_MODELS:
+        model.set_params(warm_start=True, n_estimators=model.n_estimators + n_new)
+        model.fit(X, y)
+        model.set_params(warm_start=False)
+        return model
+    if kind == 'XGBRegressor':
+        total = model.get_params()['n_estimators'] or 100
+        booster = model.get_booster()
+        model.set_params(n_estimators=n_new)
+        model.fit(X, y, xgb_model=booster)
+        model.set_params(n_estimators=total + n_new)
+        return model
+    if kind == 'LGBMRegressor':
+        total = model.get_params()['n_estimators']
+        booster = model.booster_
+        model.set_params(n_estimators=n_new)
+        model.fit(X, y, init_model=booster)
+        model.set_params(n_estimators=total + n_new)
+        return model
+    if kind == 'CatBoostRegressor':
+        extended = model.copy()
+        extended.set_params(iterations=n_new)
+        extended.fit(X, y, init_model=model)
+        return extended
+    raise FullRefitRequired(f"{kind} cannot be extended incrementally")
+
+
+def estimator_count(model):
+    params = model.get_params()
+    for key in ('n_estimators', 'iterations'):
+        if params.get(key):
+            return int(params[key])
+    return 0
+
+
+def retrain_incremental(df, data_cache, featurize, target_col, model_name, units, output_dir,
+                        extra_estimators=None, min_new_rows=1):
+    """
+    Extend the latest `model_name` model with the rows added to the cache since it was trained.
+    `featurize(df, encoder, scaler)` returns (X, X_scaled) with the fitted preprocessors.
+    Returns the new version, the current one when there is nothing new, or None if the
+    target column is missing. Raises FullRefitRequired when a full refit is needed.
+    """
+    if target_col not in df.columns:
+        print(f"No '{target_col}' column found in the training data. Skipping {model_name} model.")
+        return None
+    manifest, model, encoder, scaler = load_latest(output_dir, model_name)
+    labeled = df[df[target_col].notna()]
+    added = new_rows(labeled, manifest, data_cache)
+    if len(added) < min_new_rows:
+        print(f"[{model_name}] {len(added)} new labeled rows since version {manifest['version']}; nothing to do.")
+        return manifest['version']
+    check_categories(added, encoder, ['crop', 'soil_type'])
+
+    # Out-of-sample error of the current model on the new rows, before they are learned
+    _, X_added = featurize(added, encoder, scaler)
+    before = model.predict(X_added)
+    y_added = added[target_col].to_numpy()
+    mae_before = float(mean_absolute_error(y_added, before))
+    rmse_before = float(np.sqrt(mean_squared_error(y_added, before)))
+
+    # Calibration rows are unseen by the old estimators and left out of the new ones
+    _, calibration_rows = split_calibration(added)
+    fit_rows = labeled.drop(index=calibration_rows.index) if calibration_rows is not None else labeled
+    X, X_scaled = featurize(fit_rows, encoder, scaler)
+    n_before = estimator_count(model)
+    n_new = extra_estimators or max(10, n_before // 10)
+    model = extend_model(model, X_scaled, fit_rows[target_col].to_numpy(), n_new)
+    print(f"[{model_name}] Added {n_new} estimators for {len(added)} new rows "
+          f"(MAE on them before the update: {mae_before:.3f} {units})")
+    if calibration_rows is not None:
+        conformal = calibrate(model, featurize(calibration_rows, encoder, scaler)[1], calibration_rows[target_col].to_numpy())
+    else:
+        conformal = None
+        print(f"[{model_name}] Too few new rows to recalibrate the intervals; this version has no conformal calibration.")
+
+    metrics = {
+        "model": type(model).__name__,
+        "params": {k: v for k, v in model.get_params().items() if k in ('n_estimators', 'iterations', 'max_depth', 'learning_rate', 'depth', 'min_samples_split')},
+        "incremental": {
+            "base_version": manifest['version'],
+            "rows_added": int(len(added)),
+            "estimators_before": n_before,
+            "estimators_added": int(n_new),
+            "new_rows_mae_before": mae_before,
+            "new_rows_rmse_before": rmse_before,
+            "calibration_rows": int(len(calibration_rows)) if calibration_rows is not None else 0,
+        },
+        "feature_importances": model.feature_importances_.tolist() if hasattr(model, 'feature_importances_') else None,
+        "conformal": conformal,
+        "units": units,
+    }
+    # The profile covers every labeled row the extended model has seen
+    profile = build_profile(X[NUMERIC_FEATURES], fit_rows[CATEGORICAL_FEATURES])
+    return export_version(output_dir, model_name, model, encoder, scaler, metrics, X.columns,
+                          extra={'data_cache': data_cache, 'incremental_from': manifest['version']}, profile=profile)
@@ -0,0 +1,328 @@
+"""
+Streaming ingestion of the training CSVs into a compact columnar cache.
+
+Historical uploads (written by the uploadHistoricalCSV tRPC mutation) and the base dataset
+are read in chunks, keeping only the columns training uses. Each chunk gets the column
+aliases (crop_type -> crop, area -> areaSqM) normalized and is deduplicated against a
+sorted array of 64-bit row hashes. The surviving rows are appended to one raw binary file
+per column, alongside a ledger of the ingested files (size, mtime, SHA-256). The cache
+is rebuilt only when a source file changes:
+
+    python -m training.ingest            # build or refresh training_cache/
+"""
+import os
+import glob
+import json
+import uuid
+import shutil
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'training_cache')
+CHUNK_SIZE = 100_000
+CACHE_FORMAT = 5
+
+NUMERIC_COLUMNS = ['rainfall', 'temperature', 'soil_moisture', 'areaSqM', 'yield', 'irrigation_required']
+CATEGORICAL_COLUMNS = ['crop', 'soil_type']
+# Kept for training regional model variants (see training/variants.py), not as features
+REGION_COLUMNS = ['state', 'district']
+# Accepted spellings in uploaded CSVs -> canonical column
+ALIASES = {'crop_type': 'crop', 'area': 'areaSqM'}
+WANTED = set(NUMERIC_COLUMNS) | set(CATEGORICAL_COLUMNS) | set(REGION_COLUMNS) | set(ALIASES) | {'plot_id', 'timestamp'}
+# Strings stay strings; numeric columns are coerced per chunk so one bad cell does not fail the file
+READ_DTYPES = {col: 'string' for col in CATEGORICAL_COLUMNS + REGION_COLUMNS + list(ALIASES) + ['plot_id', 'timestamp']}
+# Columns hashed for rows without a plot_id
+VALUE_COLUMNS = NUMERIC_COLUMNS + CATEGORICAL_COLUMNS + ['timestamp']
+
+
+def source_files(data_path, historical_dir):
+    """
+    Sources in priority order: historical uploads first (sorted by name), then the base dataset.
+    Earlier sources win when rows are deduplicated.
+    """
+    hist_files = sorted(glob.glob(os.path.join(historical_dir, '*.csv'))) if os.path.isdir(historical_dir) else []
+    return hist_files + [data_path]
+
+
+def normalize_chunk(chunk):
+    """
+    Map column aliases onto the canonical names and coerce types for one chunk.
+    A canonical column wins over its alias; the alias fills its missing values.
+    """
+    for alias, canonical in ALIASES.items():
+        if alias in chunk.columns:
+            if canonical in chunk.columns:
+                chunk[canonical] = chunk[canonical].fillna(chunk[alias])
+            else:
+                chunk[canonical] = chunk[alias]
+            chunk = chunk.drop(columns=alias)
+    for col in NUMERIC_COLUMNS:
+        if col in chunk.columns:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype('float64')
+    if 'timestamp' in chunk.columns:
+        chunk['timestamp'] = pd.to_datetime(chunk['timestamp'], errors='coerce')
+    return chunk
+
+
+def row_keys(chunk):
+    """
+    64-bit dedup key per row: the hashed (plot_id, timestamp) where both are present, so a
+    plot keeps one row per reading for the rolling features; the hashed plot_id for rows
+    without a timestamp; otherwise a hash of the row's feature and target values (so rows
+    without a plot_id only drop exact repeats).
+    """
+    # Hashed as strings over every value column, so files with different dtypes or missing columns agree
+    values = chunk.reindex(columns=VALUE_COLUMNS).astype('string')
+    keys = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    if 'plot_id' in chunk.columns:
+        plot_ids = chunk['plot_id']
+        has_id = plot_ids.notna().to_numpy()
+        if has_id.any():
+            # Salted so a plot_id hash cannot collide with a row hash by construction
+            keys[has_id] = pd.util.hash_pandas_object(plot_ids[has_id], index=False, hash_key='plot_id_key_0001').to_numpy()
+        if 'timestamp' in chunk.columns:
+            readings = has_id & chunk['timestamp'].notna().to_numpy()
+            if readings.any():
+                keyed = chunk.loc[readings, ['plot_id', 'timestamp']].astype('string')
+                keys[readings] = pd.util.hash_pandas_object(keyed, index=False, hash_key='reading_key_0001').to_numpy()
+    return keys
+
+
+class _ColumnWriter:
+    """
+    Appends one column to a raw binary file. Categorical columns are stored as int32 codes
+    (-1 for missing) with the category list kept in meta.json.
+    """
+    def __init__(self, directory, name, kind, categories=(), mode='wb'):
+        self.name = name
+        self.kind = kind
+        self.f = open(os.path.join(directory, f'{name}.bin'), mode)
+        self.categories = {c: i for i, c in enumerate(categories)}
+
+    def write(self, values, n):
+        if values is None:
+            values = pd.Series([None] * n, dtype='object')
+        if self.kind == 'numeric':
+            np.asarray(pd.to_numeric(values, errors='coerce'), dtype='float64').tofile(self.f)
+        elif self.kind == 'datetime':
+            np.asarray(pd.to_datetime(values, errors='coerce').astype('int64'), dtype='int64').tofile(self.f)
+        else:
+            local, uniques = pd.factorize(values)
+            if len(uniques):
+                to_global = np.array([self.categories.setdefault(u, len(self.categories)) for u in uniques], dtype='int32')
+                codes = np.where(local >= 0, to_global[np.maximum(local, 0)], -1).astype('int32')
+            else:
+                codes = np.full(n, -1, dtype='int32')
+            codes.tofile(self.f)
+
+    def close(self):
+        self.f.close()
+
+
+_DTYPES = {'numeric': 'float64', 'datetime': 'int64', 'categorical': 'int32'}
+# plot_id is kept (as a categorical) for the per-plot rolling features
+LAYOUT = [(c, 'numeric') for c in NUMERIC_COLUMNS] + [(c, 'categorical') for c in CATEGORICAL_COLUMNS + REGION_COLUMNS + ['plot_id']] \
+    + [('timestamp', 'datetime')]
+
+
+def _ingest_files(directory, paths, meta, chunk_size, mode):
+    """
+    Stream `paths` into the column files in `directory` (mode 'wb' to start over, 'ab' to
+    append), skipping rows whose key is already in keys.npy. Updates `meta` in place.
+    """
+    keys_path = os.path.join(directory, 'keys.npy')
+    seen = np.load(keys_path) if mode == 'ab' else np.empty(0, dtype=np.uint64)
+    writers = [_ColumnWriter(directory, name, kind, meta["categories"].get(name, ()), mode) for name, kind in LAYOUT]
+    present = set(meta["columns"])
+    rows = read = 0
+    try:
+        for path in paths:
+            file_rows = 0
+            reader = pd.read_csv(path, usecols=lambda c: c in WANTED, dtype=READ_DTYPES, chunksize=chunk_size)
+            for chunk in reader:
+                read += len(chunk)
+                chunk = normalize_chunk(chunk)
+                keys = row_keys(chunk)
+                pos = np.minimum(np.searchsorted(seen, keys), max(len(seen) - 1, 0))
+                already = seen[pos] == keys if len(seen) else np.zeros(len(keys), dtype=bool)
+                keep = ~pd.Series(keys).duplicated().to_numpy() & ~already
+                chunk = chunk[keep]
+                if chunk.empty:
+                    continue
+                # Both parts are sorted, so the stable sort is a linear merge
+                seen = np.sort(np.concatenate([seen, np.sort(keys[keep])]), kind='stable')
+                present.update(c for c, _ in LAYOUT if c in chunk.columns)
+                for writer in writers:
+                    writer.write(chunk[writer.name] if writer.name in chunk.columns else None, len(chunk))
+                rows += len(chunk)
+                file_rows += len(chunk)
+            print(f"Ingested {file_rows} new rows from {path}")
+    finally:
+        for writer in writers:
+            writer.close()
+    np.save(keys_path, seen)
+    meta["rows"] += rows
+    meta["rows_read"] += read
+    # Every column file is kept (missing values for absent columns) so later appends stay aligned
+    meta["columns"] = {name: {"kind": kind, "dtype": _DTYPES[kind]} for name, kind in LAYOUT if name in present}
+    meta["categories"] = {w.name: list(w.categories) for w in writers if w.kind == 'categorical'}
+    return rows, read
+
+
+def _write_meta(directory, meta):
+    tmp = os.path.join(directory, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, os.path.join(directory, 'meta.json'))
+
+
+def build_cache(sources, cache_dir=CACHE_DIR, chunk_size=CHUNK_SIZE):
+    """
+    Stream `sources` into a fresh cache at `cache_dir`. Returns the cache metadata.
+    Each rebuild gets a new `generation`, so models trained on an older cache can tell
+    that its rows were renumbered.
+    """
+    tmp_dir = cache_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    meta = {"format": CACHE_FORMAT, "generation": uuid.uuid4().hex, "rows": 0, "rows_read": 0,
+            "sources": [], "columns": {}, "categories": {}}
+    rows, read = _ingest_files(tmp_dir, sources, meta, chunk_size, 'wb')
+    meta["sources"] = ledger_entries(sources)
+    _write_meta(tmp_dir, meta)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.rename(tmp_dir, cache_dir)
+    print(f"Wrote {rows} rows ({read - rows} duplicates dropped) to {cache_dir}")
+    return meta
+
+
+def append_to_cache(paths, cache_dir, meta, all_sources, chunk_size=CHUNK_SIZE):
+    """
+    Append the rows of new source files to an existing cache. Rows already in the cache
+    win over the new files' rows with the same key.
+    """
+    try:
+        rows, read = _ingest_files(cache_dir, paths, meta, chunk_size, 'ab')
+    except BaseException:
+        # Column files may now be longer than meta.json says; force a rebuild next time
+        os.remove(os.path.join(cache_dir, 'meta.json'))
+        raise
+    meta["sources"] = ledger_entries(all_sources, meta["sources"])
+    _write_meta(cache_dir, meta)
+    print(f"Appended {rows} rows ({read - rows} duplicates dropped) to {cache_dir}")
+    return meta
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ledger_entries(paths, previous=()):
+    """
+    Ledger of ingested files: path, size, mtime and SHA-256. Hashes are reused from
+    `previous` when a file's size and mtime did not change.
+    """
+    known = {e["path"]: e for e in previous}
+    out = []
+    for path in paths:
+        st = os.stat(path)
+        entry = {"path": os.path.abspath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        old = known.get(entry["path"])
+        if old and old["size"] == entry["size"] and old["mtime_ns"] == entry["mtime_ns"]:
+            entry["sha256"] = old["sha256"]
+        else:
+            entry["sha256"] = file_sha256(path)
+        out.append(entry)
+    return out
+
+
+def plan_update(meta, sources):
+    """
+    Compare the ledger in `meta` with the current `sources`.
+    Returns ('fresh', []), ('append', new_paths) or ('rebuild', sources).
+    Any changed or removed file means a rebuild; a touched file with the same content does not.
+    """
+    if meta is None or meta.get("format") != CACHE_FORMAT:
+        return 'rebuild', sources
+    current = {e["path"]: e for e in ledger_entries(sources, meta["sources"])}
+    previous = {e["path"]: e for e in meta["sources"]}
+    for path, entry in previous.items():
+        if path not in current or current[path]["sha256"] != entry["sha256"]:
+            return 'rebuild', sources
+    new = [p for p in sources if os.path.abspath(p) not in previous]
+    return ('append', new) if new else ('fresh', [])
+
+
+def read_meta(cache_dir=CACHE_DIR):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_cache(cache_dir=CACHE_DIR, meta=None):
+    """
+    Load the cached columns as a DataFrame. Numeric columns are memory-mapped;
+    categorical columns come back as pandas Categoricals.
+    """
+    meta = meta or read_meta(cache_dir)
+    data = {}
+    for name, col in meta["columns"].items():
+        values = np.memmap(os.path.join(cache_dir, f'{name}.bin'), dtype=col["dtype"], mode='r', shape=(meta["rows"],)) \
+            if meta["rows"] else np.empty(0, dtype=col["dtype"])
+        if col["kind"] == 'categorical':
+            data[name] = pd.Categorical.from_codes(np.asarray(values), categories=meta["categories"][name])
+        elif col["kind"] == 'datetime':
+            data[name] = pd.to_datetime(np.asarray(values).view('datetime64[ns]'))
+        else:
+            data[name] = values
+    return pd.DataFrame(data)
+
+
+def ingest(data_path, historical_dir, cache_dir=CACHE_DIR, chunk_size=CHUNK_SIZE, rebuild=False, append=False,
+           with_meta=False):
+    """
+    Return the deduplicated training rows, updating the cache first if any source changed.
+    By default any change rebuilds the cache, so historical uploads always win over the base
+    dataset. With `append=True`, files that are new since the last run are appended instead
+    and earlier rows keep their positions (used by incremental retraining).
+    With `with_meta=True`, returns (rows, meta).
+    """
+    sources = source_files(data_path, historical_dir)
+    meta = read_meta(cache_dir)
+    action, paths = ('rebuild', sources) if rebuild else plan_update(meta, sources)
+    if action == 'append' and append:
+        meta = append_to_cache(paths, cache_dir, meta, sources, chunk_size)
+    elif action != 'fresh':
+        meta = build_cache(sources, cache_dir, chunk_size)
+    else:
+        if meta["sources"] != ledger_entries(sources, meta["sources"]):
+            # Touched but unchanged files: refresh the mtimes so they are not hashed again
+            meta["sources"] = ledger_entries(sources, meta["sources"])
+            _write_meta(cache_dir, meta)
+        print(f"Using cached training data from {cache_dir} ({meta['rows']} rows)")
+    df = load_cache(cache_dir, meta)
+    return (df, meta) if with_meta else df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the columnar training-data cache.")
+    parser.add_argument('--data', default='app/synthetic_farm_data.csv')
+    parser.add_argument('--historical-dir', default='../historical_uploads')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--rebuild', action='store_true', help='rebuild even if no source changed')
+    args = parser.parse_args(argv)
+    df = ingest(args.data, args.historical_dir, args.cache_dir, args.chunk_size, rebuild=args.rebuild)
+    print(df.describe(include='all').T)
+
+
+if __name__ == '__main__':
+    main()
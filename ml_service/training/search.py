@@ -0,0 +1,195 @@
+"""
+Hyperparameter search strategies for train_yield_irrigation.py.
+
+Every strategy evaluates candidates on the same fixed folds and records each candidate's
+per-fold scores in a `FoldScoreCache`, so the winner's cross-validation score is read
+from the cache instead of being recomputed with a separate cross_val_score run.
+Candidates are fitted in chunks, so a wall-clock budget is checked inside the search and
+not only between model families.
+"""
+import json
+import time
+import functools
+import numpy as np
+from sklearn.base import clone
+from sklearn.model_selection import GridSearchCV, KFold, ParameterGrid, ParameterSampler, cross_val_score
+
+STRATEGIES = ('grid', 'random', 'halving')
+
+
+def make_folds(n_splits=5, seed=42):
+    return KFold(n_splits=n_splits, shuffle=True, random_state=seed)
+
+
+class FoldScoreCache:
+    """
+    Per-fold test scores keyed by (model name, params), for candidates scored on the full
+    folds. Successive halving only adds its final round: earlier rounds train candidates
+    on subsamples of each fold's training rows.
+    """
+    def __init__(self):
+        self._scores = {}
+
+    @staticmethod
+    def _key(name, params):
+        return name, json.dumps(params, sort_keys=True, default=str)
+
+    def get(self, name, params):
+        return self._scores.get(self._key(name, params))
+
+    def add(self, name, params, scores):
+        if not any(np.isnan(scores)):
+            self._scores[self._key(name, params)] = list(scores)
+
+    def __len__(self):
+        return len(self._scores)
+
+
+class SearchResult:
+    def __init__(self, name, best_estimator, best_params, best_score, n_trials, elapsed, exhausted_budget):
+        self.name = name
+        self.best_estimator = best_estimator
+        self.best_params = best_params
+        self.best_score = best_score
+        self.n_trials = n_trials
+        self.elapsed = elapsed
+        self.exhausted_budget = exhausted_budget
+
+
+def _mean_score(scores):
+    # Candidates with a failed or undefined fold score rank last
+    return -np.inf if np.isnan(scores).any() else float(np.mean(scores))
+
+
+def _evaluate(estimator, candidates, X, y, cv, n_splits, scored, deadline=None, first=False, chunk_size=None,
+              scoring='r2', n_jobs=-1):
+    """
+    Score `candidates` on the `cv` splits, appending (params, fold scores) to `scored`.
+    Candidates are fitted in chunks of one GridSearchCV each. Without a deadline there is
+    one chunk. With one, the first chunk is a single candidate (when `first`, it always
+    runs) and each later chunk holds as many candidates as the time left allows at the pace
+    measured so far; the loop stops between chunks once the deadline has passed.
+    Returns False if it stopped before scoring every candidate.
+    """
+    i, per_candidate = 0, None
+    while i < len(candidates):
+        size = chunk_size or len(candidates)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and not (first and i == 0):
+                return False
+            if chunk_size is None:
+                size = 1 if per_candidate is None else max(1, int(remaining / per_candidate))
+        chunk = candidates[i:i + size]
+        started = time.monotonic()
+        search = GridSearchCV(estimator, [{k: [v] for k, v in params.items()} for params in chunk], cv=cv,
+                              scoring=scoring, n_jobs=n_jobs, refit=False, error_score=np.nan)
+        search.fit(X, y)
+        per_candidate = (time.monotonic() - started) / len(chunk)
+        results = search.cv_results_
+        for j, params in enumerate(results['params']):
+            scored.append((params, [float(results[f'split{k}_test_score'][j]) for k in range(n_splits)]))
+        i += len(chunk)
+    return True
+
+
+def _halving_rounds(n_candidates, n_samples, n_splits, factor):
+    """
+    Training rows per round, as HalvingRandomSearchCV with min_resources='exhaust': each
+    round keeps 1/factor of the candidates and trains them on factor times more rows. The
+    last round uses every row.
+    """
+    n_required = 1 + int(np.floor(np.log(n_candidates) / np.log(factor)))
+    min_resources = max(n_splits * 2, n_samples // factor ** (n_required - 1))
+    n_possible = 1 + int(np.floor(np.log(max(n_samples // min_resources, 1)) / np.log(factor)))
+    n_rounds = min(n_required, n_possible)
+    return [min_resources * factor ** i for i in range(n_rounds - 1)] + [n_samples]
+
+
+def _subsample(splits, fraction, rng):
+    # A share of each fold's training rows; the test rows stay whole
+    return [(np.sort(rng.choice(train, max(2, int(len(train) * fraction)), replace=False)), test)
+            for train, test in splits]
+
+
+def run_search(name, estimator, space, X, y, strategy='halving', folds=None, n_trials=20,
+               deadline=None, cache=None, n_jobs=-1, scoring='r2', seed=42, chunk_size=None, factor=3):
+    """
+    Tune `estimator` over `space` (a dict of candidate value lists) with `strategy`:
+
+    - grid: every combination (the previous behaviour).
+    - random: up to `n_trials` sampled combinations.
+    - halving: successive halving over `n_trials` sampled combinations. Each round scores
+      the survivors of the previous one with `factor` times more training rows per fold,
+      and keeps the best 1/factor of them; the last round uses every row.
+
+    Candidates are scored in chunks (see _evaluate). The search stops at `deadline` (a
+    time.monotonic() value) between chunks, with the chunks sized to the time left. A
+    deadline never stops the first candidate, so at worst the budget is exceeded by one
+    candidate's cross-validation and the refit of the winner. A halving search cut short
+    picks the best candidate of its last round that scored any.
+    Returns a SearchResult.
+    """
+    folds = folds or make_folds()
+    n_splits = folds.get_n_splits()
+    start = time.monotonic()
+    splits = list(folds.split(X, y))
+    evaluate = functools.partial(_evaluate, estimator, X=X, y=y, n_splits=n_splits, deadline=deadline,
+                                 chunk_size=chunk_size, scoring=scoring, n_jobs=n_jobs)
+    if strategy in ('grid', 'random'):
+        if strategy == 'grid':
+            candidates = list(ParameterGrid(space))
+        else:
+            candidates = list(ParameterSampler(space, n_iter=min(n_trials, _space_size(space)), random_state=seed))
+        final = []
+        evaluate(candidates, cv=splits, scored=final, first=True)
+        n_total, on_full_folds = len(final), True
+    elif strategy == 'halving':
+        candidates = list(ParameterSampler(space, n_iter=min(n_trials, _space_size(space)), random_state=seed))
+        rng = np.random.RandomState(seed)
+        rounds = _halving_rounds(len(candidates), len(X), n_splits, factor)
+        final, n_total, on_full_folds = [], 0, False
+        for i, n_rows in enumerate(rounds):
+            last = i == len(rounds) - 1
+            scored = []
+            complete = evaluate(candidates, cv=splits if last else _subsample(splits, n_rows / len(X), rng),
+                                scored=scored, first=i == 0)
+            n_total += len(scored)
+            if scored:
+                # Scores of earlier rounds come from subsamples and are not cached
+                final, on_full_folds = scored, last
+            if not complete or last:
+                break
+            ranked = sorted(scored, key=lambda item: _mean_score(item[1]), reverse=True)
+            candidates = [params for params, _ in ranked[:int(np.ceil(len(ranked) / factor))]]
+    else:
+        raise ValueError(f"Unknown search strategy {strategy!r}; expected one of {STRATEGIES}")
+
+    if cache is not None and on_full_folds:
+        for params, scores in final:
+            cache.add(name, params, scores)
+    best_params, best_scores = max(final, key=lambda item: _mean_score(item[1]))
+    best_estimator = clone(estimator).set_params(**best_params).fit(X, y)
+    elapsed = time.monotonic() - start
+    exhausted = deadline is not None and time.monotonic() >= deadline
+    return SearchResult(name, best_estimator, best_params, _mean_score(best_scores), n_total, elapsed, exhausted)
+
+
+def cv_scores(name, estimator, params, X, y, folds, cache=None, scoring='r2', n_jobs=-1):
+    """
+    Fold scores for the chosen candidate: from `cache` when the search already evaluated
+    it, otherwise computed on the same folds.
+    Returns (scores, from_cache).
+    """
+    if cache is not None:
+        scores = cache.get(name, params)
+        if scores is not None:
+            return np.asarray(scores), True
+    return cross_val_score(clone(estimator), X, y, cv=folds, scoring=scoring, n_jobs=n_jobs), False
+
+
+def _space_size(space):
+    size = 1
+    for values in space.values():
+        size *= len(values)
+    return size
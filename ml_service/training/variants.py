@@ -0,0 +1,81 @@
+"""
+Training of regional and per-crop model variants.
+
+With `--variants district,state,crop` the trainer also fits each model on the labeled rows
+of every district, state or crop with at least `--min-variant-rows` of them. Each fit is
+exported as its own versioned model (e.g. `yield__state_punjab`). The variants are then
+listed in `<name>_variants.json`, which the service routes requests by (see app/variants.py).
+Variants are always refit from scratch. Groups that fall below the threshold are dropped
+from the index, and their old artifacts stay on disk like any superseded version.
+"""
+import pandas as pd
+from app.manifest import write_variant_index
+from app.models.base import CATEGORICAL_FEATURES
+from app.variants import DIMENSIONS, variant_name
+
+COLUMNS = {'district': ('state', 'district'), 'state': ('state',), 'crop': ('crop',)}
+
+
+def _normalized(values):
+    # Vectorized app.variants.normalize: collapse whitespace and casefold, keeping missing values
+    return values.astype('string').str.split().str.join(' ').str.casefold()
+
+
+def region_keys(df, dimension):
+    """
+    The routing key of every row for `dimension` (as app.variants.region_key), or None if
+    the rows lack its columns.
+    """
+    if any(col not in df.columns for col in COLUMNS[dimension]):
+        return None
+    if dimension == 'district':
+        return _normalized(df['state']) + '/' + _normalized(df['district'])
+    return _normalized(df[COLUMNS[dimension][0]])
+
+
+def train_variants(df, targets, dimensions, min_rows, fit, output_dir):
+    """
+    Train and export the variants of every target and rewrite each model's variant index.
+    `fit(rows, target, model_name)` trains and exports one model and returns its version.
+    Returns {model name: [index entries]}.
+    """
+    unknown = [d for d in dimensions if d not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown variant dimensions {unknown}; expected some of {list(DIMENSIONS)}")
+    indexes = {}
+    for target in targets:
+        target_col, model_name = target[0], target[1]
+        if target_col not in df.columns:
+            continue
+        labeled = df[df[target_col].notna()]
+        entries = []
+        for dimension in dimensions:
+            keys = region_keys(labeled, dimension)
+            if keys is None:
+                print(f"[{model_name}] No {'/'.join(COLUMNS[dimension])} column in the training data; "
+                      f"skipping {dimension} variants.")
+                continue
+            for key, rows in labeled.groupby(keys, sort=True):
+                if len(rows) < min_rows:
+                    print(f"[{model_name}] {dimension} {key!r}: {len(rows)} labeled rows, below {min_rows}; no variant.")
+                    continue
+                name = variant_name(model_name, dimension, key)
+                print(f"\n[{model_name}] Training variant {name} on {len(rows)} rows...")
+                version = fit(rows, target, name)
+                if version is None:
+                    continue
+                value_col = COLUMNS[dimension][-1]
+                entries.append({
+                    'name': name,
+                    'dimension': dimension,
+                    'key': key,
+                    'value': str(rows[value_col].mode().iloc[0]),
+                    'rows': len(rows),
+                    'version': version,
+                    # The variant can only serve rows of crops and soil types it was trained on
+                    'categories': {col: sorted(map(str, pd.unique(rows[col].dropna()))) for col in CATEGORICAL_FEATURES},
+                })
+        write_variant_index(output_dir, model_name, entries)
+        print(f"[{model_name}] {len(entries)} variants listed in the variant index")
+        indexes[model_name] = entries
+    return indexes